@@ -3,14 +3,18 @@ set -eufx pipefail
 cd "$(dirname "$0")"
 function clean {
   find ./monitoring/backup/influxdb -mindepth 1 -delete
-  rm -f ./monitoring/backup/grafana.db
+  rm -f ./monitoring/backup/grafana.db ./monitoring/backup/state.sqlite ./monitoring/backup/aggregation.sqlite
 }
 
 function backup {
   docker exec influxdb influxd backup -portable /tmp/backup
   # Backup grafana data
   sqlite3 monitoring/grafana/grafana.db ".backup './monitoring/backup/grafana.db'"
-  cp ./monitoring/parser/settings.json ./monitoring/backup/settings.json
+  sqlite3 monitoring/parser/state.sqlite ".backup './monitoring/backup/state.sqlite'"
+  # Windows that are still open, only there when aggregation is enabled
+  if [ -f monitoring/parser/aggregation.sqlite ]; then
+    sqlite3 monitoring/parser/aggregation.sqlite ".backup './monitoring/backup/aggregation.sqlite'"
+  fi
 }
 
 function upload {
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+"""
+Generates hourly log files like the ones log-offload uploads, from the fixtures in test/data.
+
+    python -m benchmark.generator --output /tmp/logs --size 2G --files 2
+"""
+import argparse
+import copy
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'test', 'data')
+START_DATE = datetime(2018, 10, 2, 7)
+# Like log_parser.bizz.get_log_folder
+LOG_FOLDER_FORMAT = '%Y-%m-%d %H:00:00'
+# Replaced by the timestamp of every generated line
+TIMESTAMP_PLACEHOLDER = 1234567890.123456
+# Service hashes of the api lines. The benchmarks resolve them with a fake service-app endpoint.
+SERVICE_HASHES = ['service-%02d@rogerth.at' % i for i in range(20)]
+
+# Relative amount of lines of every kind, per 1000 lines
+DEFAULT_MIX = {
+    'callback_api': 300,
+    'api': 100,
+    'app': 250,
+    'request_log': 150,
+    '_request': 50,
+    'snapshot': 20,
+    'web_channel': 95,
+    'truncated': 30,
+    'huge_app': 5,
+}
+# Larger than analyzer.settings.projection_min_size
+HUGE_APP_SIZE = 128 * 1024
+
+
+def _load(filename: str) -> dict:
+    with open(os.path.join(DATA_DIR, filename), 'r') as f:
+        return json.load(f)
+
+
+def _with_placeholder(value: dict) -> dict:
+    value = copy.deepcopy(value)
+    if 'timestamp' not in value:
+        return value
+    # First, so lines that are truncated still have it
+    del value['timestamp']
+    return dict({'timestamp': TIMESTAMP_PLACEHOLDER}, **value)
+
+
+def _offload_request_log(value: dict) -> dict:
+    """A RequestLog of which one of the app logs is written with the '[OFFLOAD] ' prefix"""
+    request_log = _load('full-request-log.json')
+    request_log['protoPayload']['line'].append({'logMessage': '[OFFLOAD] ' + json.dumps(value)})
+    return request_log
+
+
+def _huge_app(size: int) -> dict:
+    value = _with_placeholder(_load('app-log.json'))
+    calls = value['request_data']['c']
+    call_size = len(json.dumps(calls[0]))
+    value['request_data']['c'] = [calls[i % len(calls)] for i in range(max(1, size // call_size))]
+    return value
+
+
+def get_templates(huge_app_size: int = HUGE_APP_SIZE) -> Dict[str, List[str]]:
+    """Returns serialized lines for every kind, in which TIMESTAMP_PLACEHOLDER is replaced by the actual timestamp"""
+    callbacks = [_with_placeholder(_load(filename))
+                 for filename in ('callback-api.json', 'callback-api-loyalty.json', 'sandwich-callback.json',
+                                  'sandwich-fmr.json', 'callback-api-bad-tag.json')]
+    apps = [_with_placeholder(_load(filename)) for filename in ('app-log.json', 'test-str-time.json')]
+    apis = []
+    for service_hash in SERVICE_HASHES:
+        api = _with_placeholder(_load('api.json'))
+        api['user'] = service_hash
+        apis.append(api)
+    templates = {
+        'callback_api': callbacks,
+        'api': apis,
+        'app': apps,
+        'request_log': [_load('full-request-log.json'), _load('test-log-task.json'),
+                        _offload_request_log(callbacks[0]), _offload_request_log(apps[0])],
+        '_request': [_load('request-log.json')],
+        'snapshot': [_with_placeholder(_load(filename))
+                     for filename in ('created-apps.json', 'total-users.json', 'total-services.json',
+                                      'active-modules.json', 'oca-custom-loyalty-cards.json')],
+        'web_channel': [_with_placeholder(_load('channel.json'))],
+        'huge_app': [_huge_app(huge_app_size)],
+    }
+    serialized = {kind: [json.dumps(value) for value in values] for kind, values in templates.items()}
+    # Cut off like App Engine does with messages that are too long
+    serialized['truncated'] = [line[:int(len(line) * fraction)]
+                               for line in serialized['callback_api'] + serialized['app'] for fraction in (0.7, 0.9)]
+    return serialized
+
+
+def generate_file(path: str, size: int, start: datetime, mix: Dict[str, int], rng: random.Random,
+                  templates: Dict[str, List[str]]) -> int:
+    """Writes lines to path until it's at least size bytes. Returns the amount of lines."""
+    kinds = sorted(kind for kind in mix if mix[kind])
+    weights = [mix[kind] for kind in kinds]
+    start_timestamp = (start - datetime(1970, 1, 1)).total_seconds()
+    placeholder = repr(TIMESTAMP_PLACEHOLDER)
+    written = 0
+    line_count = 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        while written < size:
+            for kind in rng.choices(kinds, weights, k=1000):
+                timestamp = repr(round(start_timestamp + rng.random() * 3600, 6))
+                line = rng.choice(templates[kind]).replace(placeholder, timestamp) + '\n'
+                written += f.write(line)
+                line_count += 1
+                if written >= size:
+                    break
+    return line_count
+
+
+def generate(output_directory: str, size: int, file_count: int = 1, mix: Dict[str, int] = None, seed: int = 0,
+             huge_app_size: int = HUGE_APP_SIZE) -> List[str]:
+    """
+    Generates file_count files of about size bytes each in output_directory, one per hour like the log folders in the
+    buckets. Returns their names relative to output_directory.
+    """
+    rng = random.Random(seed)
+    templates = get_templates(huge_app_size)
+    names = []
+    for i in range(file_count):
+        name = '%s/logs.json' % (START_DATE + timedelta(hours=i)).strftime(LOG_FOLDER_FORMAT)
+        generate_file(os.path.join(output_directory, name), size, START_DATE + timedelta(hours=i), mix or DEFAULT_MIX,
+                      rng, templates)
+        names.append(name)
+    return names
+
+
+def parse_size(size: str) -> int:
+    """Parses sizes like 512K, 100M or 2G"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parses proportions like callback_api=5,app=3. Kinds that aren't mentioned keep their default proportion."""
+    result = dict(DEFAULT_MIX)
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('Unknown kind of line %s, expected one of %s' %
+                                             (kind, sorted(DEFAULT_MIX)))
+        result[kind] = int(weight)
+    return result
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--size', type=parse_size, default='50M', help='Size of every file, like 100M or 2G')
+    parser.add_argument('--files', type=int, default=1, help='Amount of hourly files')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Proportions of the kinds of lines, like callback_api=5,app=3. Kinds: %s'
+                             % ', '.join(sorted(DEFAULT_MIX)))
+    parser.add_argument('--huge-app-size', type=parse_size, default=HUGE_APP_SIZE, help='Size of the huge app lines')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates log files for the benchmarks')
+    parser.add_argument('--output', required=True, help='Directory in which the files are written')
+    add_arguments(parser)
+    args = parser.parse_args()
+    for name in generate(args.output, args.size, args.files, args.mix, args.seed, args.huge_app_size):
+        print(os.path.join(args.output, name))
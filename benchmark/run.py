@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+"""
+Measures the throughput of the parser on generated log files.
+
+    python -m benchmark.run --size 200M --files 4
+    python -m benchmark.run --scenario analyze --save-baseline
+
+Scenarios:
+    analyze         analyzer.analyze on every line, without prefilter
+    process_logs    bizz.process_logs on every file, from a fake bucket to a fake InfluxDB
+    process         the main loop of log_parser.process with a pool of worker processes, until every file is done
+Every scenario runs in a separate process, so the peak RSS is its own.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmark.fakes import FakeInfluxDBServer
+from benchmark.generator import SERVICE_HASHES, add_arguments, generate
+from test.fakes import FakeBucket, FakeServiceAppServer
+
+SCENARIOS = ['analyze', 'process_logs', 'process']
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+BUCKET_NAME = 'benchmark'
+# Seconds between checks for finished files in the process scenario
+BENCHMARK_POLL_INTERVAL = 1
+# Results where higher is better. For the others, lower is better.
+THROUGHPUT_METRICS = ['lines_per_second', 'points_per_second', 'megabytes_per_second']
+REPORTED_METRICS = THROUGHPUT_METRICS + ['peak_rss_mb']
+
+
+class FakeStorageClient(object):
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self.root_dir, name)
+
+
+def _get_peak_rss_mb() -> float:
+    # Kilobytes on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / 1024, 1)
+
+
+def _count_lines(paths: List[str]) -> int:
+    count = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                count += block.count(b'\n')
+    return count
+
+
+def _run_analyze(data_directory: str, names: List[str], work_directory: str, args: argparse.Namespace) -> int:
+    from log_parser.analyzer import analyze
+    from log_parser.resolver import get_resolver
+    points = 0
+    for name in names:
+        with open(os.path.join(data_directory, name), 'rb') as f:
+            for line in f:
+                try:
+                    for _ in analyze(line):
+                        points += 1
+                except Exception:
+                    # Like bizz.process_lines
+                    pass
+    resolver = get_resolver()
+    return points + len(resolver.drain(resolver.config.wait))
+
+
+def _run_process_logs(data_directory: str, names: List[str], work_directory: str, args: argparse.Namespace,
+                      influxdb: FakeInfluxDBServer) -> int:
+    from influxdb import InfluxDBClient
+    from log_parser.bizz import process_logs
+    from log_parser.prefilter import Prefilter
+    client = InfluxDBClient(host=influxdb.host, port=influxdb.port, database=BUCKET_NAME)
+    bucket = FakeBucket(data_directory, BUCKET_NAME)
+    for name in names:
+        process_logs(os.path.join(work_directory, 'data'), client, bucket, name, Prefilter(), args.stream_chunk_size)
+    return influxdb.lines
+
+
+def _run_process(data_directory: str, names: List[str], work_directory: str, args: argparse.Namespace,
+                 influxdb: FakeInfluxDBServer) -> int:
+    import log_parser
+    from log_parser import bizz
+    from log_parser.config import LogParserConfig
+    from log_parser.db import DatabaseConnection
+    # Processes started with spawn use spawn for their own children as well. The service forks its pool, so that the
+    # workers use the fake bucket too.
+    multiprocessing.set_start_method('fork', force=True)
+    bizz.storage_client = FakeStorageClient(data_directory)
+    log_parser.get_gcs_bucket = FakeStorageClient(data_directory).bucket
+    configuration = LogParserConfig({
+        'buckets': [BUCKET_NAME],
+        'influxdb': {'host': influxdb.host, 'port': influxdb.port, 'db': BUCKET_NAME},
+        'resolver': vars(args.resolver),
+        'stream_chunk_size': args.stream_chunk_size,
+        'chunk_size': args.chunk_size,
+    })
+    log_parser.process(configuration, DatabaseConnection(work_directory), args.processes, until_done=True,
+                       poll_interval=BENCHMARK_POLL_INTERVAL)
+    return influxdb.lines
+
+
+def run_scenario(scenario: str, data_directory: str, names: List[str], args: argparse.Namespace) -> Dict:
+    """Runs a single scenario in the current process and returns its results"""
+    from log_parser import resolver
+    from log_parser.config import ResolverConfig
+    # Imported modules configure logging to debug
+    logging.getLogger().setLevel(logging.WARNING)
+    work_directory = tempfile.mkdtemp()
+    try:
+        with FakeServiceAppServer({h: 'app-%d' % i for i, h in enumerate(SERVICE_HASHES)}) as service_apps, \
+                FakeInfluxDBServer() as influxdb:
+            args.resolver = ResolverConfig({'url': service_apps.url,
+                                            'cache_path': os.path.join(work_directory, 'service_apps.sqlite')})
+            resolver.configure(args.resolver)
+            start = time.perf_counter()
+            if scenario == 'analyze':
+                points = _run_analyze(data_directory, names, work_directory, args)
+            elif scenario == 'process_logs':
+                points = _run_process_logs(data_directory, names, work_directory, args, influxdb)
+            else:
+                points = _run_process(data_directory, names, work_directory, args, influxdb)
+            seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_directory)
+    paths = [os.path.join(data_directory, name) for name in names]
+    lines = _count_lines(paths)
+    size = sum(os.path.getsize(path) for path in paths)
+    return {
+        'lines': lines,
+        'points': points,
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'lines_per_second': round(lines / seconds),
+        'points_per_second': round(points / seconds),
+        'megabytes_per_second': round(size / seconds / 1024 ** 2, 2),
+        'peak_rss_mb': _get_peak_rss_mb(),
+    }
+
+
+def _run_scenario_in_process(scenario: str, data_directory: str, names: List[str], args: argparse.Namespace,
+                             results: multiprocessing.Queue) -> None:
+    results.put(run_scenario(scenario, data_directory, names, args))
+
+
+def run_isolated(scenario: str, data_directory: str, names: List[str], args: argparse.Namespace) -> Dict:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_scenario_in_process, args=(scenario, data_directory, names, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def compare(results: Dict[str, Dict], baselines: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Prints the results next to the baselines. Returns the metrics that regressed more than tolerance."""
+    regressions = []
+    print('%-14s %-22s %14s %14s %8s' % ('scenario', 'metric', 'result', 'baseline', 'change'))
+    for scenario, result in results.items():
+        baseline = baselines.get(scenario, {})
+        for metric in REPORTED_METRICS:
+            if not baseline.get(metric):
+                print('%-14s %-22s %14s %14s' % (scenario, metric, result[metric], '-'))
+                continue
+            change = result[metric] / baseline[metric] - 1
+            regressed = -change > tolerance if metric in THROUGHPUT_METRICS else change > tolerance
+            if regressed:
+                regressions.append('%s %s' % (scenario, metric))
+            print('%-14s %-22s %14s %14s %+7.1f%%%s' % (scenario, metric, result[metric], baseline[metric],
+                                                        change * 100, ' REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the log parser on generated log files',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--data', help='Directory with files of an earlier run of benchmark.generator. '
+                                       'Files are generated in a temporary directory when not set.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Worker processes of "process"')
+    parser.add_argument('--stream-chunk-size', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINES_PATH, help='File with the baselines')
+    parser.add_argument('--save-baseline', action='store_true', help='Stores the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative change of a metric that counts as a regression')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    data_directory = args.data or tempfile.mkdtemp()
+    try:
+        if args.data:
+            names = sorted(os.path.relpath(os.path.join(directory, filename), data_directory)
+                           for directory, _, filenames in os.walk(data_directory) for filename in filenames
+                           if filename.endswith('.json'))
+        else:
+            names = generate(data_directory, args.size, args.files, args.mix, args.seed, args.huge_app_size)
+        results = {scenario: run_isolated(scenario, data_directory, names, args) for scenario in args.scenario}
+    finally:
+        if not args.data:
+            shutil.rmtree(data_directory)
+
+    baselines = {}  # type: Dict[str, Dict]
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines, args.tolerance)
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if regressions:
+        print('Regressions: %s' % ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
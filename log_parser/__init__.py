@@ -20,18 +20,23 @@ import json
 import logging
 import os
 import time
-from collections import defaultdict
+from functools import partial
 from multiprocessing import SimpleQueue
 from multiprocessing.pool import Pool
-from typing import Tuple
+from typing import Tuple, Union, List, Dict
 
 import urllib3
 from google.cloud import storage
 from influxdb import InfluxDBClient
 
-from log_parser.bizz import process_logs, get_new_files_to_process
+from log_parser.bizz import process_logs, get_new_files_to_process, download_log, get_line_ranges, process_log_range, \
+    compact_history
 from log_parser.config import LogParserConfig
 from log_parser.db import DatabaseConnection
+from log_parser.models import LogParserFile
+from log_parser.prefilter import Prefilter
+from log_parser.scheduler import Scheduler
+from log_parser import aggregation, analyzer, profiling, resolver, snapshots, stats, writer
 
 logging.basicConfig(format='%(levelname)-8s %(process)s %(asctime)s,%(msecs)3.0f [%(filename)s:%(lineno)d] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S',
@@ -40,7 +45,21 @@ logging.getLogger('urllib3').setLevel(logging.WARNING)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 CURRENT_DIR = os.path.dirname(__file__)
 
-finished_queue = SimpleQueue()
+finished_queue = SimpleQueue()  # type: SimpleQueue
+# Seconds between checks for finished files while files are waiting for a place in the pool
+SCHEDULER_POLL_INTERVAL = 5
+
+
+class ChunkedFile(object):
+    def __init__(self, disk_path: str, remaining: int) -> None:
+        self.disk_path = disk_path
+        self.remaining = remaining
+        self.success = True
+
+
+# Files that are processed in chunks and still have ranges to process, by bucket and file name.
+# Only used from the thread of the pool that handles the results.
+chunked_files = {}  # type: Dict[Tuple[str, str], ChunkedFile]
 
 
 def get_client(config: LogParserConfig) -> InfluxDBClient:
@@ -66,12 +85,26 @@ def get_gcs_bucket(cloudstorage_bucket):
     return storage_client.bucket(cloudstorage_bucket)
 
 
-def process_file(bucket_name: str, file_name: str, download_directory: str, influxdb_client: InfluxDBClient) -> Tuple[
-    bool, str, str]:
+def get_prefilter(configuration: LogParserConfig) -> Union[Prefilter, None]:
+    if not configuration.prefilter.enabled:
+        return None
+    return Prefilter(configuration.prefilter.skip_types, configuration.prefilter.skip_untyped)
+
+
+def process_file(bucket_name: str, file_name: str, download_directory: str, influxdb_client: InfluxDBClient,
+                 configuration: LogParserConfig) -> Tuple[bool, str, str]:
     """Processes the file in a separate process."""
     try:
+        writer.configure(configuration.influxdb)
+        analyzer.configure(configuration.decode)
+        resolver.configure(configuration.resolver)
+        stats.configure(configuration.stats)
+        aggregation.configure(configuration.aggregation)
+        snapshots.configure(configuration.snapshots)
         cloudstorage_bucket = get_gcs_bucket(bucket_name)
-        process_logs(download_directory, influxdb_client, cloudstorage_bucket, file_name)
+        with profiling.profile(configuration.profiling, bucket_name, file_name):
+            process_logs(download_directory, influxdb_client, cloudstorage_bucket, file_name,
+                         get_prefilter(configuration), configuration.stream_chunk_size)
         return True, bucket_name, file_name
     except Exception as e:
         logging.error('Failed to process file %s', file_name)
@@ -79,6 +112,69 @@ def process_file(bucket_name: str, file_name: str, download_directory: str, infl
         return False, bucket_name, file_name
 
 
+def split_file(bucket_name: str, file_name: str, download_directory: str, configuration: LogParserConfig) -> Tuple[
+    bool, str, str, Union[str, None], List[Tuple[int, int]]]:
+    """Downloads the file and splits it in ranges of lines in a separate process."""
+    try:
+        stats.configure(configuration.stats)
+        cloudstorage_bucket = get_gcs_bucket(bucket_name)
+        disk_path = download_log(download_directory, cloudstorage_bucket, file_name)
+        return True, bucket_name, file_name, disk_path, get_line_ranges(disk_path, configuration.chunk_size)
+    except Exception as e:
+        logging.error('Failed to download file %s', file_name)
+        logging.exception(e)
+        return False, bucket_name, file_name, None, []
+
+
+def process_file_range(bucket_name: str, file_name: str, disk_path: str, start: int, end: int,
+                       influxdb_client: InfluxDBClient, configuration: LogParserConfig) -> Tuple[bool, str, str]:
+    """Processes a range of lines of a downloaded file in a separate process."""
+    try:
+        writer.configure(configuration.influxdb)
+        analyzer.configure(configuration.decode)
+        resolver.configure(configuration.resolver)
+        stats.configure(configuration.stats)
+        aggregation.configure(configuration.aggregation)
+        snapshots.configure(configuration.snapshots)
+        with profiling.profile(configuration.profiling, bucket_name, file_name, '.%d-%d' % (start, end)):
+            process_log_range(influxdb_client, disk_path, start, end, get_prefilter(configuration))
+        return True, bucket_name, file_name
+    except Exception as e:
+        logging.error('Failed to process bytes %s to %s of file %s', start, end, file_name)
+        logging.exception(e)
+        return False, bucket_name, file_name
+
+
+def after_split(pool: Pool, influxdb_client: InfluxDBClient, configuration: LogParserConfig,
+                split_result: Tuple[bool, str, str, Union[str, None], List[Tuple[int, int]]]) -> None:
+    success, bucket_name, filename, disk_path, ranges = split_result
+    if not success or not ranges or not disk_path:
+        if disk_path:
+            os.remove(disk_path)
+        after_processed((success, bucket_name, filename))
+        return
+    logging.info('%s: Processing file %s in %s chunks', bucket_name, filename, len(ranges))
+    chunked_files[(bucket_name, filename)] = ChunkedFile(disk_path, len(ranges))
+    for start, end in ranges:
+        pool.apply_async(process_file_range,
+                         (bucket_name, filename, disk_path, start, end, influxdb_client, configuration), {},
+                         after_range_processed, after_error)
+
+
+def after_range_processed(processed_range: Tuple[bool, str, str]) -> None:
+    success, bucket_name, filename = processed_range
+    chunked_file = chunked_files[(bucket_name, filename)]
+    chunked_file.remaining -= 1
+    chunked_file.success = chunked_file.success and success
+    if chunked_file.remaining:
+        return
+    del chunked_files[(bucket_name, filename)]
+    # The file is kept on disk when it failed, so it doesn't have to be downloaded again for the retry
+    if chunked_file.success:
+        os.remove(chunked_file.disk_path)
+    after_processed((chunked_file.success, bucket_name, filename))
+
+
 def after_processed(processed_file: Tuple[bool, str, str]) -> None:
     success, bucket_name, filename = processed_file
     if success:
@@ -94,49 +190,98 @@ def after_error(result):
     logging.exception(result)
 
 
-def process(configuration: LogParserConfig, db: DatabaseConnection, process_count: int):
+def submit(pool: Pool, influxdb_client: InfluxDBClient, configuration: LogParserConfig, dl_dir: str,
+           file: LogParserFile) -> None:
+    if configuration.chunk_size:
+        pool.apply_async(split_file, (file.bucket, file.name, dl_dir, configuration), {},
+                         partial(after_split, pool, influxdb_client, configuration), after_error)
+    else:
+        pool.apply_async(process_file, (file.bucket, file.name, dl_dir, influxdb_client, configuration),
+                         {}, after_processed, after_error)
+
+
+def write_stats(influxdb_client: InfluxDBClient, scheduler: Scheduler) -> None:
+    """Writes the statistics of the main process, like the time spent listing files and the amount of waiting files"""
+    process_stats = stats.get_stats()
+    if not process_stats.due:
+        return
+    process_stats.set_gauge('files_queued', len(scheduler.queued))
+    process_stats.set_gauge('files_in_flight', scheduler.in_flight_count)
+    lines = process_stats.flush_lines()
+    if not lines:
+        return
+    try:
+        writer.save_statistic_entries(influxdb_client, lines)
+    except Exception:
+        logging.exception('Failed to write the statistics of the main process')
+
+
+def process(configuration: LogParserConfig, db: DatabaseConnection, process_count: int, until_done: bool = False,
+            poll_interval: float = SCHEDULER_POLL_INTERVAL):
+    """
+    Processes new files forever, or until every file that was found in the first listing is done.
+    While files are waiting for a place in the pool, finished files are checked every poll_interval seconds.
+    """
+    writer.configure(configuration.influxdb)
+    stats.configure(configuration.stats)
     influxdb_client = get_client(configuration)
     pool = Pool(process_count)
-    currently_processing = defaultdict(list)
+    scheduler = Scheduler(configuration.scheduler, process_count)
     dl_dir = os.path.join(db.root_dir, 'data')
+    if not configuration.resolver.cache_path:
+        configuration.resolver.cache_path = os.path.join(db.root_dir, 'service_apps.sqlite')
+    if not configuration.aggregation.state_path:
+        configuration.aggregation.state_path = os.path.join(db.root_dir, 'aggregation.sqlite')
+    if not configuration.snapshots.state_path:
+        configuration.snapshots.state_path = os.path.join(db.root_dir, 'snapshots.sqlite')
+    default_profiling = configuration.profiling
+    last_listing = 0.0
 
     while True:
-        logging.info('Checking for new files to process')
-        settings = db.get_settings()
-        new_files = get_new_files_to_process(configuration.buckets, settings)
-        settings.files.extend(new_files)
+        profiling_config = profiling.load_profiling_config(db.root_dir, default_profiling)
+        if vars(profiling_config) != vars(configuration.profiling):
+            logging.info('Profiling files with the settings %s', vars(profiling_config))
+            configuration.profiling = profiling_config
+        if time.time() - last_listing >= configuration.interval and not (until_done and last_listing):
+            logging.info('Checking for new files to process')
+            last_listing = time.time()
+            new_files, watermarks = get_new_files_to_process(configuration.buckets, db, configuration.listing_overlap)
+            db.add_files(new_files, watermarks)
         timestamp = int(time.time())
-        completed_files = defaultdict(list)
-        # Empty queue of finished work and create a lists of all completed files per bucket
-        while True:
-            if finished_queue.empty():
-                break
+        completed_count = 0
+        # Empty queue of finished work and set the processed timestamp on the completed files
+        while not finished_queue.empty():
             success, bucket, filename = finished_queue.get()
-            currently_processing[bucket].remove(filename)
+            scheduler.done(bucket, filename)
             if success:
-                completed_files[bucket].append(filename)
-        # Set processed timestamp on processed files
-        for file in settings.files:
-            if file.name in completed_files[file.bucket]:
-                file.processed_timestamp = timestamp
-        logging.info('%d files completed processing since last loop', sum(len(l) for l in completed_files.values()))
-        completed_files.clear()
-        db.save_settings(settings)
-        added = 0
-        for file in settings.files:
-            if file.processed_timestamp is None and file.name not in currently_processing[file.bucket]:
-                currently_processing[file.bucket].append(file.name)
-                pool.apply_async(process_file, (file.bucket, file.name, dl_dir, influxdb_client), {}, after_processed,
-                                 after_error)
-                added += 1
-        processing_count = sum(len(l) for l in currently_processing.values())
-        if added:
-            logging.info('Added %s files to pool, %s files currently processing.', added, processing_count)
+                db.set_processed(bucket, filename, timestamp)
+                completed_count += 1
+        if completed_count:
+            logging.info('%d files completed processing since last loop', completed_count)
+        if configuration.compaction_horizon:
+            compact_history(db, max(configuration.compaction_horizon, configuration.listing_overlap))
+        # Failed files are still unprocessed, so they are queued again
+        for file in db.get_unprocessed_files():
+            scheduler.add(file)
+        started = scheduler.next_files()
+        for file in started:
+            submit(pool, influxdb_client, configuration, dl_dir, file)
+        write_stats(influxdb_client, scheduler)
+        if started:
+            logging.info('Added %s files to pool%s, %s files currently processing, %s waiting.', len(started),
+                         ' (largest first)' if scheduler.backfilling else '', scheduler.in_flight_count,
+                         len(scheduler.queued))
+        elif until_done and not scheduler.in_flight_count:
+            pool.close()
+            pool.join()
+            return
+        elif scheduler.queued or until_done:
+            # Wait for a place in the pool
+            time.sleep(poll_interval)
         else:
-            logging.info('Nothing new to process, sleeping %s seconds. %s files currently in queue to be processed.',
-                         configuration.interval, processing_count)
+            logging.info('Nothing new to process, sleeping %s seconds. %s files currently processing.',
+                         configuration.interval, scheduler.in_flight_count)
             time.sleep(configuration.interval)
-            continue
 
 
 if __name__ == '__main__':
@@ -145,5 +290,22 @@ if __name__ == '__main__':
     parser.add_argument('--processes', type=int, help='Number of processes to use', default=os.cpu_count())
     parser.add_argument('--data_path', type=str, help='Path where the data will be stored. Defaults to ../parser',
                         default=os.path.join(CURRENT_DIR, '..', 'parser'))
+    parser.add_argument('--profile', action='append', metavar='PATTERN',
+                        help='Profile the files that match the pattern, like "bucket/2018-10-02 *". Can be repeated.')
+    parser.add_argument('--profile-sample', type=float, default=0.0, metavar='FRACTION',
+                        help='Profile this fraction of the files')
+    parser.add_argument('--profile-worker', type=int, default=0, metavar='PID',
+                        help='Profile every file of the worker process with this process id')
+    parser.add_argument('--profile-off', action='store_true',
+                        help='Stop profiling files, also the ones in the configuration')
+    parser.add_argument('--update-profiling', action='store_true',
+                        help='Only change the profiling settings of the log parser that is running with this data path')
     args = parser.parse_args()
-    main(args.processes, args.data_path)
+    if args.profile or args.profile_sample or args.profile_worker or args.profile_off:
+        profiling.save_profiling_config(args.data_path, {} if args.profile_off else {
+            'files': args.profile or [],
+            'sample_rate': args.profile_sample,
+            'worker': args.profile_worker,
+        })
+    if not args.update_profiling:
+        main(args.processes, args.data_path)
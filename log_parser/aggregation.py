@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Tuple, Union
+
+from log_parser.config import AggregationConfig
+from log_parser.point import Items, Point, intern_tags
+
+# Quantiles are estimated within this fraction of their actual value
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MICROSECONDS = 1000000
+# Seconds that the sources which handed off their windows are remembered, so a retried file doesn't hand them off twice
+HAND_OFF_HISTORY = 7 * 24 * 3600
+
+settings = AggregationConfig({})
+
+# measurement, tags and start of a window
+WindowKey = Tuple[str, Items, int]
+
+
+def _to_items(tags: list) -> Items:
+    """Returns the tags of a window key that were serialized to JSON"""
+    return intern_tags({key: value for key, value in tags})
+
+
+class Sketch(object):
+    """
+    Count, sum, minimum, maximum and quantiles of the values of a field.
+    Positive values are counted in logarithmic buckets, so quantiles are accurate to RELATIVE_ACCURACY, and sketches
+    can be merged.
+    """
+    __slots__ = ('count', 'sum', 'min', 'max', 'zeros', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0  # type: int
+        self.sum = 0.0  # type: float
+        self.min = math.inf  # type: float
+        self.max = -math.inf  # type: float
+        # Values of 0 and less
+        self.zeros = 0  # type: int
+        self.buckets = {}  # type: Dict[int, int]
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / LOG_GAMMA)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: 'Sketch') -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, quantile: float) -> float:
+        rank = quantile * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return min(0.0, self.max)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Middle of the bucket, which is within RELATIVE_ACCURACY of every value in it
+                value = 2 * GAMMA ** index / (GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_json(self) -> list:
+        return [self.count, self.sum, self.min, self.max, self.zeros, sorted(self.buckets.items())]
+
+    @classmethod
+    def from_json(cls, value: list) -> 'Sketch':
+        sketch = cls()
+        sketch.count, sketch.sum, sketch.min, sketch.max, sketch.zeros, buckets = value
+        sketch.buckets = {index: count for index, count in buckets}
+        return sketch
+
+
+class Window(object):
+    __slots__ = ('count', 'sketches')
+
+    def __init__(self) -> None:
+        self.count = 0  # type: int
+        self.sketches = {}  # type: Dict[str, Sketch]
+
+    def merge(self, other: 'Window') -> None:
+        self.count += other.count
+        for name, sketch in other.sketches.items():
+            if name in self.sketches:
+                self.sketches[name].merge(sketch)
+            else:
+                self.sketches[name] = sketch
+
+    def to_json(self) -> str:
+        return json.dumps([self.count, {name: sketch.to_json() for name, sketch in self.sketches.items()}])
+
+    @classmethod
+    def from_json(cls, value: str) -> 'Window':
+        window = cls()
+        window.count, sketches = json.loads(value)
+        window.sketches = {name: Sketch.from_json(sketch) for name, sketch in sketches.items()}
+        return window
+
+
+class Aggregator(object):
+    """
+    Counts the points of the configured measurements per window of config.window seconds and tag set, with sketches
+    of their numeric fields.
+    A window is closed once a point is seen that's config.lateness seconds after its end. The windows that are still
+    open at the end of a file are handed off to the next file with the AggregationStore.
+    Every aggregated point gets a timestamp in its window that depends on the source of the points, since a window
+    can be written in parts by several files. Query them with sum(count), min(..._min) and max(..._max) grouped by
+    the window.
+    """
+
+    def __init__(self, config: AggregationConfig, source: str) -> None:
+        self.config = config
+        self.source = source
+        self.window_size = config.window * MICROSECONDS  # type: int
+        self.lateness = config.lateness * MICROSECONDS  # type: int
+        # Leaves room for the parts of a window that's closed more than once
+        self.source_offset = zlib.crc32(source.encode('utf-8')) % (self.window_size // 2)  # type: int
+        self.fields = {measurement: frozenset(fields) for measurement, fields in config.measurements.items()}
+        self.windows = {}  # type: Dict[WindowKey, Window]
+        self.parts = {}  # type: Dict[WindowKey, int]
+        # Latest time of the points that were added
+        self.watermark = 0  # type: int
+        self._next_check = 0  # type: int
+
+    def add(self, point: Point) -> bool:
+        """Adds the point to its window. Returns False when the point isn't aggregated or should be written as well."""
+        fields = self.fields.get(point.measurement)
+        if fields is None:
+            return False
+        time = point.time
+        key = (point.measurement, point.tags, time - time % self.window_size)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = Window()
+        window.count += 1
+        if fields:
+            for name, value in point.fields:
+                if name in fields and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    sketch = window.sketches.get(name)
+                    if sketch is None:
+                        sketch = window.sketches[name] = Sketch()
+                    sketch.add(value)
+        if time > self.watermark:
+            self.watermark = time
+        return not self.config.keep_raw
+
+    @property
+    def due(self) -> bool:
+        """If windows might have been closed since the last time close_windows was called"""
+        return self.watermark >= self._next_check
+
+    def close_windows(self) -> List[Point]:
+        """Removes the windows that are closed and returns their points"""
+        self._next_check = self.watermark + self.window_size
+        limit = self.watermark - self.lateness - self.window_size
+        closed = [key for key in self.windows if key[2] <= limit]
+        return self.to_points({key: self.windows.pop(key) for key in closed})
+
+    def take_open_windows(self) -> Dict[WindowKey, Window]:
+        windows, self.windows = self.windows, {}
+        return windows
+
+    def get_state(self) -> dict:
+        """Returns the open windows and the parts that were written, to save them with a checkpoint"""
+        return {
+            'windows': [[measurement, tags, start, window.to_json()]
+                        for (measurement, tags, start), window in self.windows.items()],
+            'parts': [[measurement, tags, start, part] for (measurement, tags, start), part in self.parts.items()],
+            'watermark': self.watermark,
+        }
+
+    def restore(self, state: dict) -> None:
+        """Continues with the state of get_state, when a file is resumed from a checkpoint"""
+        self.windows = {(measurement, _to_items(tags), start): Window.from_json(window)
+                        for measurement, tags, start, window in state['windows']}
+        self.parts = {(measurement, _to_items(tags), start): part for measurement, tags, start, part in state['parts']}
+        self.watermark = state['watermark']
+
+    def to_points(self, windows: Dict[WindowKey, Window]) -> List[Point]:
+        points = []
+        # Tag values can be None, which can't be compared with strings
+        for key in sorted(windows, key=repr):
+            measurement, tags, start = key
+            window = windows[key]
+            part = self.parts.get(key, 0)
+            self.parts[key] = part + 1
+            fields = {'count': window.count}  # type: Dict[str, Union[int, float]]
+            for name, sketch in window.sketches.items():
+                fields[name + '_sum'] = float(sketch.sum)
+                fields[name + '_min'] = float(sketch.min)
+                fields[name + '_max'] = float(sketch.max)
+                for quantile in self.config.quantiles:
+                    fields['%s_p%s' % (name, ('%g' % (quantile * 100)).replace('.', '_'))] = \
+                        float(sketch.quantile(quantile))
+            points.append(Point(measurement + self.config.suffix, dict(tags), start + self.source_offset + part,
+                                fields))
+        return points
+
+
+class AggregationStore(object):
+    """
+    Windows that were still open at the end of a file, in a SQLite database that is shared by all processes.
+    Every file puts its open windows in the store and takes the windows that are closed by now, to write them.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS windows (measurement TEXT NOT NULL, tags TEXT NOT NULL, '
+                                'start INTEGER NOT NULL, state TEXT NOT NULL, PRIMARY KEY (measurement, tags, start))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS windows_start ON windows (start)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS watermark (id INTEGER PRIMARY KEY, time INTEGER NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS handed_off (source TEXT PRIMARY KEY, time REAL NOT NULL)')
+
+    def put(self, windows: Dict[WindowKey, Window], watermark: int = 0, source: Union[str, None] = None) -> bool:
+        """
+        Merges the windows with the ones in the store, and the watermark of the file they're from.
+        With a source, the windows are only merged the first time that source hands them off, since a file or range
+        of a file is processed again from the start when it's retried. Returns False when they were skipped.
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                if source is not None:
+                    now = time.time()
+                    self.connection.execute('DELETE FROM handed_off WHERE time < ?', (now - HAND_OFF_HISTORY,))
+                    if self.connection.execute('SELECT 1 FROM handed_off WHERE source = ?', (source,)).fetchone():
+                        self.connection.execute('COMMIT')
+                        return False
+                    self.connection.execute('INSERT INTO handed_off VALUES (?, ?)', (source, now))
+                for (measurement, tags, start), window in windows.items():
+                    tags_json = json.dumps(tags)
+                    row = self.connection.execute('SELECT state FROM windows WHERE measurement = ? AND tags = ? AND '
+                                                  'start = ?', (measurement, tags_json, start)).fetchone()
+                    if row:
+                        window.merge(Window.from_json(row[0]))
+                    self.connection.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?)',
+                                            (measurement, tags_json, start, window.to_json()))
+                self.connection.execute('INSERT OR IGNORE INTO watermark VALUES (0, 0)')
+                self.connection.execute('UPDATE watermark SET time = max(time, ?) WHERE id = 0', (watermark,))
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return True
+
+    def take(self, closed_after: Union[int, None]) -> Dict[WindowKey, Window]:
+        """
+        Removes and returns the windows that start closed_after microseconds or more before the latest watermark of
+        all files, or every window when closed_after is None.
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                if closed_after is None:
+                    limit = None
+                else:
+                    row = self.connection.execute('SELECT time FROM watermark WHERE id = 0').fetchone()
+                    limit = (row[0] if row else 0) - closed_after
+                rows = self.connection.execute('SELECT measurement, tags, start, state FROM windows '
+                                               'WHERE ? IS NULL OR start <= ?', (limit, limit)).fetchall()
+                self.connection.execute('DELETE FROM windows WHERE ? IS NULL OR start <= ?', (limit, limit))
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return {(measurement, _to_items(json.loads(tags)), start): Window.from_json(state)
+                for measurement, tags, start, state in rows}
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+_store = None  # type: Union[AggregationStore, None]
+
+
+def configure(config: AggregationConfig) -> None:
+    """Sets the configuration of the aggregation of this process. Called at the start of every task in a worker."""
+    global settings, _store
+    if vars(config) == vars(settings):
+        return
+    if _store:
+        _store.close()
+        _store = None
+    settings = config
+
+
+def get_store() -> AggregationStore:
+    global _store
+    if _store is None:
+        _store = AggregationStore(settings.state_path or ':memory:')
+    return _store
+
+
+def get_aggregator(source: str) -> Union[Aggregator, None]:
+    """Returns an aggregator for the points of the source, like a file, or None when aggregation is disabled"""
+    return Aggregator(settings, source) if settings.enabled else None
+
+
+def hand_off(aggregator: Aggregator) -> Tuple[Dict[WindowKey, Window], List[Point]]:
+    """
+    Hands the open windows of the aggregator off to the next files and takes the windows that are closed by now.
+    The open windows are skipped when the source of the aggregator already handed them off.
+    Returns those windows and their points.
+    """
+    store = get_store()
+    if not store.put(aggregator.take_open_windows(), aggregator.watermark, aggregator.source):
+        logging.warning('The windows of %s were already handed off', aggregator.source)
+    windows = store.take(aggregator.lateness + aggregator.window_size)
+    return windows, aggregator.to_points(windows)
+
+
+def take_all(source: str) -> Tuple[Dict[WindowKey, Window], List[Point]]:
+    """Takes every window that was handed off, like at the end of a backfill. Returns those windows and their points."""
+    aggregator = Aggregator(settings, source)
+    windows = get_store().take(None)
+    return windows, aggregator.to_points(windows)
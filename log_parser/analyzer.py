@@ -15,45 +15,84 @@
 #
 # @@license_version:1.4@@
 
-import io
 import json
 import logging
-from typing import Iterator, Dict, Any, List, Union
-
-import ijson
+import time
+from typing import Callable, Iterator, List, Union
 
+from log_parser.config import DecodeConfig
 from log_parser.parsers import request_log, rogerthat, threefold, oca
-from log_parser.parsers.filter import registry, request_filter
+from log_parser.parsers.filter import get_index, get_projection, request_filter
+from log_parser.point import Point
+from log_parser.projection import has_fast_backend, project
+from log_parser.salvage import salvage
+from log_parser.stats import DECODE, PARSE, get_stats
+
+
+class LogType(object):
+    def __init__(self, process: Callable[[dict], Iterator[Point]], fields: Union[List[str], None] = None) -> None:
+        self.process = process
+        # Paths in the log line that are read by the parser, None when it needs the whole line
+        self.fields = fields  # type: Union[List[str], None]
+
 
+SNAPSHOT_FIELDS = ['timestamp', 'request_data']
 log_types = {
-    '_request': request_log.process,
-    'callback_api': rogerthat.callback_api,
-    'api': rogerthat.api,
-    'app': rogerthat.app,
-    'web': rogerthat.web,
-    'rogerthat.created_apps': rogerthat.created_apps,
-    'rogerthat.released_apps': rogerthat.released_apps,
-    'rogerthat.total_users': rogerthat.all_users,
-    'rogerthat.total_services': rogerthat.total_services,
-    'oca.active_modules': oca.active_modules,
-    'oca.custom_loyalty_cards': oca.custom_loyalty_cards,
-    'web_channel': rogerthat.web_channel,
-    'tf.web': threefold.web
+    '_request': LogType(request_log.process, ['data']),
+    'callback_api': LogType(rogerthat.callback_api, ['timestamp', 'user', 'function', 'request_data.method',
+                                                     'request_data.params.tag', 'request_data.params.method',
+                                                     'request_data.params.user_details']),
+    'api': LogType(rogerthat.api, ['timestamp', 'user', 'function', 'success']),
+    'app': LogType(rogerthat.app, ['timestamp', 'user', 'request_data.r.item.item.r', 'request_data.c.item.t',
+                                   'request_data.c.item.f', 'response_data.c.item.t', 'response_data.c.item.f']),
+    'web': LogType(rogerthat.web, []),
+    'rogerthat.created_apps': LogType(rogerthat.created_apps, SNAPSHOT_FIELDS),
+    'rogerthat.released_apps': LogType(rogerthat.released_apps, SNAPSHOT_FIELDS),
+    'rogerthat.total_users': LogType(rogerthat.all_users, SNAPSHOT_FIELDS),
+    'rogerthat.total_services': LogType(rogerthat.total_services, SNAPSHOT_FIELDS),
+    'oca.active_modules': LogType(oca.active_modules, SNAPSHOT_FIELDS),
+    'oca.custom_loyalty_cards': LogType(oca.custom_loyalty_cards, SNAPSHOT_FIELDS),
+    'web_channel': LogType(rogerthat.web_channel, []),
+    'tf.web': LogType(threefold.web, []),
 }
+# Fields needed to determine the type of a line
+GUESS_FIELDS = ['type', 'request_data.params', 'request_data.a']
 
 PREFIXES = ['[XX-OFFLOADv1]', '[OFFLOAD] ']
+REQUEST_LOG_MARKER = '"type.googleapis.com/google.appengine.logging.v1.RequestLog"'
+REQUEST_LOG_MARKER_BYTES = REQUEST_LOG_MARKER.encode('utf-8')
+
+# Lines larger than settings.projection_min_size are decoded with a projection, so that the subtrees that aren't needed
+# are never allocated. That takes more CPU time than decoding them completely in a single pass.
+settings = DecodeConfig({})
+
+
+def configure(config: DecodeConfig) -> None:
+    """Sets the size from which lines are decoded with a projection in this process"""
+    global settings
+    settings = config
 
 
-@request_filter('')
-def process_log(value: dict) -> Iterator[dict]:
-    type_ = value.get('type')
+def get_log_fields() -> Union[List[str], None]:
+    fields = set(GUESS_FIELDS)
+    for log_type in log_types.values():
+        if log_type.fields is None:
+            return None
+        fields.update(log_type.fields)
+    return sorted(fields)
+
+
+@request_filter('', fields=get_log_fields())
+def process_log(value: dict) -> Iterator[Point]:
+    type_ = value.get('type') or guess_log_type(value)
     if not type_:
-        type_ = guess_log_type(value)
-    f = log_types.get(type_)
-    if f:
-        yield from f(value)
-    elif not type_:
-        pass
+        return
+    log_type = log_types.get(type_)
+    if log_type:
+        start = time.perf_counter()
+        points = list(log_type.process(value))
+        get_stats().record(PARSE, time.perf_counter() - start, len(points), log_type=type_)
+        yield from points
     else:
         logging.warning('Unsupported log type %s for line %s', type_, value)
         yield from ()
@@ -69,69 +108,59 @@ def guess_log_type(value: dict) -> Union[None, str]:
     return result
 
 
-def analyze(line: str) -> Iterator[dict]:
-    if '"type.googleapis.com/google.appengine.logging.v1.RequestLog"' in line:
+def analyze(line: Union[str, bytes]) -> Iterator[Point]:
+    """
+    Returns the points for a single log line.
+    Lines can be passed as bytes as they are read from the file, those are never decoded as a whole.
+    """
+    if isinstance(line, bytes):
+        is_request_log = REQUEST_LOG_MARKER_BYTES in line
+    else:
+        is_request_log = REQUEST_LOG_MARKER in line
+    if is_request_log:
         # Contains an actual request log, process that first.
+        stats = get_stats()
+        start = time.perf_counter()
         log = json.loads(line)
+        decoded = time.perf_counter()
+        stats.record(DECODE, decoded - start, size=len(line))
         # Only the last log entry of a request log contains all request information like status code etc.
         if log['operation'].get('last', False):
-            yield from request_log.process_request_log(log)
+            points = list(request_log.process_request_log(log))
+            stats.record(PARSE, time.perf_counter() - decoded, len(points), log_type='request_log')
+            yield from points
         for app_log in log['protoPayload'].get('line', []):
             message = app_log['logMessage']
             for prefix in PREFIXES:
                 if message.startswith(prefix):
-                    yield from _analyze_possibly_broken_json(message.replace(prefix, ''))
+                    yield from _analyze_json(message[len(prefix):])
+    else:
+        yield from _analyze_json(line)
+
+
+def _analyze_json(line: Union[str, bytes]) -> Iterator[Point]:
+    """
+    Decodes the line in a single pass, which works for nearly every line.
+    Lines that were truncated by App Engine are repaired first, keeping everything up to the last complete value.
+    Large lines only decode the fields that are read by the parsers, when the C backend of ijson is available.
+    """
+    start = time.perf_counter()
+    size = len(line)
+    min_size = settings.projection_min_size
+    if min_size and size >= min_size and has_fast_backend:
+        value = project(line, get_projection())
     else:
-        yield from _analyze_possibly_broken_json(line)
-
-
-def _analyze_possibly_broken_json(line: str) -> Iterator[dict]:
-    readers: Any = {}  # too complicated for proper types
-    f = io.StringIO(line)
-    data: Union[Dict, List]
-    try:
-        for key, type_, value in ijson.parse(f):
-            listeners = registry.get(key, [])
-            for reader in readers.values():
-                _, stack, property_name = reader
-                parent = stack[-1]
-                if type_ == 'start_map':
-                    data = {}
-                    stack.append(data)
-                    if isinstance(parent, dict):
-                        parent[property_name] = data
-                    else:
-                        parent.append(data)
-                    continue
-                if type_ in ('end_map', 'end_array'):
-                    stack.pop()
-                    continue
-                if type_ == 'map_key':
-                    reader[2] = value
-                    continue
-                if type_ == 'start_array':
-                    data = []
-                    stack.append(data)
-                    if isinstance(parent, dict):
-                        parent[property_name] = data
-                    else:
-                        parent.append(data)
-                    continue
-                if isinstance(parent, dict):
-                    parent[property_name] = value
-                else:
-                    parent.append(value)
-            for func in listeners:
-                if type_ == 'start_map':
-                    # Start reading
-                    initial_data: Dict = {}
-                    readers[func] = [initial_data, [initial_data], None]
-                elif type_ == 'end_map':
-                    yield from func(readers.pop(func)[0])
-    except (ijson.common.IncompleteJSONError, ijson.backends.python.UnexpectedSymbol):
-        pass
-    finally:
-        f.close()
-    for func, reader in readers.items():
-        for result in func(reader[0]):
-            yield result
+        try:
+            value = json.loads(line)
+        except ValueError:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            result = salvage(line)
+            if not result:
+                get_stats().record(DECODE, time.perf_counter() - start, size=size)
+                return
+            logging.debug('Salvaged truncated line: dropped %d characters, closed %s', len(result.dropped),
+                          result.closed)
+            value = result.value
+    get_stats().record(DECODE, time.perf_counter() - start, size=size)
+    yield from get_index().dispatch(value)
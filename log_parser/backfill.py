@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+"""
+Processes log files that are already on disk, for example to parse a month of logs again after the parsers changed.
+
+    python -m log_parser.backfill /data/logs --output /data/import
+    influx -import -compressed -precision=u -path=/data/import/<file>.txt.gz
+
+Without --output, the points are written to the InfluxDB of configuration.json.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import timedelta
+from fnmatch import fnmatch
+from multiprocessing.pool import Pool
+from typing import List, Tuple, Union
+
+from influxdb import InfluxDBClient
+
+from log_parser import aggregation, analyzer, get_client, get_prefilter, resolver, snapshots, stats, writer, CURRENT_DIR
+from log_parser.bizz import get_line_ranges, iter_file_lines, process_lines
+from log_parser.line_protocol import make_line
+from log_parser.config import LogParserConfig
+from log_parser.writer import BackgroundWriter, LineProtocolFiles
+
+# Bytes per task, files are split on line boundaries
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+# Seconds between progress reports
+PROGRESS_INTERVAL = 10
+
+Task = Tuple[str, int, int]
+
+
+class Progress(object):
+    """Keeps track of the bytes that are processed to estimate when everything will be done"""
+
+    def __init__(self, total_bytes: int) -> None:
+        self.total_bytes = total_bytes
+        self.done_bytes = 0  # type: int
+        self.points = 0  # type: int
+        self.started = time.time()  # type: float
+        self.last_report = self.started  # type: float
+
+    def add(self, size: int, points: int) -> None:
+        self.done_bytes += size
+        self.points += points
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second"""
+        return self.done_bytes / max(time.time() - self.started, 1e-6)
+
+    @property
+    def remaining_seconds(self) -> Union[float, None]:
+        rate = self.rate
+        if not rate:
+            return None
+        return (self.total_bytes - self.done_bytes) / rate
+
+    @property
+    def due(self) -> bool:
+        return time.time() - self.last_report >= PROGRESS_INTERVAL or self.done_bytes == self.total_bytes
+
+    def report(self) -> str:
+        self.last_report = time.time()
+        remaining = self.remaining_seconds
+        return 'Processed %.1f of %.1f MB (%.1f%%) at %.1f MB/s, %d points. %s remaining.' % (
+            self.done_bytes / 1024 ** 2, self.total_bytes / 1024 ** 2,
+            100.0 * self.done_bytes / self.total_bytes if self.total_bytes else 100.0, self.rate / 1024 ** 2,
+            self.points, 'Unknown time' if remaining is None else timedelta(seconds=int(remaining)))
+
+
+def find_files(directory: str, pattern: str) -> List[str]:
+    """Returns the paths relative to directory of the files that match the pattern, sorted"""
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            if fnmatch(filename, pattern) or fnmatch(path, pattern):
+                paths.append(path)
+    return sorted(paths)
+
+
+def get_tasks(directory: str, paths: List[str], chunk_size: int) -> List[Task]:
+    return [(path, start, end) for path in paths
+            for start, end in get_line_ranges(os.path.join(directory, path), chunk_size)]
+
+
+def backfill_range(directory: str, path: str, start: int, end: int, output: Union[str, None],
+                   configuration: LogParserConfig) -> Tuple[bool, Task, int]:
+    """Processes a range of lines of a file in a separate process. Returns if it succeeded and the amount of points."""
+    name = '%s[%d:%d]' % (path, start, end)
+    target = None  # type: Union[LineProtocolFiles, InfluxDBClient, None]
+    try:
+        writer.configure(configuration.influxdb)
+        analyzer.configure(configuration.decode)
+        resolver.configure(configuration.resolver)
+        stats.configure(configuration.stats)
+        aggregation.configure(configuration.aggregation)
+        snapshots.configure(configuration.snapshots)
+        if output:
+            target = LineProtocolFiles(os.path.join(output, '%s.%d-%d' % (path, start, end)), configuration.influxdb.db)
+            os.makedirs(os.path.dirname(target.path_prefix), exist_ok=True)
+        else:
+            target = get_client(configuration)
+        points = process_lines(target, iter_file_lines(os.path.join(directory, path), start, end), name,
+                               get_prefilter(configuration))
+        if output:
+            target.close()
+        return True, (path, start, end), points
+    except Exception:
+        logging.exception('Failed to process %s', name)
+        # The range is processed again from the start, so the files of this attempt would be duplicates
+        if isinstance(target, LineProtocolFiles):
+            target.discard()
+        return False, (path, start, end), 0
+
+
+def _backfill_task(args: tuple) -> Tuple[bool, Task, int]:
+    return backfill_range(*args)
+
+
+def _init_worker() -> None:
+    # Only the progress of the main process is reported
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def backfill(directory: str, configuration: LogParserConfig, process_count: int, output: Union[str, None] = None,
+             pattern: str = '*', chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Task]:
+    """
+    Processes every file in directory of which the name or the path relative to directory matches the pattern, with
+    process_count processes. Returns the ranges of the files that failed.
+    """
+    paths = find_files(directory, pattern)
+    tasks = get_tasks(directory, paths, chunk_size)
+    progress = Progress(sum(end - start for _, start, end in tasks))
+    logging.info('Processing %d files (%.1f MB) in %d parts with %d processes', len(paths),
+                 progress.total_bytes / 1024 ** 2, len(tasks), process_count)
+    failed = []
+    with Pool(process_count, _init_worker) as pool:
+        arguments = [(directory, path, start, end, output, configuration) for path, start, end in tasks]
+        for success, task, points in pool.imap_unordered(_backfill_task, arguments):
+            _, start, end = task
+            progress.add(end - start, points)
+            if not success:
+                failed.append(task)
+            if progress.due:
+                logging.info(progress.report())
+    if configuration.aggregation.enabled:
+        write_open_windows(configuration, output)
+    if failed:
+        logging.error('Failed to process %d parts: %s', len(failed), failed)
+    return failed
+
+
+def write_open_windows(configuration: LogParserConfig, output: Union[str, None]) -> None:
+    """Writes the aggregated windows that were handed off at the end of the last files"""
+    aggregation.configure(configuration.aggregation)
+    _, points = aggregation.take_all('backfill')
+    if not points:
+        return
+    if output:
+        target = LineProtocolFiles(os.path.join(output, 'aggregated-windows'), configuration.influxdb.db)
+    else:
+        target = get_client(configuration)
+    try:
+        with BackgroundWriter(target) as background_writer:
+            background_writer.write([make_line(point) for point in points])
+    except Exception:
+        if isinstance(target, LineProtocolFiles):
+            target.discard()
+        raise
+    if isinstance(target, LineProtocolFiles):
+        target.close()
+    logging.info('Wrote %d aggregated windows that were still open', len(points))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Processes log files on disk')
+    parser.add_argument('directory', help='Directory with the log files, searched recursively')
+    parser.add_argument('--output', help='Write the points to compressed line protocol files in this directory for '
+                                         '"influx -import" instead of to InfluxDB')
+    parser.add_argument('--database', help='Database of the points. Defaults to the one in the configuration.')
+    parser.add_argument('--pattern', default='*', help='Only process the files that match this pattern')
+    parser.add_argument('--processes', type=int, help='Number of processes to use', default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Files are processed in parts of about this many bytes')
+    parser.add_argument('--configuration', default=os.path.join(CURRENT_DIR, 'configuration.json'),
+                        help='Configuration of the log parser, only the database is needed when writing to files')
+    parser.add_argument('--data_path', type=str, default=os.path.join(CURRENT_DIR, '..', 'parser'),
+                        help='Data path of the log parser, to share its cache of app ids')
+    args = parser.parse_args()
+    config = {}
+    if os.path.exists(args.configuration):
+        with open(args.configuration, 'r') as f:
+            config = json.load(f)
+    configuration = LogParserConfig(config)
+    configuration.influxdb.db = args.database or configuration.influxdb.db
+    if not configuration.influxdb.db:
+        parser.error('The database is not set in the configuration, use --database')
+    if not configuration.resolver.cache_path:
+        configuration.resolver.cache_path = os.path.join(args.data_path, 'service_apps.sqlite')
+    if not configuration.aggregation.state_path:
+        # Not shared with the log parser, the windows that are still open at the end are written as well
+        configuration.aggregation.state_path = os.path.join(args.data_path, 'backfill_aggregation.sqlite')
+    if not configuration.snapshots.state_path:
+        # The log parser may already have written later snapshots, those of the backfill are compared among themselves
+        configuration.snapshots.state_path = os.path.join(args.data_path, 'backfill_snapshots.sqlite')
+    os.makedirs(os.path.dirname(os.path.abspath(configuration.resolver.cache_path)), exist_ok=True)
+    if args.output:
+        # The statistics of the backfill shouldn't end up in the files
+        configuration.stats.enabled = False
+    logging.getLogger().setLevel(logging.INFO)
+    failed = backfill(args.directory, configuration, args.processes, args.output, args.pattern, args.chunk_size)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
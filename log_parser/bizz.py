@@ -15,21 +15,50 @@
 #
 # @@license_version:1.4@@
 import logging
+import mmap
 import os
-from datetime import datetime
-from typing import Optional, List
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, List, Tuple, Iterable, Iterator, Union, Set, Dict, Deque
 
 from google.cloud import storage
 from google.cloud.storage import Bucket, Blob
 from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBClientError
 
+from log_parser.aggregation import Aggregator, get_aggregator, get_store, hand_off
 from log_parser.analyzer import analyze
+from log_parser.checkpoint import Checkpoint, load_checkpoint, remove_checkpoint, save_checkpoint
 from log_parser.db import DatabaseConnection, create_folder
-from log_parser.models import LogParserFile, LogParserSettings
+from log_parser.line_protocol import make_line
+from log_parser.models import LogParserFile
+from log_parser.point import Point
+from log_parser.prefilter import Prefilter
+from log_parser.resolver import get_resolver
+from log_parser.snapshots import filter_unchanged
+from log_parser.stats import BUILD, DOWNLOAD, FLUSH, LISTING, Stats, get_stats
+from log_parser.writer import BackgroundWriter
 
-MAX_DB_ENTRIES_PER_RPC = 500
-storage_client = storage.Client.from_service_account_json(os.path.join(os.path.dirname(__file__), 'credentials.json'))
+# Amount of downloaded chunks that are buffered while streaming a file
+STREAM_BUFFER_CHUNKS = 4
+LOG_FOLDER_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Only the names and sizes are needed when listing files
+LIST_FIELDS = 'items(name,size),nextPageToken'
+# Seconds between checkpoints while aggregating, since those contain every open window
+AGGREGATION_CHECKPOINT_INTERVAL = 10
+# Created when it's first needed, so that files on disk can be processed without credentials
+storage_client = None  # type: storage.Client
+
+
+def get_storage_client() -> storage.Client:
+    global storage_client
+    if storage_client is None:
+        storage_client = storage.Client.from_service_account_json(
+            os.path.join(os.path.dirname(__file__), 'credentials.json'))
+    return storage_client
 
 
 def _get_foldername(file_path) -> str:
@@ -45,34 +74,87 @@ def get_log_folder(date: datetime) -> str:
 
 
 def _get_date_from_filename(filename):
-    return datetime.strptime(_get_foldername(filename), '%Y-%m-%d %H:%M:%S')
+    return datetime.strptime(_get_foldername(filename), LOG_FOLDER_FORMAT)
 
 
-def _get_next_date(cloudstorage_bucket: Bucket, min_date: datetime = None) -> Optional[datetime]:
-    directories = sorted([f.name for f in cloudstorage_bucket.list_blobs()])
-    if not directories:
+def _get_log_folder_of(file_name: str) -> Optional[str]:
+    """Returns the log folder a file is in, or None when it's not in a log folder"""
+    folder, separator, _ = file_name.partition('/')
+    if not separator:
         return None
-    if not min_date:
-        return _get_date_from_filename(directories[0])
-    for directory in directories:
-        dir_date = _get_date_from_filename(directory)
-        if dir_date > min_date:
+    try:
+        datetime.strptime(folder, LOG_FOLDER_FORMAT)
+    except ValueError:
+        return None
+    return folder
+
+
+def _get_next_date(cloudstorage_bucket: Bucket, min_date: Optional[datetime] = None) -> Optional[datetime]:
+    # Blobs are listed in lexicographical order, which is chronological for the log folders
+    start_offset = get_log_folder(min_date) if min_date else None
+    for blob in cloudstorage_bucket.list_blobs(start_offset=start_offset, fields=LIST_FIELDS):
+        dir_date = _get_date_from_filename(blob.name)
+        if not min_date or dir_date > min_date:
             return dir_date
-    else:
+    return None
+
+
+def get_listing_offset(watermark: Optional[str], overlap_hours: int) -> Optional[str]:
+    """Returns the name from which a bucket is listed: overlap_hours before the log folder in watermark"""
+    if not watermark:
         return None
+    return get_log_folder(datetime.strptime(watermark, LOG_FOLDER_FORMAT) - timedelta(hours=overlap_hours))
 
 
-def get_new_files_to_process(buckets: List[str], settings: LogParserSettings) -> List[LogParserFile]:
-    file_names = [f.name for f in settings.files]
+def list_new_files(cloudstorage_bucket: Bucket, known_files: Set[str], watermark: Optional[str], overlap_hours: int,
+                   compacted_folder: Optional[str] = None) -> Tuple[List[LogParserFile], Optional[str]]:
+    """
+    Lists the files that aren't known yet, starting overlap_hours before the log folder in watermark.
+    Folders up to compacted_folder are done and aren't listed at all.
+    Returns the new files and the watermark for the next listing: the last log folder that was seen.
+    """
+    start_offset = get_listing_offset(watermark, overlap_hours)
+    if compacted_folder:
+        after_compacted = get_log_folder(datetime.strptime(compacted_folder, LOG_FOLDER_FORMAT) + timedelta(hours=1))
+        start_offset = max(start_offset or '', after_compacted)
+    new_files = []
+    # Pages of 1000 files are requested while iterating
+    for blob in cloudstorage_bucket.list_blobs(start_offset=start_offset, fields=LIST_FIELDS):  # type: Blob
+        name = blob.name
+        if name.endswith('.json') and name not in known_files:
+            new_files.append(LogParserFile(name, None, cloudstorage_bucket.name, blob.size))
+        folder = _get_log_folder_of(name)
+        if folder and (not watermark or folder > watermark):
+            watermark = folder
+    return new_files, watermark
+
+
+def get_new_files_to_process(buckets: List[str], db: DatabaseConnection,
+                             overlap_hours: int) -> Tuple[List[LogParserFile], Dict[str, str]]:
+    """Lists the files that were added since the last time. Returns them with the new watermarks of the buckets."""
+    watermarks = db.get_watermarks()
     new_files = []
     for bucket_name in buckets:
-        bucket = storage_client.bucket(bucket_name)
-        # TODO provide a date prefix so we don't have to fetch every single filename every time
-        # This takes long because a request is done for every 1000 files
-        for file in bucket.list_blobs():  # type: Blob
-            if file.name not in file_names and file.name.endswith('.json'):
-                new_files.append(LogParserFile(file.name, None, bucket_name))
-    return new_files
+        start = time.perf_counter()
+        bucket = get_storage_client().bucket(bucket_name)
+        watermark = watermarks.get(bucket_name)
+        known_files = db.get_file_names(bucket_name, get_listing_offset(watermark, overlap_hours))
+        files, watermark = list_new_files(bucket, known_files, watermark, overlap_hours,
+                                          db.get_compacted_folder(bucket_name))
+        get_stats().record(LISTING, time.perf_counter() - start, len(files))
+        new_files.extend(files)
+        if watermark:
+            watermarks[bucket_name] = watermark
+    return new_files, watermarks
+
+
+def compact_history(db: DatabaseConnection, horizon_hours: int) -> None:
+    """Compacts the processed files of every bucket in the log folders that are horizon_hours before its watermark"""
+    for bucket_name, watermark in db.get_watermarks().items():
+        before_folder = get_log_folder(datetime.strptime(watermark, LOG_FOLDER_FORMAT) - timedelta(hours=horizon_hours))
+        file_count = db.compact(bucket_name, before_folder)
+        if file_count:
+            logging.info('%s: Compacted %s processed files before %s', bucket_name, file_count, before_folder)
 
 
 def get_unprocessed_logs(db: DatabaseConnection, cloudstorage_bucket: Bucket, year: str) -> List[str]:
@@ -81,51 +163,315 @@ def get_unprocessed_logs(db: DatabaseConnection, cloudstorage_bucket: Bucket, ye
     return list(sorted(filter(lambda f: f not in done_log_filenames, filenames_in_year)))
 
 
-def save_statistic_entries(client: InfluxDBClient, entries: List[dict]) -> bool:
+def download_log(download_directory: str, cloudstorage_bucket: Bucket, bucket_path: str) -> str:
+    """Downloads the file if it's not already on disk and returns its path."""
+    blob = cloudstorage_bucket.blob(bucket_path)
+    disk_path = os.path.join(download_directory, cloudstorage_bucket.name, bucket_path)
+    create_folder(os.path.dirname(disk_path))
+    if not os.path.exists(disk_path):
+        logging.info('Downloading %s', bucket_path)
+        start = time.perf_counter()
+        blob.download_to_filename(disk_path)
+        get_stats().record(DOWNLOAD, time.perf_counter() - start, 1, os.path.getsize(disk_path))
+    return disk_path
+
+
+def get_line_ranges(disk_path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Splits a file in ranges of about chunk_size bytes that start and end on a line boundary."""
+    size = os.path.getsize(disk_path)
+    if not size:
+        return []
+    ranges = []
+    with open(disk_path, 'rb') as file_obj, mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_file_lines(disk_path: str, start: int, end: int) -> Iterator[bytes]:
+    """Yields the lines of a file that start between the byte offsets start and end, including the newline."""
+    with open(disk_path, 'rb') as file_obj, mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(start)
+        while mm.tell() < end:
+            yield mm.readline()
+
+
+def _put_chunk(chunks: queue.Queue, chunk: Union[bytes, Exception, None], stopped: threading.Event) -> bool:
+    """Waits until there's room for the chunk in the queue, unless the lines aren't being read anymore."""
+    while not stopped.is_set():
+        try:
+            chunks.put(chunk, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _download_chunks(blob: Blob, chunk_size: int, chunks: queue.Queue, stopped: threading.Event,
+                     offset: int = 0) -> None:
+    stats = get_stats()
     try:
-        return client.write_points(entries)
-    except InfluxDBClientError as e:
-        if 'timeout' in e.content:
-            logging.warning('Timeout while writing to influxdb. Retrying with smaller batch size...')
-            client.write_points(entries, batch_size=MAX_DB_ENTRIES_PER_RPC / 5, protocol='json')
-        else:
-            logging.exception('Failed to write data to influxdb')
-            raise
-    except UnicodeEncodeError:
-        logging.debug(entries)
-        raise
+        for start in range(offset, blob.size, chunk_size):
+            download_start = time.perf_counter()
+            chunk = blob.download_as_bytes(start=start, end=min(start + chunk_size, blob.size) - 1)
+            stats.record(DOWNLOAD, time.perf_counter() - download_start, 1, len(chunk))
+            if not _put_chunk(chunks, chunk, stopped):
+                return
+        _put_chunk(chunks, None, stopped)
+    except Exception as e:
+        _put_chunk(chunks, e, stopped)
 
 
-def process_logs(download_directory: str, influxdb_client: InfluxDBClient, cloudstorage_bucket: Bucket,
-                 bucket_path: str):
+def iter_blob_lines(blob: Blob, chunk_size: int, buffer_chunks: int = STREAM_BUFFER_CHUNKS,
+                    start: int = 0) -> Iterator[bytes]:
     """
-    Processes a log file its contents.
-    Downloads the file if it's not already on disk.
+    Yields the lines of a blob from the byte offset start on, including the newline, while it's being downloaded.
+    The blob is downloaded in ranges of chunk_size bytes in a separate thread, which stops downloading when
+    buffer_chunks chunks haven't been processed yet.
     """
-    line_number = 0
-    to_save = []  # type: List[dict]
+    chunks = queue.Queue(maxsize=buffer_chunks)  # type: queue.Queue
+    stopped = threading.Event()
+    thread = threading.Thread(target=_download_chunks, args=(blob, chunk_size, chunks, stopped, start), daemon=True)
+    thread.start()
+    partial_line = []  # type: List[bytes]
+    stats = get_stats()
+    try:
+        while True:
+            stats.set_gauge('download_queue', chunks.qsize())
+            chunk = chunks.get()  # type: Union[bytes, Exception, None]
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            end = chunk.find(b'\n')
+            if end == -1:
+                partial_line.append(chunk)
+                continue
+            partial_line.append(chunk[:end + 1])
+            yield b''.join(partial_line)
+            line_start = end + 1
+            end = chunk.find(b'\n', line_start)
+            while end != -1:
+                yield chunk[line_start:end + 1]
+                line_start = end + 1
+                end = chunk.find(b'\n', line_start)
+            # The last line continues in the next chunk
+            partial_line = [chunk[line_start:]]
+        if any(partial_line):
+            yield b''.join(partial_line)
+    finally:
+        stopped.set()
+        thread.join()
 
-    blob = Blob(bucket_path, cloudstorage_bucket)
-    disk_path = os.path.join(download_directory, cloudstorage_bucket.name, bucket_path)
-    create_folder(os.path.dirname(disk_path))
-    if not os.path.exists(disk_path):
-        logging.info('Downloading %s', bucket_path)
-        blob.download_to_filename(disk_path)
-    logging.debug('Processing logs in file %s/%s', cloudstorage_bucket.name, bucket_path)
-    with open(disk_path) as file_obj:
-        logging.info('Processing %s', bucket_path)
-        file_obj.seek(0)
-        for line in file_obj:
+
+def _save_written_checkpoint(checkpoint_path: str, marks: Deque[Tuple[int, Checkpoint]], written: int,
+                             batch_sequence: int) -> None:
+    """Saves the last checkpoint of which every point before it has been written, once a batch is written"""
+    checkpoint = None
+    while marks and marks[0][0] <= written:
+        checkpoint = marks.popleft()[1]
+    if checkpoint:
+        checkpoint.batch_sequence = batch_sequence
+        save_checkpoint(checkpoint_path, checkpoint)
+
+
+def _add_progress(stats: Stats, reported: Tuple[int, int, int], line_number: int, point_count: int,
+                  offset: int) -> Tuple[int, int, int]:
+    """Adds the progress since the last time it was reported to the statistics"""
+    stats.add_progress(line_number - reported[0], point_count - reported[1], offset - reported[2])
+    return line_number, point_count, offset
+
+
+def _write_stats(writer: BackgroundWriter, stats: Stats) -> None:
+    lines = stats.flush_lines()
+    if lines:
+        writer.write(lines)
+
+
+def _aggregate(aggregator: Aggregator, points: Iterable[Point]) -> List[Point]:
+    """Returns the points that aren't aggregated, followed by the windows that were closed by these points"""
+    result = [point for point in points if not aggregator.add(point)]
+    if aggregator.due:
+        result.extend(aggregator.close_windows())
+    return result
+
+
+def _hand_off_windows(influxdb_client: InfluxDBClient, aggregator: Aggregator) -> int:
+    """
+    Hands the windows that are still open off to the next files and writes the ones of earlier files that are closed
+    by now. Windows that can't be written are handed off again. Returns the amount of points that were written.
+    """
+    windows, points = hand_off(aggregator)
+    if not points:
+        return 0
+    try:
+        with BackgroundWriter(influxdb_client) as writer:
+            writer.write([make_line(point) for point in points])
+    except Exception:
+        logging.exception('Failed to write %d aggregated windows, they are handed off again', len(points))
+        get_store().put(windows)
+        return 0
+    return len(points)
+
+
+def process_lines(influxdb_client: InfluxDBClient, lines: Iterable[bytes], name: str,
+                  prefilter: Optional[Prefilter] = None, checkpoint_path: Optional[str] = None,
+                  checkpoint: Optional[Checkpoint] = None) -> int:
+    """
+    Parses the lines, including their newline, and saves the resulting points. Returns the amount of points.
+    Lines that are rejected by the prefilter are skipped without being parsed.
+    Points that wait for the app id of their service are added once it's resolved, or at the end. When this fails,
+    they are dropped.
+    Points are written in the background while the next lines are parsed. This returns when everything is written,
+    or raises the error of the first write that failed.
+    With a checkpoint_path, a checkpoint is saved after every batch that is written. It points at the end of the last
+    line of which all points are written. The lines should start at the offset of checkpoint.
+    The statistics of this process are written along with the points every stats.settings.interval seconds.
+    When aggregation is enabled, the points of the aggregated measurements are counted per window. Windows that are
+    still open at the end are handed off to the next file. Checkpoints contain the open windows, so they are saved at
+    most every AGGREGATION_CHECKPOINT_INTERVAL seconds.
+    Points of the snapshot measurements are skipped when they didn't change, see log_parser.snapshots.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    offset = checkpoint.offset
+    line_number = checkpoint.line_number
+    batch_sequence = checkpoint.batch_sequence
+    # Progress that is already in the statistics
+    reported = (line_number, 0, offset)
+    # Points that were handed to the writer
+    written = 0
+    # Points that have to be written before a checkpoint can be saved, with that checkpoint
+    marks = deque()  # type: Deque[Tuple[int, Checkpoint]]
+    to_save = []  # type: List[bytes]
+    resolver = get_resolver()
+    stats = get_stats()
+    aggregator = get_aggregator(name)
+    if aggregator and checkpoint.aggregation:
+        aggregator.restore(checkpoint.aggregation)
+    # Time of the last checkpoint with the state of the aggregator
+    aggregation_marked = time.time()
+    with resolver.clearing_on_error(), BackgroundWriter(influxdb_client) as writer:
+        for line in lines:
             line_number += 1
+            offset += len(line)
             if line_number % 10000 == 0:
-                logging.info('Processing line %s of %s', line_number, bucket_path)
+                logging.info('Processing line %s of %s', line_number, name)
+            if prefilter and prefilter.skip(line):
+                continue
             try:
-                to_save.extend(analyze(line))
+                points = filter_unchanged(list(analyze(line)))
+                if aggregator:
+                    points = _aggregate(aggregator, points)
+                start = time.perf_counter()
+                to_save.extend(make_line(point) for point in points)
+                stats.record(BUILD, time.perf_counter() - start, len(points))
             except Exception:
                 logging.exception('Could not process line %s', line)
-            if len(to_save) > MAX_DB_ENTRIES_PER_RPC:
-                save_statistic_entries(influxdb_client, to_save[:MAX_DB_ENTRIES_PER_RPC])
-                to_save = to_save[MAX_DB_ENTRIES_PER_RPC:]
+            if resolver.ready:
+                drained = resolver.drain()
+                if aggregator:
+                    drained = _aggregate(aggregator, drained)
+                to_save.extend(make_line(point) for point in drained)
+            batch_size = writer.batch_size
+            if len(to_save) > batch_size:
+                on_written = None
+                if checkpoint_path:
+                    # Parked points of earlier lines aren't in to_save yet
+                    if not resolver.has_unwritten_points():
+                        if not aggregator:
+                            marks.append((written + len(to_save), Checkpoint(offset, line_number)))
+                        elif time.time() - aggregation_marked >= AGGREGATION_CHECKPOINT_INTERVAL:
+                            aggregation_marked = time.time()
+                            marks.append((written + len(to_save),
+                                          Checkpoint(offset, line_number, aggregation=aggregator.get_state())))
+                    on_written = partial(_save_written_checkpoint, checkpoint_path, marks, written + batch_size,
+                                         batch_sequence + 1)
+                start = time.perf_counter()
+                writer.write(to_save[:batch_size], on_written)
+                stats.record(FLUSH, time.perf_counter() - start, batch_size)
+                to_save = to_save[batch_size:]
+                written += batch_size
+                batch_sequence += 1
+                if stats.due:
+                    reported = _add_progress(stats, reported, line_number, written + len(to_save), offset)
+                    stats.set_gauge('writer_queue', writer.batches.qsize())
+                    stats.set_gauge('parked_services', len(resolver.parked))
+                    _write_stats(writer, stats)
+        drained = resolver.drain(resolver.config.wait)
+        if aggregator:
+            drained = _aggregate(aggregator, drained) + aggregator.close_windows()
+        to_save.extend(make_line(point) for point in drained)
+        point_count = written + len(to_save)
         if to_save:
-            save_statistic_entries(influxdb_client, to_save)
+            writer.write(to_save)
+        # The rest is written with the statistics of the next file of this process
+        _add_progress(stats, reported, line_number, point_count, offset)
+        if stats.due:
+            _write_stats(writer, stats)
+    if aggregator:
+        # Only once every point of this file is written, so that the windows aren't handed off twice when it's retried
+        point_count += _hand_off_windows(influxdb_client, aggregator)
+    if prefilter and prefilter.skipped:
+        logging.info('Skipped %s lines of %s without parsing them: %s', sum(prefilter.skipped.values()), name,
+                     dict(prefilter.skipped))
+    return point_count
+
+
+def get_checkpoint_path(download_directory: str, bucket_name: str, bucket_path: str) -> str:
+    checkpoint_path = os.path.join(download_directory, bucket_name, bucket_path + '.checkpoint')
+    create_folder(os.path.dirname(checkpoint_path))
+    return checkpoint_path
+
+
+def process_logs(download_directory: str, influxdb_client: InfluxDBClient, cloudstorage_bucket: Bucket,
+                 bucket_path: str, prefilter: Optional[Prefilter] = None, stream_chunk_size: int = 0):
+    """
+    Processes a log file its contents.
+    Downloads the file if it's not already on disk, or streams it in chunks of stream_chunk_size bytes when set.
+    When an earlier attempt saved a checkpoint, processing resumes from there.
+    """
+    checkpoint_path = get_checkpoint_path(download_directory, cloudstorage_bucket.name, bucket_path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint.offset:
+        logging.info('Resuming %s at line %s (byte %s)', bucket_path, checkpoint.line_number + 1, checkpoint.offset)
+    if stream_chunk_size:
+        blob = cloudstorage_bucket.get_blob(bucket_path)
+        if not blob:
+            raise Exception('File %s/%s does not exist' % (cloudstorage_bucket.name, bucket_path))
+        logging.info('Streaming %s', bucket_path)
+        lines = iter_blob_lines(blob, stream_chunk_size, start=checkpoint.offset)
+        process_lines(influxdb_client, lines, bucket_path, prefilter, checkpoint_path, checkpoint)
+        remove_checkpoint(checkpoint_path)
+        return
+    disk_path = download_log(download_directory, cloudstorage_bucket, bucket_path)
+    logging.debug('Processing logs in file %s/%s', cloudstorage_bucket.name, bucket_path)
+    # Lines are handled as bytes, only the values that end up in points are decoded
+    with open(disk_path, 'rb') as file_obj:
+        logging.info('Processing %s', bucket_path)
+        file_obj.seek(checkpoint.offset)
+        process_lines(influxdb_client, file_obj, bucket_path, prefilter, checkpoint_path, checkpoint)
+    remove_checkpoint(checkpoint_path)
     os.remove(disk_path)
+
+
+def process_log_range(influxdb_client: InfluxDBClient, disk_path: str, start: int, end: int,
+                      prefilter: Optional[Prefilter] = None):
+    """
+    Processes the lines of a downloaded log file between the byte offsets start and end.
+    When an earlier attempt saved a checkpoint, processing resumes from there.
+    """
+    name = '%s[%d:%d]' % (disk_path, start, end)
+    checkpoint_path = '%s.%d-%d.checkpoint' % (disk_path, start, end)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint.offset:
+        logging.info('Resuming %s at line %s (byte %s)', name, checkpoint.line_number + 1, checkpoint.offset)
+    else:
+        checkpoint = Checkpoint(start)
+    logging.info('Processing %s', name)
+    process_lines(influxdb_client, iter_file_lines(disk_path, checkpoint.offset, end), name, prefilter, checkpoint_path,
+                  checkpoint)
+    remove_checkpoint(checkpoint_path)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import logging
+import os
+from typing import Union
+
+
+class Checkpoint(object):
+    """Position in a log file up to which every point has been written to InfluxDB"""
+
+    def __init__(self, offset: int = 0, line_number: int = 0, batch_sequence: int = 0,
+                 aggregation: Union[dict, None] = None) -> None:
+        self.offset = offset  # type: int # byte offset of the first line that still needs processing
+        self.line_number = line_number  # type: int # lines before that offset
+        self.batch_sequence = batch_sequence  # type: int # batches that were written before that offset
+        # State of the aggregator at that offset, see Aggregator.get_state
+        self.aggregation = aggregation  # type: Union[dict, None]
+
+    def to_dict(self) -> dict:
+        return {'offset': self.offset, 'line_number': self.line_number, 'batch_sequence': self.batch_sequence,
+                'aggregation': self.aggregation}
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """Returns the checkpoint that was saved at path, or a checkpoint at the start of the file"""
+    if not os.path.exists(path):
+        return Checkpoint()
+    try:
+        with open(path, 'r') as f:
+            content = json.load(f)
+        return Checkpoint(content['offset'], content['line_number'], content['batch_sequence'],
+                          content.get('aggregation'))
+    except (ValueError, KeyError):
+        logging.warning('Ignoring invalid checkpoint %s', path)
+        return Checkpoint()
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    # Replaced in one step, so a crash while saving leaves the previous checkpoint
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def remove_checkpoint(path: Union[str, None]) -> None:
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 # @@license_version:1.4@@
-from typing import List
+from typing import Dict, List, Union
 
 
 class InfluxConfig(object):
@@ -25,6 +25,123 @@ class InfluxConfig(object):
         self.ssl = config.get('ssl', False)  # type: bool
         self.username = config.get('username')  # type: str
         self.password = config.get('password')  # type: str
+        # Lines per write request. It's adapted between the minimum and maximum to keep writes close to target_latency.
+        self.batch_size = config.get('batch_size', 500)  # type: int
+        self.min_batch_size = config.get('min_batch_size', 100)  # type: int
+        self.max_batch_size = config.get('max_batch_size', 5000)  # type: int
+        self.target_latency = config.get('target_latency', 1.0)  # type: float
+        self.gzip = config.get('gzip', True)  # type: bool
+
+
+class DecodeConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Lines of at least this many bytes are decoded with a projection on the fields that are read, 0 to never do
+        # that. It uses about half the memory of json.loads on such lines, but 1.2 to 3.4 times the CPU time.
+        # Projection is only used with the C backend of ijson.
+        self.projection_min_size = config.get('projection_min_size', 64 * 1024)  # type: int
+
+
+class PrefilterConfig(object):
+    def __init__(self, config: dict) -> None:
+        self.enabled = config.get('enabled', True)  # type: bool
+        # Defaults to prefilter.DEFAULT_SKIP_TYPES
+        self.skip_types = config.get('skip_types')  # type: Union[List[str], None]
+        self.skip_untyped = config.get('skip_untyped', True)  # type: bool
+
+
+class ResolverConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Returns {"app_id": ...} for a GET request with the service hash in the 'user' parameter
+        self.url = config.get('url', 'https://rogerth.at/unauthenticated/service-app')  # type: str
+        # SQLite database that caches the app ids for all processes. Defaults to service_apps.sqlite in the data path.
+        self.cache_path = config.get('cache_path')  # type: Union[str, None]
+        self.ttl = config.get('ttl', 7 * 86400)  # type: int
+        self.max_entries = config.get('max_entries', 100000)  # type: int
+        self.timeout = config.get('timeout', 5.0)  # type: float
+        # Lookups that run at the same time
+        self.concurrency = config.get('concurrency', 4)  # type: int
+        # Seconds to wait for the lookups of points that are still parked when a file is done
+        self.wait = config.get('wait', 30.0)  # type: float
+
+
+class SchedulerConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Files in the worker pool at the same time, 0 for twice the amount of processes
+        self.max_in_flight = config.get('max_in_flight', 0)  # type: int
+        # Files of the same bucket in the worker pool at the same time, 0 for no limit
+        self.bucket_limit = config.get('bucket_limit', 0)  # type: int
+        # Waiting files above which the largest files are processed first instead of the oldest
+        self.backfill_threshold = config.get('backfill_threshold', 100)  # type: int
+
+
+class StatsConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Writes the counters and timers of every stage of the parser to InfluxDB
+        self.enabled = config.get('enabled', True)  # type: bool
+        self.measurement = config.get('measurement', 'log_parser.stats')  # type: str
+        # Seconds between writes of the statistics of a process
+        self.interval = config.get('interval', 10)  # type: int
+
+
+class ProfilingConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Patterns like 'bucket/2018-10-02 *' or '*/logs.json' of files that are profiled
+        self.files = config.get('files', [])  # type: List[str]
+        # Fraction of the files that is profiled, always the same ones for the same fraction
+        self.sample_rate = config.get('sample_rate', 0.0)  # type: float
+        # Process id of a worker of which every file is profiled, 0 for none
+        self.worker = config.get('worker', 0)  # type: int
+        # Directory for the profiles and their summaries. Defaults to profiles in the data path.
+        self.output_path = config.get('output_path')  # type: Union[str, None]
+        # Functions in the summaries
+        self.top = config.get('top', 30)  # type: int
+
+
+class AggregationConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Points of these measurements are counted per window instead of written one by one, with sketches of the
+        # numeric fields in the lists
+        self.enabled = config.get('enabled', False)  # type: bool
+        self.measurements = config.get('measurements', {
+            'rogerthat.callback_api': [],
+            'rogerthat.client_call': [],
+            'rogerthat.messages': [],
+            'request-info': ['latency', 'response_size', 'megaCycles'],
+        })  # type: Dict[str, List[str]]
+        # Aggregated points are written to the measurement with this suffix
+        self.suffix = config.get('suffix', '.aggregated')  # type: str
+        # Seconds per window
+        self.window = config.get('window', 60)  # type: int
+        # Seconds after the end of a window, in the time of the points, after which the window is written
+        self.lateness = config.get('lateness', 600)  # type: int
+        self.quantiles = config.get('quantiles', [0.5, 0.9, 0.99])  # type: List[float]
+        # Write the points that are aggregated as well
+        self.keep_raw = config.get('keep_raw', False)  # type: bool
+        # SQLite database with the windows that were still open at the end of a file, shared by all processes.
+        # Defaults to aggregation.sqlite in the data path.
+        self.state_path = config.get('state_path')  # type: Union[str, None]
+
+
+class SnapshotConfig(object):
+    def __init__(self, config: dict) -> None:
+        # Points of these periodic snapshots are only written when their fields changed since the last snapshot
+        self.enabled = config.get('enabled', False)  # type: bool
+        self.measurements = config.get('measurements', [
+            'rogerthat.all_users',
+            'rogerthat.total_services',
+            'rogerthat.created_apps',
+            'rogerthat.released_apps',
+            'oca.active_modules',
+            'oca.custom_loyalty_cards',
+        ])  # type: List[str]
+        # Seconds after which a point is written again even when it didn't change, so every series has recent data
+        self.heartbeat = config.get('heartbeat', 86400)  # type: int
+        # Seconds of snapshots that are kept before the latest snapshot that was seen. Should be longer than the
+        # heartbeat.
+        self.history = config.get('history', 30 * 86400)  # type: int
+        # SQLite database with the recent snapshots of every series, shared by all processes.
+        # Defaults to snapshots.sqlite in the data path.
+        self.state_path = config.get('state_path')  # type: Union[str, None]
 
 
 class LogParserConfig(object):
@@ -33,3 +150,22 @@ class LogParserConfig(object):
         self.influxdb = InfluxConfig(config.get('influxdb', {}))  # type: InfluxConfig
         self.debug = config.get('debug', False)  # type: bool
         self.interval = config.get('interval', 120)  # type: int
+        # Hours before the last log folder of a bucket that are listed again, for files that are uploaded late
+        self.listing_overlap = config.get('listing_overlap', 2)  # type: int
+        # Processed files in log folders this many hours before the last log folder of a bucket are folded into a
+        # single record, 0 to keep every file. Never less than listing_overlap.
+        self.compaction_horizon = config.get('compaction_horizon', 0)  # type: int
+        self.decode = DecodeConfig(config.get('decode', {}))  # type: DecodeConfig
+        self.prefilter = PrefilterConfig(config.get('prefilter', {}))  # type: PrefilterConfig
+        self.resolver = ResolverConfig(config.get('resolver', {}))  # type: ResolverConfig
+        self.scheduler = SchedulerConfig(config.get('scheduler', {}))  # type: SchedulerConfig
+        self.stats = StatsConfig(config.get('stats', {}))  # type: StatsConfig
+        self.aggregation = AggregationConfig(config.get('aggregation', {}))  # type: AggregationConfig
+        self.snapshots = SnapshotConfig(config.get('snapshots', {}))  # type: SnapshotConfig
+        # Overridden by profiling.json in the data path while the log parser is running, see log_parser.profiling
+        self.profiling = ProfilingConfig(config.get('profiling', {}))  # type: ProfilingConfig
+        # Split files in ranges of this many bytes that are processed in parallel, 0 to process every file as a whole
+        self.chunk_size = config.get('chunk_size', 0)  # type: int
+        # Stream files from cloud storage in ranges of this many bytes instead of downloading them first, 0 to download
+        # them to disk. Not used when files are processed in chunks.
+        self.stream_chunk_size = config.get('stream_chunk_size', 0)  # type: int
@@ -16,10 +16,12 @@
 # @@license_version:1.4@@
 
 import json
+import logging
 import os
+import sqlite3
 import typing
 
-from log_parser.models import LogParserSettings, LogFile, LogParserFile
+from log_parser.models import LogFile, LogParserFile
 
 
 def touch(path):
@@ -36,33 +38,109 @@ def create_folder(directory):
             pass
 
 
-# todo: use a database (mysql or something)
 class DatabaseConnection(object):
-    root_dir = None
+    """
+    State of the log parser: the files that were found in the buckets, whether they are processed and the watermarks
+    of the listings. Stored in a SQLite database in root_dir.
+    """
 
-    def __init__(self, root_dir) -> None:
-        self.root_dir = os.path.realpath(root_dir)
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = os.path.realpath(root_dir)  # type: str
+        create_folder(self.root_dir)
+        self.connection = sqlite3.connect(os.path.join(self.root_dir, 'state.sqlite'))
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files (bucket TEXT NOT NULL, name TEXT NOT NULL, '
+                                    'processed_timestamp INTEGER, size INTEGER, PRIMARY KEY (bucket, name))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS unprocessed_files ON files (bucket, name) '
+                                    'WHERE processed_timestamp IS NULL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS watermarks (bucket TEXT PRIMARY KEY, '
+                                    'folder TEXT NOT NULL)')
+            # Processed files that were folded together by compact(), by the first and last log folder of the range
+            self.connection.execute('CREATE TABLE IF NOT EXISTS compacted_ranges (bucket TEXT NOT NULL, '
+                                    'first_folder TEXT NOT NULL, last_folder TEXT NOT NULL, '
+                                    'file_count INTEGER NOT NULL, processed_timestamp INTEGER, '
+                                    'PRIMARY KEY (bucket, last_folder))')
+            self._add_size_column()
+        self._migrate_settings()
 
-    def get_settings(self) -> LogParserSettings:
-        f_path = os.path.join(self.root_dir, 'settings.json')
-        if not os.path.exists(f_path):
-            return LogParserSettings([])
-        with open(f_path, 'r') as f:
-            file_content = json.load(f)
-            settings = LogParserSettings([LogParserFile(f['name'], f['processed_timestamp'], f['bucket'])
-                                          for f in file_content.get('files', [])])
-        return settings
+    def _add_size_column(self) -> None:
+        """Adds the size of the files to a database that was created before the size was stored"""
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+        if 'size' not in columns:
+            self.connection.execute('ALTER TABLE files ADD COLUMN size INTEGER')
 
-    def save_settings(self, settings: LogParserSettings) -> LogParserSettings:
-        # in case process is killed when writing we still have a backup
-        tmp_path = os.path.join(self.root_dir, 'settings.json.tmp')
+    def _migrate_settings(self) -> None:
+        """Imports settings.json, which was used before the database"""
         settings_path = os.path.join(self.root_dir, 'settings.json')
-        content = {'files': [f.to_dict() for f in settings.files]}
-        with open(tmp_path, 'w') as f:
-            json.dump(content, f)
-        with open(settings_path, 'w') as f:
-            json.dump(content, f)
-        return settings
+        if not os.path.exists(settings_path):
+            return
+        with open(settings_path, 'r') as f:
+            file_content = json.load(f)
+        files = [LogParserFile(f['name'], f['processed_timestamp'], f['bucket']) for f in file_content.get('files', [])]
+        with self.connection:
+            self._insert_files(files)
+            self._set_watermarks(file_content.get('watermarks', {}))
+        os.replace(settings_path, settings_path + '.migrated')
+        logging.info('Migrated %s files from %s', len(files), settings_path)
+
+    def _insert_files(self, files: typing.Iterable[LogParserFile]) -> None:
+        self.connection.executemany('INSERT OR IGNORE INTO files (bucket, name, processed_timestamp, size) '
+                                    'VALUES (?, ?, ?, ?)', ((f.bucket, f.name, f.processed_timestamp, f.size)
+                                                            for f in files))
+
+    def _set_watermarks(self, watermarks: typing.Dict[str, str]) -> None:
+        self.connection.executemany('INSERT OR REPLACE INTO watermarks (bucket, folder) VALUES (?, ?)',
+                                    watermarks.items())
+
+    def add_files(self, files: typing.List[LogParserFile], watermarks: typing.Dict[str, str]) -> None:
+        """Saves newly found files together with the watermarks of the listing that found them"""
+        with self.connection:
+            self._insert_files(files)
+            self._set_watermarks(watermarks)
+
+    def set_processed(self, bucket: str, name: str, timestamp: int) -> None:
+        with self.connection:
+            self.connection.execute('UPDATE files SET processed_timestamp = ? WHERE bucket = ? AND name = ?',
+                                    (timestamp, bucket, name))
+
+    def get_unprocessed_files(self) -> typing.List[LogParserFile]:
+        return [LogParserFile(name, None, bucket, size) for bucket, name, size in self.connection.execute(
+            'SELECT bucket, name, size FROM files WHERE processed_timestamp IS NULL ORDER BY bucket, name')]
+
+    def get_file_names(self, bucket: str, start: typing.Optional[str] = None) -> typing.Set[str]:
+        """Returns the names of the known files of a bucket, from start on"""
+        return {name for name, in self.connection.execute('SELECT name FROM files WHERE bucket = ? AND name >= ?',
+                                                          (bucket, start or ''))}
+
+    def get_watermarks(self) -> typing.Dict[str, str]:
+        return dict(self.connection.execute('SELECT bucket, folder FROM watermarks'))
+
+    def get_compacted_folder(self, bucket: str) -> typing.Union[str, None]:
+        """Returns the last log folder of which all files are processed and compacted"""
+        return self.connection.execute('SELECT MAX(last_folder) FROM compacted_ranges WHERE bucket = ?',
+                                       (bucket,)).fetchone()[0]
+
+    def compact(self, bucket: str, before_folder: str) -> int:
+        """
+        Replaces the files in the log folders before before_folder by a single range record, up to the first folder
+        that still has a file that isn't processed. Returns the amount of files that were compacted.
+        """
+        with self.connection:
+            first_unprocessed = self.connection.execute(
+                'SELECT MIN(name) FROM files WHERE bucket = ? AND processed_timestamp IS NULL AND name < ?',
+                (bucket, before_folder)).fetchone()[0]
+            if first_unprocessed is not None:
+                before_folder = first_unprocessed.split('/')[0]
+            first_name, last_name, file_count, processed_timestamp = self.connection.execute(
+                'SELECT MIN(name), MAX(name), COUNT(*), MAX(processed_timestamp) FROM files '
+                'WHERE bucket = ? AND name < ?', (bucket, before_folder)).fetchone()
+            if not file_count:
+                return 0
+            self.connection.execute('INSERT INTO compacted_ranges VALUES (?, ?, ?, ?, ?)',
+                                    (bucket, first_name.split('/')[0], last_name.split('/')[0], file_count,
+                                     processed_timestamp))
+            self.connection.execute('DELETE FROM files WHERE bucket = ? AND name < ?', (bucket, before_folder))
+        return file_count
 
     def get_all_processed_logs(self, year: str) -> typing.List[str]:
         all_dirs = []
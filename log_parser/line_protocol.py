@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import calendar
+import math
+import time
+from functools import lru_cache
+from typing import Any, Union
+
+from log_parser.point import Items, Point
+
+# Precision of the timestamps in the lines: microseconds
+TIME_PRECISION = 'u'
+TIME_UNITS_PER_SECOND = 1000000
+
+
+@lru_cache(maxsize=4096)
+def escape_key(key: str) -> str:
+    """Escapes measurement names, tag keys and field keys"""
+    return key.replace('\\', '\\\\').replace(' ', '\\ ').replace(',', '\\,').replace('=', '\\=')
+
+
+@lru_cache(maxsize=65536)
+def escape_tag_value(value: Any) -> str:
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    escaped = escape_key(str(value))
+    if escaped.endswith('\\'):
+        escaped += ' '
+    return escaped
+
+
+def escape_field_value(value: Any) -> str:
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        if not value:
+            return ''
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    if isinstance(value, int) and not isinstance(value, bool):
+        return '%di' % value
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+@lru_cache(maxsize=4096)
+def parse_time(value: str) -> int:
+    """Converts an ISO 8601 UTC time like 2018-10-02T07:37:59.713854Z to an epoch timestamp in TIME_PRECISION"""
+    date_time, _, fraction = value.rstrip('Z').partition('.')
+    seconds = calendar.timegm(time.strptime(date_time, '%Y-%m-%dT%H:%M:%S'))
+    return seconds * TIME_UNITS_PER_SECOND + int((fraction + '000000')[:6])
+
+
+def from_epoch(seconds: Union[int, float]) -> int:
+    """
+    Converts an epoch timestamp in seconds to TIME_PRECISION, rounded the same way as datetime.utcfromtimestamp.
+    """
+    if isinstance(seconds, int):
+        return seconds * TIME_UNITS_PER_SECOND
+    fraction, whole = math.modf(seconds)
+    return int(whole) * TIME_UNITS_PER_SECOND + round(fraction * TIME_UNITS_PER_SECOND)
+
+
+@lru_cache(maxsize=65536)
+def get_series_key(measurement: str, tags: Items) -> str:
+    """Returns the escaped measurement and tags of a point, which is the same for every point of a series"""
+    key_values = [escape_key(measurement)]
+    for key, value in tags:
+        if value is not None:
+            value = escape_tag_value(value)
+            if value:
+                key_values.append(escape_key(key) + '=' + value)
+    return ','.join(key_values)
+
+
+def make_line(point: Point) -> bytes:
+    """
+    Serializes a point to a line of the InfluxDB line protocol, without newline.
+    Tags and fields without a value are left out, like influxdb.line_protocol.make_lines does.
+    """
+    fields = []
+    for key, value in point.fields:
+        if value is not None:
+            value = escape_field_value(value)
+            if value:
+                fields.append(escape_key(key) + '=' + value)
+    line = get_series_key(point.measurement, point.tags) + ' ' + ','.join(fields)
+    if point.time is not None:
+        line += ' %d' % point.time
+    return line.encode('utf-8', 'replace')
@@ -14,22 +14,19 @@
 # limitations under the License.
 #
 # @@license_version:1.4@@
-from typing import Union, List
+from typing import Union
 
 
 class LogParserFile(object):
-    def __init__(self, name: str, processed_timestamp: Union[int, None], bucket: str):
+    def __init__(self, name: str, processed_timestamp: Union[int, None], bucket: str, size: Union[int, None] = None):
         self.name = name
         self.processed_timestamp = processed_timestamp
         self.bucket = bucket
+        self.size = size
 
     def to_dict(self):
-        return {'name': self.name, 'processed_timestamp': self.processed_timestamp, 'bucket': self.bucket}
-
-
-class LogParserSettings(object):
-    def __init__(self, files: List[LogParserFile]) -> None:
-        self.files = files
+        return {'name': self.name, 'processed_timestamp': self.processed_timestamp, 'bucket': self.bucket,
+                'size': self.size}
 
 
 class LogFile(object):
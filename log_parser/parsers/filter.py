@@ -16,13 +16,91 @@
 # @@license_version:1.4@@
 from collections import defaultdict
 from types import FunctionType
-from typing import Dict, List
+from typing import Dict, List, Iterator, Any, Union
+
+from log_parser.point import Point
+from log_parser.projection import Projection, ARRAY_ITEM
 
 registry: Dict[str, List[FunctionType]] = defaultdict(list)
+# Paths (relative to the key) that are read by each filter, None when the filter needs the whole object
+fields_registry: Dict[str, List[Union[List[str], None]]] = defaultdict(list)
+
+
+class PathIndex(object):
+    """
+    Prefix trie of the paths in the registry.
+    Paths use the same notation as ijson prefixes: keys are separated by dots and 'item' stands for every element of
+    an array, e.g. 'request_data.params.user_details' or 'protoPayload.line.item'.
+    """
+
+    def __init__(self) -> None:
+        self.listeners = []  # type: List[FunctionType]
+        self.children = {}  # type: Dict[str, PathIndex]
+
+    def add(self, path: str, func: FunctionType) -> None:
+        node = self
+        for key in path.split('.') if path else []:
+            node = node.children.setdefault(key, PathIndex())
+        node.listeners.append(func)
+
+    def dispatch(self, value: Any) -> Iterator[Point]:
+        """
+        Calls the listeners with the objects at their path. Only the subscribed branches of value are visited.
+        Like before, nested objects are handled before the object that contains them.
+        """
+        if self.children:
+            if isinstance(value, list):
+                child = self.children.get(ARRAY_ITEM)
+                if child:
+                    for item in value:
+                        yield from child.dispatch(item)
+            elif isinstance(value, dict):
+                for key, child in self.children.items():
+                    if key in value:
+                        yield from child.dispatch(value[key])
+        if self.listeners and isinstance(value, dict):
+            for func in self.listeners:
+                yield from func(value)
+
+
+_index: Union[PathIndex, None] = None
+_projection: Union[Projection, None] = None
+
+
+def get_index() -> PathIndex:
+    """Returns the registry compiled into a PathIndex"""
+    global _index
+    if _index is None:
+        index = PathIndex()
+        for path, funcs in registry.items():
+            for func in funcs:
+                index.add(path, func)
+        _index = index
+    return _index
+
+
+def get_projection() -> Projection:
+    """Returns the projection of all paths that are read by the registered filters"""
+    global _projection
+    if _projection is None:
+        paths = []
+        for key, fields_list in fields_registry.items():
+            for fields in fields_list:
+                if fields is None:
+                    paths.append(key)
+                else:
+                    paths.extend('%s.%s' % (key, field) if key else field for field in fields)
+        _projection = Projection.from_paths(paths)
+    return _projection
 
 
-def request_filter(key):
+def request_filter(key, fields=None):
     def wrap(func):
+        global _index, _projection
         registry[key].append(func)
+        fields_registry[key].append(fields)
+        _index = None
+        _projection = None
+        return func
     return wrap
 
@@ -17,6 +17,7 @@
 from typing import Iterator
 
 from log_parser.parsers.rogerthat import _get_time
+from log_parser.point import Point
 
 
 class Measurements(object):
@@ -24,32 +25,32 @@ class Measurements(object):
     CUSTOM_LOYALTY_CARDS = 'oca.custom_loyalty_cards'
 
 
-def active_modules(value: dict) -> Iterator[dict]:
+def active_modules(value: dict) -> Iterator[Point]:
     for app_id, values in value.get('request_data', {}).items():
         for module, amount in values.items():
-            yield {
-                'measurement': Measurements.ACTIVE_MODULES,
-                'tags': {
+            yield Point(
+                measurement=Measurements.ACTIVE_MODULES,
+                tags={
                     'module': module,
                     'app': app_id
                 },
-                'time': _get_time(value),
-                'fields': {
+                time=_get_time(value),
+                fields={
                     'amount': amount
                 }
-            }
+            )
 
 
-def custom_loyalty_cards(value: dict) -> Iterator[dict]:
+def custom_loyalty_cards(value: dict) -> Iterator[Point]:
     for stats in value.get('request_data', []):
-        yield {
-            'measurement': Measurements.CUSTOM_LOYALTY_CARDS,
-            'tags': {
+        yield Point(
+            measurement=Measurements.CUSTOM_LOYALTY_CARDS,
+            tags={
                 'country': stats['country'],
                 'app': stats['app_id']
             },
-            'time': _get_time(value),
-            'fields': {
+            time=_get_time(value),
+            fields={
                 'amount': stats['amount']
             }
-        }
+        )
@@ -14,16 +14,14 @@
 # limitations under the License.
 #
 # @@license_version:1.4@@
-from datetime import datetime
-from typing import Iterator, Dict, Any
+from typing import Iterator
 from urllib.parse import urlparse
 
+from log_parser.line_protocol import from_epoch, parse_time
+from log_parser.point import Point
 
-def encode(text):
-    return text and text.encode('utf-8', 'replace')
 
-
-def process(value: dict) -> Iterator[Dict[str, Any]]:
+def process(value: dict) -> Iterator[Point]:
     request_info = value['data']
     tags = {
         'project': request_info.get('app_id'),  # e.g. e~rogerthat-server,
@@ -33,7 +31,7 @@ def process(value: dict) -> Iterator[Dict[str, Any]]:
         'host': request_info['host'],  # e.g. version-xxx.rogerthat-server.appspot.com
         'resource': urlparse(request_info['resource']).path,  # strip query parameters
         'ip': request_info['ip'],
-        'user_agent': encode(request_info['user_agent']),
+        'user_agent': request_info['user_agent'],
         'latency': float(request_info['latency']),
         'status': int(request_info['status']),
         'megaCycles': int(request_info['mcycles']),
@@ -43,15 +41,15 @@ def process(value: dict) -> Iterator[Dict[str, Any]]:
         tags['task_queue_name'] = request_info['task_queue_name']
         fields['task_name'] = request_info['task_name']
         fields['task_retry_count'] = int(request_info.get('task_retry_count', 0))
-    yield {
-        'measurement': 'request-info',
-        'tags': tags,
-        'time': datetime.utcfromtimestamp(request_info['start_time']).isoformat() + 'Z',
-        'fields': fields
-    }
+    yield Point(
+        measurement='request-info',
+        tags=tags,
+        time=from_epoch(request_info['start_time']),
+        fields=fields
+    )
 
 
-def process_request_log(request_log: dict) -> Iterator[Dict[str, Any]]:
+def process_request_log(request_log: dict) -> Iterator[Point]:
     proto_payload = request_log['protoPayload']
     tags = {
         'project': proto_payload.get('appId'),  # e.g. e~rogerthat-server,
@@ -71,7 +69,7 @@ def process_request_log(request_log: dict) -> Iterator[Dict[str, Any]]:
         'status': int(proto_payload['status']),
     }
     if 'userAgent' in proto_payload:
-        fields['user_agent'] = encode(proto_payload['userAgent'])
+        fields['user_agent'] = proto_payload['userAgent']
     if 'responseSize' in proto_payload:
         fields['response_size'] = int(proto_payload['responseSize'])
     if 'megaCycles' in proto_payload:
@@ -87,9 +85,9 @@ def process_request_log(request_log: dict) -> Iterator[Dict[str, Any]]:
         tags['task_queue_name'] = proto_payload['taskQueueName']
         fields['task_name'] = proto_payload['taskName']
         fields['task_retry_count'] = retry_count
-    yield {
-        'measurement': 'request-info',
-        'tags': tags,
-        'time': proto_payload['startTime'],
-        'fields': fields
-    }
+    yield Point(
+        measurement='request-info',
+        tags=tags,
+        time=parse_time(proto_payload['startTime']),
+        fields=fields
+    )
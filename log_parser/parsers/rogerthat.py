@@ -16,19 +16,16 @@
 # @@license_version:1.4@@
 import json
 import re
-from datetime import datetime
-from functools import lru_cache
 from json import JSONDecodeError
-from typing import Union, Iterator, Any
+from typing import Union, Iterator
 
-import certifi
-import urllib3
+from log_parser.line_protocol import from_epoch
+from log_parser.point import Point
+from log_parser.resolver import get_resolver
 
 HUMAN_READABLE_TAG_REGEX = re.compile('(.*?)\\s*{.*\\}')
 UNKNOWN = 'unknown'
 
-poolmngr = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-
 
 class Measurements(object):
     ALL_USERS = 'rogerthat.all_users'
@@ -41,8 +38,8 @@ class Measurements(object):
     TOTAL_SERVICES = 'rogerthat.total_services'
 
 
-def _get_time(value: dict) -> str:
-    return datetime.utcfromtimestamp(value['timestamp']).isoformat() + 'Z'
+def _get_time(value: dict) -> int:
+    return from_epoch(value['timestamp'])
 
 
 def parse_to_human_readable_tag(tag: str) -> Union[str, None]:
@@ -63,7 +60,7 @@ def parse_to_human_readable_tag(tag: str) -> Union[str, None]:
     return tag
 
 
-def callback_api(value: dict) -> Iterator[Any]:
+def callback_api(value: dict) -> Iterator[Point]:
     request_data = value.get('request_data', {})
     function_type = value.get('function') or request_data.get('method')
     timestamp = _get_time(value)
@@ -87,18 +84,18 @@ def callback_api(value: dict) -> Iterator[Any]:
     }
     if function_type == 'system.api_call':
         tags['method'] = params.get('method')
-    yield {
-        'measurement': Measurements.CALLBACK_API,
-        'tags': tags,
-        'time': timestamp,
-        'fields': {
+    yield Point(
+        measurement=Measurements.CALLBACK_API,
+        tags=tags,
+        time=timestamp,
+        fields={
             'user': user_email,
             'service': value.get('user')
         }
-    }
+    )
 
 
-def app(value: dict) -> Iterator[Any]:
+def app(value: dict) -> Iterator[Point]:
     # {
     #   "timestamp": 1518603982,
     #   "request_data": {
@@ -146,33 +143,33 @@ def app(value: dict) -> Iterator[Any]:
     for request in request_data.get('r', []):
         if request.get('item', {}).get('r'):
             if request['item']['r'].keys() == ['received_timestamp']:
-                yield {
-                    'measurement': Measurements.MESSAGES,
-                    'tags': {
+                yield Point(
+                    measurement=Measurements.MESSAGES,
+                    tags={
                         'app': app_id,
                     },
-                    'time': _get_time(value),
-                    'fields': {
+                    time=_get_time(value),
+                    fields={
                         'user': user
                     }
-                }
+                )
     client_calls = value.get('response_data', {}).get('c', []) + request_data.get('c', [])
     for call in client_calls:
         if 't' in call:
-            yield {
-                'measurement': Measurements.CLIENT_CALL,
-                'tags': {
+            yield Point(
+                measurement=Measurements.CLIENT_CALL,
+                tags={
                     'app': app_id,
                     'type': call.get('f', UNKNOWN)
                 },
-                'time': datetime.utcfromtimestamp(int(call['t'])).isoformat() + 'Z',
-                'fields': {
+                time=from_epoch(int(call['t'])),
+                fields={
                     'user': user
                 }
-            }
+            )
 
 
-def api(value: dict) -> Iterator[Any]:
+def api(value: dict) -> Iterator[Point]:
     # value = {
     #     u'function': u'system.get_identity',
     #     u'success': True,
@@ -190,37 +187,33 @@ def api(value: dict) -> Iterator[Any]:
     }
 
     if 'user' in value:
-        tags['app_id'] = _get_app_id_by_service_hash(value['user'])
         fields['service'] = value['user']
-    yield {
-        'measurement': Measurements.API_CALLS,
-        'tags': tags,
-        'time': _get_time(value),
-        'fields': fields
-    }
-
-
-def web(value: dict) -> Iterator[dict]:
+        resolver = get_resolver()
+        app_id = resolver.get_app_id(value['user'])
+        if app_id is None:
+            # Emitted by resolver.drain() once the app id is known
+            resolver.park(value['user'], Measurements.API_CALLS, tags, _get_time(value), fields)
+            return
+        tags['app_id'] = app_id
+    yield Point(
+        measurement=Measurements.API_CALLS,
+        tags=tags,
+        time=_get_time(value),
+        fields=fields
+    )
+
+
+def web(value: dict) -> Iterator[Point]:
     # We actually don't care for this
     yield from []
 
 
-def web_channel(value: dict) -> Iterator[dict]:
+def web_channel(value: dict) -> Iterator[Point]:
     # We actually don't care for this
     yield from []
 
 
-@lru_cache(maxsize=1000)
-def _get_app_id_by_service_hash(service_hash: str) -> Union[str, None]:
-    url = 'https://rogerth.at/unauthenticated/service-app'
-    fields = {'user': service_hash}
-    res = poolmngr.request('GET', url, fields)  # type: urllib3.HTTPResponse
-    if res.status != 200:
-        raise Exception('Failed to get app_id for service hash %s', service_hash)
-    return json.loads(res.data)['app_id']
-
-
-def created_apps(value: dict) -> Iterator[dict]:
+def created_apps(value: dict) -> Iterator[Point]:
     # value = {
     #     "request_data": {
     #         "YSAAA": {"BE": 1},
@@ -233,20 +226,20 @@ def created_apps(value: dict) -> Iterator[dict]:
     # }
     for app_type, values in value.get('request_data', {}).items():
         for country_code, amount in values.items():
-            yield {
-                'measurement': Measurements.CREATED_APPS,
-                'tags': {
+            yield Point(
+                measurement=Measurements.CREATED_APPS,
+                tags={
                     'type': app_type,
                     'country': country_code
                 },
-                'time': _get_time(value),
-                'fields': {
+                time=_get_time(value),
+                fields={
                     'amount': amount
                 }
-            }
+            )
 
 
-def released_apps(value: dict) -> Iterator[dict]:
+def released_apps(value: dict) -> Iterator[Point]:
     # value = {
     #     "request_data": {
     #         "YSAAA": {"BE": 1},
@@ -258,44 +251,44 @@ def released_apps(value: dict) -> Iterator[dict]:
     # }
     for app_type, values in value.get('request_data', {}).items():
         for country_code, amount in values.items():
-            yield {
-                'measurement': Measurements.RELEASED_APPS,
-                'tags': {
+            yield Point(
+                measurement=Measurements.RELEASED_APPS,
+                tags={
                     'type': app_type,
                     'country': country_code
                 },
-                'time': _get_time(value),
-                'fields': {
+                time=_get_time(value),
+                fields={
                     'amount': amount
                 }
-            }
+            )
 
 
-def all_users(value: dict) -> Iterator[dict]:
+def all_users(value: dict) -> Iterator[Point]:
     for app_id, amount in value.get('request_data', {}).items():
-        yield {
-            'measurement': Measurements.ALL_USERS,
-            'tags': {
+        yield Point(
+            measurement=Measurements.ALL_USERS,
+            tags={
                 'app': app_id,
             },
-            'time': _get_time(value),
-            'fields': {
+            time=_get_time(value),
+            fields={
                 'amount': amount
             }
-        }
+        )
 
 
-def total_services(value: dict) -> Iterator[dict]:
+def total_services(value: dict) -> Iterator[Point]:
     for app_id, values in value.get('request_data', {}).items():
         for organization_type, amount in values.items():
-            yield {
-                'measurement': Measurements.TOTAL_SERVICES,
-                'tags': {
+            yield Point(
+                measurement=Measurements.TOTAL_SERVICES,
+                tags={
                     'type': organization_type,
                     'app': app_id
                 },
-                'time': _get_time(value),
-                'fields': {
+                time=_get_time(value),
+                fields={
                     'amount': amount
                 }
-            }
+            )
@@ -16,6 +16,8 @@
 # @@license_version:1.4@@
 from typing import Iterator
 
+from log_parser.point import Point
 
-def web(value: dict) -> Iterator[dict]:
+
+def web(value: dict) -> Iterator[Point]:
     yield from []
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+MAX_INTERNED_TAG_SETS = 10000
+
+Items = Tuple[Tuple[str, Any], ...]
+
+_tag_sets = OrderedDict()  # type: OrderedDict
+
+
+def intern_tags(tags: Dict[str, Any]) -> Items:
+    """
+    Returns the tags as a tuple of (key, value) pairs sorted by key.
+    Equal tag sets share the same tuple, as long as it's among the last MAX_INTERNED_TAG_SETS that were seen.
+    """
+    items = tuple(sorted(tags.items()))
+    interned = _tag_sets.get(items)
+    if interned is None:
+        if len(_tag_sets) >= MAX_INTERNED_TAG_SETS:
+            _tag_sets.popitem(last=False)
+        _tag_sets[items] = interned = items
+    return interned
+
+
+class Point(object):
+    """
+    A single point for InfluxDB. The time is an integer epoch timestamp in line_protocol.TIME_PRECISION.
+    Tags and fields are stored as tuples of (key, value) pairs sorted by key.
+    Use to_dict() to get the dict that influxdb.InfluxDBClient.write_points expects. Indexing with the keys of that dict
+    works as well.
+    """
+    __slots__ = ('measurement', 'tags', 'time', 'fields')
+
+    def __init__(self, measurement: str, tags: Dict[str, Any], time: int, fields: Dict[str, Any]) -> None:
+        self.measurement = measurement
+        self.tags = intern_tags(tags)  # type: Items
+        self.time = time
+        self.fields = tuple(sorted(fields.items()))  # type: Items
+
+    def to_dict(self) -> dict:
+        return {
+            'measurement': self.measurement,
+            'tags': dict(self.tags),
+            'time': self.time,
+            'fields': dict(self.fields),
+        }
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'tags' or key == 'fields':
+            return dict(getattr(self, key))
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self.__slots__ else default
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Point) and all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def __repr__(self) -> str:
+        return 'Point(%r)' % self.to_dict()
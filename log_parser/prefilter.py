@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import re
+from collections import Counter
+from typing import Iterable, Optional, Union
+
+from log_parser.analyzer import REQUEST_LOG_MARKER, REQUEST_LOG_MARKER_BYTES
+from log_parser.salvage import NOT_BRACKET_RE
+
+# Log types that never result in any points
+DEFAULT_SKIP_TYPES = ['web', 'web_channel', 'tf.web']
+UNTYPED = ''
+TYPE_RE = re.compile(r'"type"\s*:\s*"([^"\\]*)"')
+# Keys that are needed to determine the type of a line without a 'type' property
+TYPE_HINTS_RE = re.compile(r'"(?:type|params|a)"\s*:')
+# Same patterns, for lines that are read as bytes
+TYPE_BYTES_RE = re.compile(TYPE_RE.pattern.encode('utf-8'))
+TYPE_HINTS_BYTES_RE = re.compile(TYPE_HINTS_RE.pattern.encode('utf-8'))
+NOT_BRACKET_BYTES_RE = re.compile(NOT_BRACKET_RE.pattern.encode('utf-8'), re.DOTALL)
+
+
+def _get_depth(skeleton: str) -> int:
+    return skeleton.count('{') + skeleton.count('[') - skeleton.count('}') - skeleton.count(']')
+
+
+class Prefilter(object):
+    """
+    Looks for the type of a log line in the raw text, so that lines of types that don't result in any points can be
+    skipped before they are decoded.
+    """
+
+    def __init__(self, skip_types: Optional[Iterable[str]] = None, skip_untyped: bool = True) -> None:
+        self.skip_types = set(DEFAULT_SKIP_TYPES if skip_types is None else skip_types)
+        self.skip_types_bytes = {type_.encode('utf-8') for type_ in self.skip_types}
+        self.skip_untyped = skip_untyped
+        self.skipped = Counter()  # type: Counter
+
+    def get_skipped_type(self, line: Union[str, bytes]) -> Union[str, None]:
+        """Returns the type of the line when it can be skipped"""
+        if isinstance(line, bytes):
+            return self._get_skipped_type_bytes(line)
+        if REQUEST_LOG_MARKER in line:
+            return None
+        if self.skip_untyped and not TYPE_HINTS_RE.search(line):
+            # No type and no way to guess one
+            return UNTYPED
+        for match in TYPE_RE.finditer(line):
+            # Only the 'type' property of the outermost object counts, there might be others in the request data
+            type_ = match.group(1)
+            if type_ in self.skip_types and _get_depth(NOT_BRACKET_RE.sub('', line[:match.start()])) == 1:
+                return type_
+        return None
+
+    def _get_skipped_type_bytes(self, line: bytes) -> Union[str, None]:
+        """Same as get_skipped_type, for lines that are read as bytes"""
+        if REQUEST_LOG_MARKER_BYTES in line:
+            return None
+        if self.skip_untyped and not TYPE_HINTS_BYTES_RE.search(line):
+            return UNTYPED
+        for match in TYPE_BYTES_RE.finditer(line):
+            type_ = match.group(1)
+            if type_ in self.skip_types_bytes and \
+                    _get_depth(NOT_BRACKET_BYTES_RE.sub(b'', line[:match.start()]).decode('ascii')) == 1:
+                return type_.decode('utf-8')
+        return None
+
+    def skip(self, line: Union[str, bytes]) -> bool:
+        type_ = self.get_skipped_type(line)
+        if type_ is None:
+            return False
+        self.skipped[type_] += 1
+        return True
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import zlib
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from log_parser.analyzer import log_types
+from log_parser.config import ProfilingConfig
+from log_parser.db import create_folder
+from log_parser.parsers import request_log
+
+# Settings in the data path that are read by the coordinator while it's running
+PROFILING_FILE = 'profiling.json'
+# Folder of the profiles in the data path, or in the working directory without one
+PROFILES_FOLDER = 'profiles'
+SAMPLE_BUCKETS = 10000
+
+Function = Tuple[str, int, str]
+
+
+def get_profiling_path(data_path: str) -> str:
+    return os.path.join(data_path, PROFILING_FILE)
+
+
+def load_profiling_config(data_path: str, default: ProfilingConfig) -> ProfilingConfig:
+    """Returns the settings in profiling.json in the data path, or default when there is no such file"""
+    path = get_profiling_path(data_path)
+    config = default
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            config = ProfilingConfig(json.load(f))
+    if not config.output_path:
+        config.output_path = os.path.join(data_path, PROFILES_FOLDER)
+    return config
+
+
+def save_profiling_config(data_path: str, config: dict) -> None:
+    """Changes the profiling settings of the log parser that's running with this data path"""
+    create_folder(data_path)
+    path = get_profiling_path(data_path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def should_profile(config: ProfilingConfig, bucket_name: str, file_name: str) -> bool:
+    path = '%s/%s' % (bucket_name, file_name)
+    if any(fnmatch(path, pattern) or fnmatch(file_name, pattern) for pattern in config.files):
+        return True
+    if config.worker and config.worker == os.getpid():
+        return True
+    # Based on the name, so a file that is retried is profiled again
+    return zlib.crc32(path.encode('utf-8')) % SAMPLE_BUCKETS < config.sample_rate * SAMPLE_BUCKETS
+
+
+@contextmanager
+def profile(config: ProfilingConfig, bucket_name: str, file_name: str, suffix: str = '') -> Iterator[None]:
+    """
+    Profiles the code in the block when the file is selected by the settings.
+    The profile is saved as <file name><suffix>.prof in the output path, with a summary in <file name><suffix>.txt.
+    """
+    if not should_profile(config, bucket_name, file_name):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(config.output_path or PROFILES_FOLDER, bucket_name, file_name + suffix)
+        try:
+            write_profile(profiler, path, config.top)
+            logging.info('Saved the profile of %s/%s%s to %s.prof', bucket_name, file_name, suffix, path)
+        except Exception:
+            logging.exception('Failed to save the profile of %s/%s%s', bucket_name, file_name, suffix)
+
+
+def write_profile(profiler: cProfile.Profile, path: str, top: int) -> None:
+    create_folder(os.path.dirname(path))
+    profiler.dump_stats(path + '.prof')
+    with open(path + '.txt', 'w') as f:
+        f.write(summarize(profiler, top))
+
+
+def get_parsers() -> Dict[str, Callable]:
+    """Returns the functions that parse the values of each log type"""
+    parsers = {name: log_type.process for name, log_type in log_types.items()}
+    parsers['request_log'] = request_log.process_request_log
+    return parsers
+
+
+def _get_function(func: Callable) -> Function:
+    code = func.__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _get_entries(stats: pstats.Stats) -> Dict[Function, tuple]:
+    """Returns the call counts, times and callers by function, which aren't in the type stubs of pstats"""
+    return getattr(stats, 'stats')
+
+
+def attribute_time(stats: pstats.Stats, root: Function) -> Dict[Function, float]:
+    """
+    Returns the cumulative time of the functions that are called from root, directly or indirectly, as far as it was
+    spent on behalf of root. A function that's also called from elsewhere gets the time of the calls from the callers
+    in the tree, in proportion to the time of those callers that was spent for root.
+    This is an estimate, since the profile only knows the time per caller and callee.
+    """
+    entries = _get_entries(stats)
+    callees = defaultdict(list)  # type: Dict[Function, List[Tuple[Function, float]]]
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+    attributed = defaultdict(float)  # type: Dict[Function, float]
+    attributed[root] = entries[root][3]
+    queue = deque([root])
+    queued = {root}
+    processed = set()
+    while queue:
+        caller = queue.popleft()
+        processed.add(caller)
+        total = entries[caller][3]
+        share = attributed[caller] / total if total else 0
+        for callee, cumulative in callees[caller]:
+            # Time of recursive calls is already part of the time of the caller
+            if callee in processed:
+                continue
+            attributed[callee] += cumulative * share
+            if callee not in queued:
+                queued.add(callee)
+                queue.append(callee)
+    return attributed
+
+
+def _format_function(func: Function) -> str:
+    filename, line, name = func
+    return '%s:%d(%s)' % (os.path.basename(filename), line, name)
+
+
+def summarize(profiler: cProfile.Profile, top: int) -> str:
+    """Returns the top functions by cumulative time, followed by the top functions of every log type that was parsed"""
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(top)
+    entries = _get_entries(stats)
+    for name, parser in sorted(get_parsers().items()):
+        root = _get_function(parser)
+        if root not in entries:
+            continue
+        _, calls, _, cumulative, _ = entries[root]
+        output.write('Log type %s: %.3f seconds in %d calls\n' % (name, cumulative, calls))
+        output.write('   cumulative  function\n')
+        attributed = attribute_time(stats, root)
+        for func, seconds in sorted(attributed.items(), key=lambda item: -item[1])[:top]:
+            output.write('%13.3f  %s\n' % (seconds, _format_function(func)))
+        output.write('\n')
+    return output.getvalue()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import importlib
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import ijson
+
+IJSON_BACKENDS = ['yajl2_c', 'yajl2_cffi', 'yajl2', 'python']
+# Projecting with the other backends takes many times longer than json.loads
+FAST_IJSON_BACKEND = 'yajl2_c'
+ARRAY_ITEM = 'item'
+
+
+def _get_ijson_backend():
+    """Returns the fastest ijson backend that is installed."""
+    for name in IJSON_BACKENDS:
+        try:
+            return importlib.import_module('ijson.backends.%s' % name)
+        except ImportError:
+            # C extension or yajl shared library is not available
+            continue
+    return ijson
+
+
+ijson_backend = _get_ijson_backend()
+has_fast_backend = ijson_backend.__name__ == 'ijson.backends.' + FAST_IJSON_BACKEND
+
+
+class Projection(object):
+    """
+    Prefix trie of the paths that should be decoded, in ijson prefix notation ('item' stands for every element of an
+    array). Everything below the last key of a path is kept.
+    """
+
+    def __init__(self) -> None:
+        self.children = {}  # type: Dict[str, Projection]
+        self.complete = False  # type: bool
+
+    def add(self, path: str) -> None:
+        node = self
+        for key in path.split('.') if path else []:
+            if node.complete:
+                return
+            node = node.children.setdefault(key, Projection())
+        node.complete = True
+        node.children.clear()
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[str]) -> 'Projection':
+        projection = cls()
+        for path in paths:
+            projection.add(path)
+        return projection
+
+
+def project(data: Union[str, bytes], projection: Projection) -> Any:
+    """
+    Decodes only the parts of the JSON document that are in the projection. Other subtrees are skipped while scanning
+    without allocating any objects for them.
+    Scalars at a path that expects an object or array are kept as well.
+    When the document is truncated, everything that was read up to that point is returned.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    root = None
+    stack = []  # type: List[Tuple[Any, Projection]]
+    key = None  # type: Any
+    skipping = 0
+    try:
+        for event, value in ijson_backend.basic_parse(data, use_float=True):
+            if skipping:
+                if event == 'start_map' or event == 'start_array':
+                    skipping += 1
+                elif event == 'end_map' or event == 'end_array':
+                    skipping -= 1
+                continue
+            if event == 'end_map' or event == 'end_array':
+                stack.pop()
+                continue
+            if event == 'map_key':
+                key = value
+                continue
+            if stack:
+                container, node = stack[-1]
+                if node.complete:
+                    child = node
+                else:
+                    found = node.children.get(key if type(container) is dict else ARRAY_ITEM)
+                    if found is None:
+                        if event == 'start_map' or event == 'start_array':
+                            skipping = 1
+                        continue
+                    child = found
+            else:
+                container, child = None, projection
+            if event == 'start_map':
+                value = {}
+            elif event == 'start_array':
+                value = []
+            if container is None:
+                root = value
+            elif type(container) is dict:
+                container[key] = value
+            else:
+                container.append(value)
+            if event == 'start_map' or event == 'start_array':
+                stack.append((value, child))
+    except ijson.common.JSONError:
+        # Truncated
+        pass
+    return root
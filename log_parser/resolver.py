@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, Union
+
+import certifi
+import urllib3
+
+from log_parser.config import ResolverConfig
+from log_parser.point import Point
+
+# App id of points whose service hash could not be resolved
+UNKNOWN_APP_ID = 'unknown'
+# App ids that are kept in memory in every process, in front of the shared cache
+MEMORY_ENTRIES = 1000
+# Seconds between updates of the last time an entry of the shared cache was used
+TOUCH_INTERVAL = 60
+# Entries that are added by a process between the removal of expired and least recently used entries
+EVICTION_INTERVAL = 100
+# Seconds that the points of a service hash get UNKNOWN_APP_ID after its lookup failed, instead of looking it up again
+FAILURE_TTL = 60
+
+settings = ResolverConfig({})
+
+# measurement, tags, time and fields of a point that waits for its app id
+ParkedPoint = Tuple[str, dict, int, dict]
+
+
+class ResolverCache(object):
+    """
+    App ids by service hash in a SQLite database that is shared by all processes.
+    Entries expire ttl seconds after they were fetched. Every eviction_interval entries that are added, the expired
+    entries are removed, and when there are more than max_entries the least recently used ones are removed in a batch,
+    down to 90% of max_entries.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int, eviction_interval: int = EVICTION_INTERVAL) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self.added = 0  # type: int
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS service_apps (service_hash TEXT PRIMARY KEY, '
+                                'app_id TEXT NOT NULL, fetched REAL NOT NULL, used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS service_apps_used ON service_apps (used)')
+
+    def get(self, service_hash: str) -> Union[Tuple[str, float], None]:
+        """Returns the app id and the time it was fetched"""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT app_id, fetched, used FROM service_apps WHERE service_hash = ?',
+                                          (service_hash,)).fetchone()
+            if row is None or row[1] < now - self.ttl:
+                return None
+            app_id, fetched, used = row
+            if used < now - TOUCH_INTERVAL:
+                self.connection.execute('UPDATE service_apps SET used = ? WHERE service_hash = ?', (now, service_hash))
+        return app_id, fetched
+
+    def put(self, service_hash: str, app_id: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO service_apps VALUES (?, ?, ?, ?)',
+                                    (service_hash, app_id, now, now))
+            self.added += 1
+            if self.added % self.eviction_interval == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self.connection.execute('DELETE FROM service_apps WHERE fetched < ?', (now - self.ttl,))
+        count = self.connection.execute('SELECT COUNT(*) FROM service_apps').fetchone()[0]
+        if count > self.max_entries:
+            # The oldest entries are found with the index on used
+            self.connection.execute('DELETE FROM service_apps WHERE service_hash IN '
+                                    '(SELECT service_hash FROM service_apps ORDER BY used LIMIT ?)',
+                                    (count - self.max_entries + self.max_entries // 10,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ServiceAppResolver(object):
+    """
+    Resolves service hashes to app ids without blocking the parsing.
+    Points of service hashes that aren't cached yet are parked while the app id is looked up in the background, and
+    can be taken with drain() once the lookup is done.
+    Failed lookups are only kept in the memory of the process, for FAILURE_TTL seconds.
+    """
+
+    def __init__(self, config: ResolverConfig) -> None:
+        self.config = config
+        self.cache = ResolverCache(config.cache_path or ':memory:', config.ttl, config.max_entries)
+        self.pool = urllib3.PoolManager(num_pools=1, maxsize=config.concurrency, cert_reqs='CERT_REQUIRED',
+                                        ca_certs=certifi.where())
+        self.executor = ThreadPoolExecutor(config.concurrency)
+        self.memory = OrderedDict()  # type: OrderedDict
+        self.lock = threading.Lock()
+        self.parked = defaultdict(list)  # type: Dict[str, List[ParkedPoint]]
+        self.pending = {}  # type: Dict[str, Future]
+        self.ready = []  # type: List[Tuple[str, List[ParkedPoint]]]
+        # Time until which the service hashes of failed lookups aren't looked up again
+        self.failed = {}  # type: Dict[str, float]
+
+    def get_app_id(self, service_hash: str) -> Union[str, None]:
+        """Returns the app id when it's cached, without looking it up"""
+        now = time.time()
+        failed_until = self.failed.get(service_hash)
+        if failed_until is not None and failed_until > now:
+            return UNKNOWN_APP_ID
+        entry = self.memory.get(service_hash)
+        if entry is not None and entry[1] > now:
+            self.memory.move_to_end(service_hash)
+            return entry[0]
+        cached = self.cache.get(service_hash)
+        if cached is None:
+            return None
+        app_id, fetched = cached
+        self.memory[service_hash] = (app_id, fetched + self.config.ttl)
+        self.memory.move_to_end(service_hash)
+        if len(self.memory) > MEMORY_ENTRIES:
+            self.memory.popitem(last=False)
+        return app_id
+
+    def park(self, service_hash: str, measurement: str, tags: dict, timestamp: int, fields: dict) -> None:
+        """Keeps the point until the app id of the service hash is known, and starts looking it up"""
+        with self.lock:
+            self.parked[service_hash].append((measurement, tags, timestamp, fields))
+            if service_hash not in self.pending:
+                self.pending[service_hash] = self.executor.submit(self._resolve, service_hash)
+
+    def _fetch(self, service_hash: str) -> str:
+        res = self.pool.request('GET', self.config.url, fields={'user': service_hash}, timeout=self.config.timeout,
+                                retries=urllib3.Retry(2))
+        if res.status != 200:
+            raise Exception('Failed to get app_id for service hash %s: status %s' % (service_hash, res.status))
+        return json.loads(res.data)['app_id']
+
+    def _resolve(self, service_hash: str) -> None:
+        try:
+            app_id = self._fetch(service_hash)
+            self.cache.put(service_hash, app_id)
+        except Exception as e:
+            # Not in the shared cache, so it's looked up again once FAILURE_TTL has passed
+            logging.warning('Could not resolve service hash %s: %s', service_hash, e)
+            app_id = UNKNOWN_APP_ID
+        now = time.time()
+        with self.lock:
+            if app_id == UNKNOWN_APP_ID:
+                self.failed = {failed: until for failed, until in self.failed.items() if until > now}
+                self.failed[service_hash] = now + FAILURE_TTL
+            del self.pending[service_hash]
+            parked = self.parked.pop(service_hash, None)
+            if parked:
+                self.ready.append((app_id, parked))
+
+    def has_unwritten_points(self) -> bool:
+        """If there are parked points, or points of which the app id is known but that weren't drained yet"""
+        with self.lock:
+            return bool(self.parked or self.ready)
+
+    def clear(self) -> None:
+        """Drops the parked points and the ones that weren't drained yet. Their lookups continue."""
+        with self.lock:
+            self.parked.clear()
+            self.ready = []
+
+    @contextmanager
+    def clearing_on_error(self) -> Iterator[None]:
+        """Clears the points when the block raises, so the points of a file that failed aren't written with the next"""
+        try:
+            yield
+        except BaseException:
+            self.clear()
+            raise
+
+    def drain(self, timeout: float = 0) -> List[Point]:
+        """
+        Returns the parked points of which the app id has been looked up.
+        With a timeout, this waits for the lookups that are still running. Points of which the app id still isn't known
+        after that get UNKNOWN_APP_ID.
+        """
+        if timeout:
+            with self.lock:
+                futures = list(self.pending.values())
+            _, not_done = wait(futures, timeout)
+            if not_done:
+                logging.warning('%s service hashes were not resolved within %s seconds', len(not_done), timeout)
+        with self.lock:
+            ready, self.ready = self.ready, []
+            if timeout:
+                ready.extend((UNKNOWN_APP_ID, parked) for parked in self.parked.values())
+                self.parked.clear()
+        points = []  # type: List[Point]
+        for app_id, parked in ready:
+            for measurement, tags, timestamp, fields in parked:
+                tags['app_id'] = app_id
+                points.append(Point(measurement, tags, timestamp, fields))
+        return points
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.cache.close()
+
+
+_resolver = None  # type: Union[ServiceAppResolver, None]
+
+
+def configure(config: ResolverConfig) -> None:
+    """Sets the configuration of the resolver of this process. Called at the start of every task in a worker."""
+    global settings, _resolver
+    if vars(config) == vars(settings):
+        return
+    if _resolver:
+        _resolver.close()
+        _resolver = None
+    settings = config
+
+
+def get_resolver() -> ServiceAppResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = ServiceAppResolver(settings)
+    return _resolver
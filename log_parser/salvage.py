@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import re
+from typing import Any, Tuple, Union
+
+# Contents of a string after its opening quote, up to the closing quote or the end of the text.
+# This never fails to match, so every string is scanned once.
+STRING_CONTENT_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+NON_BRACKETS_RE = re.compile(r'[^{}\[\]]+')
+# Strings and everything else that isn't a bracket, for text that doesn't end inside a string
+NOT_BRACKET_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[^{}\[\]"]+', re.DOTALL)
+CLOSERS = {'{': '}', '[': ']'}
+WHITESPACE = ' \t\r\n'
+TOKEN_DELIMITERS = WHITESPACE + ',:[{'
+LITERALS = ('true', 'false', 'null')
+
+_decoder = json.JSONDecoder()
+
+
+class SalvageResult(object):
+    def __init__(self, value: Any, dropped: str, closed: str) -> None:
+        self.value = value
+        self.dropped = dropped  # type: str # text at the end of the line that could not be kept
+        self.closed = closed  # type: str # brackets that were appended to close the open containers
+
+
+def get_open_containers(skeleton: str) -> Union[str, None]:
+    """
+    Returns the brackets of the containers that are still open at the end of the skeleton, outermost first.
+    Returns None when more containers are closed than opened.
+    """
+    while True:
+        reduced = skeleton.replace('{}', '').replace('[]', '')
+        if reduced == skeleton:
+            break
+        skeleton = reduced
+    if '}' in skeleton or ']' in skeleton:
+        return None
+    return skeleton
+
+
+def get_skeleton(text: str) -> Tuple[str, int]:
+    """
+    Returns the brackets in text that aren't part of a string, and the index of the opening quote of the string that
+    is never closed, or -1.
+    """
+    parts = []
+    position = 0
+    while True:
+        quote = text.find('"', position)
+        if quote == -1:
+            parts.append(text[position:])
+            break
+        parts.append(text[position:quote])
+        # Always matches, the content can be empty
+        match = STRING_CONTENT_RE.match(text, quote + 1)
+        end = match.end() if match else quote + 1
+        if end >= len(text):
+            return NON_BRACKETS_RE.sub('', ''.join(parts)), quote
+        position = end + 1
+    return NON_BRACKETS_RE.sub('', ''.join(parts)), -1
+
+
+def _rstrip_index(text: str, end: int) -> int:
+    while end and text[end - 1] in WHITESPACE:
+        end -= 1
+    return end
+
+
+def _unescaped_quote(text: str, end: int) -> int:
+    """Returns the index of the last quote before end that isn't escaped, or -1"""
+    quote = end
+    while quote > 0:
+        quote = text.rfind('"', 0, quote)
+        backslashes = 0
+        while quote - backslashes > 0 and text[quote - backslashes - 1] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+    return quote
+
+
+def _string_start(text: str, end: int) -> int:
+    """Returns the index of the opening quote of the string that ends at text[end - 1]"""
+    return max(_unescaped_quote(text, end - 1), 0)
+
+
+def _find_cut(text: str, container: str) -> int:
+    """
+    Returns the index after the last complete value in text.
+    Dangling commas, keys without a value and numbers that might have been cut in half are dropped.
+    """
+    end = len(text)
+    while True:
+        end = _rstrip_index(text, end)
+        if not end:
+            return 0
+        char = text[end - 1]
+        if char in '{[}]':
+            return end
+        if char == ',':
+            end -= 1
+        elif char == ':':
+            # Drop the key as well
+            end = _rstrip_index(text, end - 1)
+            if not end or text[end - 1] != '"':
+                return 0
+            end = _string_start(text, end)
+        elif char == '"':
+            start = _string_start(text, end)
+            previous = _rstrip_index(text, start)
+            is_key = container == '{' and previous and text[previous - 1] in '{,'
+            if not is_key:
+                return end
+            end = start
+        else:
+            start = end
+            while start and text[start - 1] not in TOKEN_DELIMITERS:
+                start -= 1
+            # Only a number at the very end of the text might be incomplete
+            if end < len(text) or text[start:end] in LITERALS:
+                return end
+            end = start
+
+
+def salvage(text: str) -> Union[SalvageResult, None]:
+    """
+    Decodes a JSON document that has been truncated, for example because the log message was too long.
+    The text is cut after the last complete value, the containers that are still open are closed and the result is
+    decoded in a single pass.
+    Returns None if nothing could be salvaged.
+    """
+    # Brackets after the opening quote of a string that is never closed are part of that string
+    skeleton, quote = get_skeleton(text)
+    open_containers = get_open_containers(skeleton)
+    if open_containers is None:
+        return None
+    if not open_containers:
+        # Nothing is truncated, but there might be garbage after the document
+        start = len(text) - len(text.lstrip())
+        try:
+            value, end = _decoder.raw_decode(text, start)
+        except ValueError:
+            return None
+        return SalvageResult(value, text[end:], '')
+    safe = text[:quote] if quote != -1 else text
+    cut = _find_cut(safe, open_containers[-1])
+    if not cut:
+        return None
+    closed = ''.join(CLOSERS[bracket] for bracket in reversed(open_containers))
+    try:
+        value = json.loads(text[:cut] + closed)
+    except ValueError:
+        return None
+    return SalvageResult(value, text[cut:], closed)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from log_parser.config import SchedulerConfig
+from log_parser.models import LogParserFile
+
+
+class Scheduler(object):
+    """
+    Decides which files are handed to the worker pool, and in which order.
+    Normally the oldest files go first, so recent data is never stuck behind a backlog. When more than
+    backfill_threshold files are waiting, the largest files go first so the pool finishes the backlog as soon as
+    possible. At most max_in_flight files are in the pool at the same time, and at most bucket_limit of each bucket.
+    """
+
+    def __init__(self, config: SchedulerConfig, process_count: int) -> None:
+        self.config = config
+        self.max_in_flight = config.max_in_flight or 2 * process_count  # type: int
+        self.queued = {}  # type: Dict[Tuple[str, str], LogParserFile]
+        self.in_flight = defaultdict(set)  # type: Dict[str, Set[str]]
+
+    @property
+    def in_flight_count(self) -> int:
+        return sum(len(names) for names in self.in_flight.values())
+
+    @property
+    def backfilling(self) -> bool:
+        return len(self.queued) > self.config.backfill_threshold
+
+    def add(self, file: LogParserFile) -> None:
+        """Queues the file, unless it's already queued or being processed"""
+        key = (file.bucket, file.name)
+        if key not in self.queued and file.name not in self.in_flight[file.bucket]:
+            self.queued[key] = file
+
+    def next_files(self) -> List[LogParserFile]:
+        """Returns the files that should be started now, and marks them as in flight"""
+        available = self.max_in_flight - self.in_flight_count
+        if available <= 0 or not self.queued:
+            return []
+        if self.backfilling:
+            order = sorted(self.queued.values(), key=lambda f: (-(f.size or 0), f.name))
+        else:
+            # Names start with the log folder, so this is oldest first
+            order = sorted(self.queued.values(), key=lambda f: f.name)
+        started = []
+        for file in order:
+            in_flight = self.in_flight[file.bucket]
+            if self.config.bucket_limit and len(in_flight) >= self.config.bucket_limit:
+                continue
+            in_flight.add(file.name)
+            del self.queued[(file.bucket, file.name)]
+            started.append(file)
+            if len(started) == available:
+                break
+        return started
+
+    def done(self, bucket: str, name: str) -> None:
+        self.in_flight[bucket].discard(name)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import sqlite3
+import threading
+from typing import List, Union
+
+from log_parser.config import SnapshotConfig
+from log_parser.line_protocol import TIME_UNITS_PER_SECOND
+from log_parser.point import Point
+
+# Calls of SnapshotStore.changed in a process between removals of the snapshots that are older than the history
+PRUNE_INTERVAL = 100
+
+settings = SnapshotConfig({})
+
+
+class SnapshotStore(object):
+    """
+    The recent points of every series of the snapshot measurements, in a SQLite database that is shared by all
+    processes. A series is a measurement with a tag set. Every point is kept with its fields and whether it was written.
+    Files can be processed in any order, so a point is compared with the point of its series that was written last
+    before it in time, not with the one that was seen last.
+    """
+
+    def __init__(self, path: str, history: int, prune_interval: int = PRUNE_INTERVAL) -> None:
+        self.history = history
+        self.prune_interval = prune_interval
+        self.calls = 0  # type: int
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS snapshot_points (measurement TEXT NOT NULL, '
+                                'tags TEXT NOT NULL, time INTEGER NOT NULL, fields TEXT NOT NULL, '
+                                'written INTEGER NOT NULL, PRIMARY KEY (measurement, tags, time))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS snapshot_points_time ON snapshot_points (time)')
+
+    def changed(self, points: List[Point], heartbeat: int) -> List[Point]:
+        """
+        Returns the points that should be written: the ones of which the fields differ from the last point of their
+        series that was written before them, or of which that point is heartbeat microseconds or more older.
+        When a point is written before a later point that was skipped and that has other fields, that later point is
+        returned as well, since it no longer repeats the point before it.
+        The store is updated before the points are written, so a file should be retried until it succeeds.
+        """
+        result = []
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                for point in points:
+                    result.extend(self._add(point, heartbeat))
+                self.calls += 1
+                if points and self.calls % self.prune_interval == 0:
+                    limit = max(point.time for point in points) - self.history * TIME_UNITS_PER_SECOND
+                    self.connection.execute('DELETE FROM snapshot_points WHERE time < ?', (limit,))
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return result
+
+    def _add(self, point: Point, heartbeat: int) -> List[Point]:
+        measurement, time = point.measurement, point.time
+        tags = json.dumps(point.tags)
+        fields = json.dumps(point.fields)
+        previous = self.connection.execute('SELECT time, fields FROM snapshot_points WHERE measurement = ? '
+                                           'AND tags = ? AND time < ? AND written ORDER BY time DESC LIMIT 1',
+                                           (measurement, tags, time)).fetchone()
+        if previous and previous[1] == fields and time - previous[0] < heartbeat:
+            self.connection.execute('INSERT OR REPLACE INTO snapshot_points VALUES (?, ?, ?, ?, 0)',
+                                    (measurement, tags, time, fields))
+            return []
+        self.connection.execute('INSERT OR REPLACE INTO snapshot_points VALUES (?, ?, ?, ?, 1)',
+                                (measurement, tags, time, fields))
+        result = [point]
+        following = self.connection.execute('SELECT time, fields, written FROM snapshot_points WHERE measurement = ? '
+                                            'AND tags = ? AND time > ? ORDER BY time LIMIT 1',
+                                            (measurement, tags, time)).fetchone()
+        if following and not following[2] and following[1] != fields:
+            self.connection.execute('UPDATE snapshot_points SET written = 1 WHERE measurement = ? AND tags = ? AND '
+                                    'time = ?', (measurement, tags, following[0]))
+            result.append(Point(measurement, dict(point.tags), following[0], dict(json.loads(following[1]))))
+        return result
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+_store = None  # type: Union[SnapshotStore, None]
+
+
+def configure(config: SnapshotConfig) -> None:
+    """Sets the configuration of the snapshots of this process. Called at the start of every task in a worker."""
+    global settings, _store
+    if vars(config) == vars(settings):
+        return
+    if _store:
+        _store.close()
+        _store = None
+    settings = config
+
+
+def get_store() -> SnapshotStore:
+    global _store
+    if _store is None:
+        _store = SnapshotStore(settings.state_path or ':memory:', settings.history)
+    return _store
+
+
+def filter_unchanged(points: List[Point]) -> List[Point]:
+    """
+    Removes the points of the snapshot measurements that repeat the last point of their series that was written, and
+    adds the later points that have to be written after all because of the points before them.
+    """
+    if not settings.enabled:
+        return points
+    measurements = settings.measurements
+    snapshots = [point for point in points if point.measurement in measurements]
+    if not snapshots:
+        return points
+    changed = get_store().changed(snapshots, settings.heartbeat * TIME_UNITS_PER_SECOND)
+    return [point for point in points if point.measurement not in measurements] + changed
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+from log_parser.config import StatsConfig
+from log_parser.line_protocol import from_epoch, make_line
+from log_parser.point import Point
+
+# Stages of the parser that are timed
+LISTING = 'listing'
+DOWNLOAD = 'download'
+DECODE = 'decode'
+PARSE = 'parse'
+BUILD = 'build'
+FLUSH = 'flush'
+WRITE = 'write'
+
+settings = StatsConfig({})
+
+
+class StageStats(object):
+    __slots__ = ('count', 'seconds', 'items', 'bytes')
+
+    def __init__(self) -> None:
+        self.count = 0  # type: int
+        self.seconds = 0.0  # type: float
+        self.items = 0  # type: int
+        self.bytes = 0  # type: int
+
+
+class Stats(object):
+    """
+    Counters and timers of the stages of the parser in this process.
+    Stages are recorded from the parsing thread, the writer thread and the download thread, the counters are reset
+    every time they are flushed to points. Nothing is recorded when the statistics are disabled.
+    """
+
+    def __init__(self, config: StatsConfig) -> None:
+        self.config = config
+        self.pid = os.getpid()  # type: int
+        self.worker = '%s:%d' % (socket.gethostname(), self.pid)  # type: str
+        self.lock = threading.Lock()
+        self.stages = {}  # type: Dict[Tuple[str, str], StageStats]
+        self.gauges = {}  # type: Dict[str, float]
+        self.lines = 0  # type: int
+        self.points = 0  # type: int
+        self.bytes = 0  # type: int
+        self.last_flush = time.time()  # type: float
+
+    def record(self, stage: str, seconds: float, items: int = 0, size: int = 0, log_type: str = '') -> None:
+        """Records a single run of a stage, with the amount of items and bytes that it handled"""
+        if not self.config.enabled:
+            return
+        with self.lock:
+            stage_stats = self.stages.get((stage, log_type))
+            if stage_stats is None:
+                stage_stats = self.stages[(stage, log_type)] = StageStats()
+            stage_stats.count += 1
+            stage_stats.seconds += seconds
+            stage_stats.items += items
+            stage_stats.bytes += size
+
+    def add_progress(self, lines: int, points: int, size: int) -> None:
+        if not self.config.enabled:
+            return
+        with self.lock:
+            self.lines += lines
+            self.points += points
+            self.bytes += size
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Sets the current value of something like the length of a queue. The last value is flushed."""
+        if self.config.enabled:
+            self.gauges[name] = value
+
+    @property
+    def due(self) -> bool:
+        return self.config.enabled and time.time() - self.last_flush >= self.config.interval
+
+    def flush(self) -> List[Point]:
+        """Returns the points with everything that was recorded since the last flush and resets the counters"""
+        now = time.time()
+        with self.lock:
+            stages, self.stages = self.stages, {}
+            gauges, self.gauges = self.gauges, {}
+            lines, points, size = self.lines, self.points, self.bytes
+            self.lines = self.points = self.bytes = 0
+            elapsed = max(now - self.last_flush, 1e-6)
+            self.last_flush = now
+        timestamp = from_epoch(now)
+        result = []
+        for (stage, log_type), stage_stats in sorted(stages.items()):
+            tags = {'worker': self.worker, 'stage': stage}
+            if log_type:
+                tags['log_type'] = log_type
+            result.append(Point(self.config.measurement, tags, timestamp, {
+                'count': stage_stats.count,
+                'seconds': stage_stats.seconds,
+                'items': stage_stats.items,
+                'bytes': stage_stats.bytes,
+                'average_latency': stage_stats.seconds / stage_stats.count,
+            }))
+        if lines or points or size or gauges:
+            fields = {
+                'lines': lines,
+                'points': points,
+                'bytes': size,
+                'lines_per_second': lines / elapsed,
+                'points_per_second': points / elapsed,
+                'bytes_per_second': size / elapsed,
+            }
+            fields.update(gauges)
+            result.append(Point(self.config.measurement, {'worker': self.worker, 'stage': 'total'}, timestamp, fields))
+        return result
+
+    def flush_lines(self) -> List[bytes]:
+        """Like flush, but serialized to the line protocol"""
+        return [make_line(point) for point in self.flush()]
+
+
+_stats = None  # type: Union[Stats, None]
+
+
+def configure(config: StatsConfig) -> None:
+    """Sets the configuration of the statistics of this process. Called at the start of every task in a worker."""
+    global settings, _stats
+    if vars(config) == vars(settings):
+        return
+    settings = config
+    _stats = None
+
+
+def get_stats() -> Stats:
+    global _stats
+    # Forked workers start with their own counters
+    if _stats is None or _stats.pid != os.getpid():
+        _stats = Stats(settings)
+    return _stats
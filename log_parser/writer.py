@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import gzip
+import logging
+import os
+import queue
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Tuple, Union
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from log_parser.config import InfluxConfig
+from log_parser.line_protocol import TIME_PRECISION
+from log_parser.stats import WRITE, get_stats
+
+WRITE_HEADERS = {'Content-Type': 'application/octet-stream', 'Accept': 'text/plain'}
+GZIP_WRITE_HEADERS = dict(WRITE_HEADERS, **{'Content-Encoding': 'gzip'})
+# The lines are very repetitive, so the fastest compression level already gives most of the gain
+GZIP_LEVEL = 1
+# Batches that may wait while another one is being written
+MAX_PENDING_BATCHES = 1
+# Weight of the last write in the moving averages of the batch controllers
+SMOOTHING = 0.3
+# Lines per file when writing to line protocol files
+SHARD_LINES = 1000000
+IMPORT_HEADER = '# DDL\nCREATE DATABASE %(db)s\n# DML\n# CONTEXT-DATABASE: %(db)s\n'
+
+settings = InfluxConfig({})
+
+
+class BatchController(object):
+    """
+    Adapts the amount of lines per write request for one InfluxDB target.
+    The batch size moves towards the size that would take target_latency to write, based on a moving average of the
+    time per line. It's halved after every failed write, and while writes keep failing, the size it moves towards is
+    reduced by the moving average of the error rate.
+    """
+
+    def __init__(self, config: InfluxConfig) -> None:
+        self.config = config
+        self.size = max(config.min_batch_size, min(config.batch_size, config.max_batch_size))  # type: int
+        self.line_latency = None  # type: Union[float, None]
+        # Moving average of the fraction of writes that failed
+        self.error_rate = 0.0  # type: float
+
+    def _clamp(self, size: float) -> int:
+        return int(max(self.config.min_batch_size, min(size, self.config.max_batch_size)))
+
+    def record_success(self, line_count: int, latency: float) -> None:
+        self.error_rate *= 1 - SMOOTHING
+        if line_count < self.size // 2:
+            # The fixed cost per request dominates small batches, like the last one of a file
+            return
+        line_latency = latency / line_count
+        if self.line_latency is None:
+            self.line_latency = line_latency
+        else:
+            self.line_latency += SMOOTHING * (line_latency - self.line_latency)
+        ideal_size = self.config.target_latency / self.line_latency if self.line_latency else self.size * 2
+        ideal_size *= 1 - self.error_rate
+        # Move half way, so a single slow write doesn't make the batches much smaller
+        self.size = self._clamp(self.size + (min(ideal_size, self.size * 2) - self.size) / 2)
+
+    def record_error(self) -> None:
+        self.error_rate += SMOOTHING * (1 - self.error_rate)
+        self.size = self._clamp(self.size / 2)
+
+
+# Batch controllers of the InfluxDB targets, by host, port and database. Fake clients don't have a host and port.
+_controllers = {}  # type: Dict[Tuple[Union[str, None], Union[int, None], str], BatchController]
+
+
+def configure(config: InfluxConfig) -> None:
+    """Sets the batch size limits and compression for the writes of this process"""
+    global settings
+    settings = config
+    for controller in _controllers.values():
+        controller.config = config
+        controller.size = controller._clamp(controller.size)
+
+
+def get_batch_controller(client: InfluxDBClient) -> BatchController:
+    key = (getattr(client, '_host', None), getattr(client, '_port', None), client._database)
+    controller = _controllers.get(key)
+    if not controller:
+        controller = _controllers[key] = BatchController(settings)
+    return controller
+
+
+def _write_lines(client: InfluxDBClient, lines: List[bytes]) -> int:
+    """Returns the amount of bytes that were sent"""
+    data = b'\n'.join(lines) + b'\n'
+    headers = WRITE_HEADERS
+    if settings.gzip:
+        data = gzip.compress(data, GZIP_LEVEL)
+        headers = GZIP_WRITE_HEADERS
+    client.request(url='write',
+                   method='POST',
+                   params={'db': client._database, 'precision': TIME_PRECISION},
+                   data=data,
+                   expected_response_code=204,
+                   headers=headers)
+    return len(data)
+
+
+def save_statistic_entries(client: InfluxDBClient, lines: List[bytes]) -> bool:
+    """Writes lines that are already serialized to the line protocol, see log_parser.line_protocol.make_line"""
+    controller = get_batch_controller(client)
+    start = time.time()
+    try:
+        size = _write_lines(client, lines)
+    except InfluxDBClientError as e:
+        controller.record_error()
+        if 'timeout' in e.content:
+            logging.warning('Timeout while writing to influxdb. Retrying with batch size %s...', controller.size)
+            for i in range(0, len(lines), controller.size):
+                batch = lines[i:i + controller.size]
+                start = time.time()
+                size = _write_lines(client, batch)
+                get_stats().record(WRITE, time.time() - start, len(batch), size)
+        else:
+            logging.exception('Failed to write data to influxdb')
+            raise
+    except Exception:
+        controller.record_error()
+        raise
+    else:
+        latency = time.time() - start
+        controller.record_success(len(lines), latency)
+        get_stats().record(WRITE, latency, len(lines), size)
+    return True
+
+
+class LineProtocolFiles(object):
+    """
+    Writes lines to gzip compressed files instead of to InfluxDB, to load them later with
+    `influx -import -compressed -precision=u -path=<file>`.
+    Files are named <path_prefix>.<number>.txt.gz and a new one is started every max_lines lines. They only get that
+    name once they are complete.
+    """
+
+    def __init__(self, path_prefix: str, database: str, max_lines: int = SHARD_LINES) -> None:
+        self.path_prefix = path_prefix
+        self.database = database
+        self.max_lines = max_lines
+        # Files that are complete
+        self.paths = []  # type: List[str]
+        self._file = None  # type: Union[gzip.GzipFile, None]
+        self._line_count = 0
+
+    def _get_path(self) -> str:
+        return '%s.%d.txt.gz' % (self.path_prefix, len(self.paths))
+
+    def _open(self) -> gzip.GzipFile:
+        self._file = gzip.open(self._get_path() + '.tmp', 'wb', GZIP_LEVEL)
+        self._file.write((IMPORT_HEADER % {'db': self.database}).encode('utf-8'))
+        self._line_count = 0
+        return self._file
+
+    def _complete(self, file: gzip.GzipFile) -> None:
+        file.close()
+        self._file = None
+        path = self._get_path()
+        os.replace(path + '.tmp', path)
+        self.paths.append(path)
+
+    def write_lines(self, lines: List[bytes]) -> None:
+        start = 0
+        while start < len(lines):
+            file = self._file or self._open()
+            end = min(len(lines), start + self.max_lines - self._line_count)
+            file.write(b'\n'.join(lines[start:end]) + b'\n')
+            self._line_count += end - start
+            start = end
+            if self._line_count >= self.max_lines:
+                self._complete(file)
+
+    def close(self) -> None:
+        if self._file:
+            self._complete(self._file)
+
+    def discard(self) -> None:
+        """Removes every file, also the complete ones, when not all lines could be written"""
+        if self._file:
+            self._file.close()
+            self._file = None
+            os.remove(self._get_path() + '.tmp')
+        for path in self.paths:
+            os.remove(path)
+        self.paths = []
+
+
+class BackgroundWriter(object):
+    """
+    Writes batches of lines to InfluxDB in a separate thread, so the next batch can be parsed while the previous one
+    is being written. write() blocks when max_pending batches are already waiting.
+    The first error is raised again from write() or close(), after which the remaining batches are dropped.
+    The callback that is passed with a batch is called from the writer thread once the batch has been written.
+    Instead of an InfluxDB client, the lines can be written to LineProtocolFiles.
+    """
+
+    def __init__(self, influxdb_client: Union[InfluxDBClient, LineProtocolFiles],
+                 max_pending: int = MAX_PENDING_BATCHES) -> None:
+        self.influxdb_client = influxdb_client
+        if isinstance(influxdb_client, LineProtocolFiles):
+            self._save = influxdb_client.write_lines  # type: Callable[[List[bytes]], object]
+        else:
+            self._save = partial(save_statistic_entries, influxdb_client)
+        self.batches = queue.Queue(maxsize=max_pending)  # type: queue.Queue
+        self.error = None  # type: Union[Exception, None]
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            if self.error:
+                continue
+            lines, on_written = batch
+            try:
+                self._save(lines)
+                if on_written:
+                    on_written()
+            except Exception as e:
+                self.error = e
+
+    @property
+    def batch_size(self) -> int:
+        if isinstance(self.influxdb_client, LineProtocolFiles):
+            return settings.max_batch_size
+        return get_batch_controller(self.influxdb_client).size
+
+    def write(self, lines: List[bytes], on_written: Union[Callable[[], None], None] = None) -> None:
+        if self.error:
+            raise self.error
+        self.batches.put((lines, on_written))
+
+    def close(self) -> None:
+        """Waits until every batch has been written."""
+        self.batches.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.batches.put(None)
+            self.thread.join()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import gzip
+import json
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, Iterator, List, Union
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeBlob(object):
+    """Stand-in for google.cloud.storage.Blob that reads from a file on disk"""
+
+    def __init__(self, name: str, bucket: 'FakeBucket') -> None:
+        self.name = name
+        self.bucket = bucket
+        self.path = os.path.join(bucket.root_dir, name)
+
+    @property
+    def size(self) -> Union[int, None]:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    def download_as_bytes(self, start: int = None, end: int = None) -> bytes:
+        # Like cloud storage, end is inclusive
+        with open(self.path, 'rb') as f:
+            f.seek(start or 0)
+            if end is None:
+                return f.read()
+            return f.read(end - (start or 0) + 1)
+
+    def download_to_filename(self, filename: str) -> None:
+        shutil.copyfile(self.path, filename)
+
+    def upload_from_string(self, data: Union[str, bytes]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+class FakeBucket(object):
+    """Stand-in for google.cloud.storage.Bucket backed by a directory"""
+
+    def __init__(self, root_dir: str, name: str = 'fake-bucket') -> None:
+        self.root_dir = root_dir
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(name, self)
+
+    def get_blob(self, name: str) -> Union[FakeBlob, None]:
+        blob = self.blob(name)
+        return blob if os.path.isfile(blob.path) else None
+
+    def list_blobs(self, prefix: str = None, start_offset: str = None, end_offset: str = None,
+                   fields: str = None) -> Iterator[FakeBlob]:
+        names = []  # type: List[str]
+        for directory, _, filenames in os.walk(self.root_dir):
+            for filename in filenames:
+                names.append(os.path.relpath(os.path.join(directory, filename), self.root_dir).replace(os.sep, '/'))
+        for name in sorted(names):
+            if prefix and not name.startswith(prefix):
+                continue
+            if start_offset and name < start_offset:
+                continue
+            if end_offset and name >= end_offset:
+                continue
+            yield self.blob(name)
+
+
+class FakeInfluxDBClient(object):
+    """Keeps every line that is written in memory"""
+
+    def __init__(self, database: str = 'test') -> None:
+        self._database = database
+        self.lines = []  # type: List[bytes]
+        self.requests = 0
+
+    def request(self, url: str, method: str = 'GET', params: dict = None, data: bytes = None,
+                expected_response_code: int = 200, headers: dict = None) -> None:
+        assert url == 'write' and method == 'POST'
+        self.requests += 1
+        if headers and headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        self.lines.extend(line for line in data.split(b'\n') if line)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Same as http.server.ThreadingHTTPServer, which needs Python 3.7"""
+    daemon_threads = True
+
+
+class FakeServiceAppServer(object):
+    """
+    Local stand-in for the service-app endpoint. Service hashes that aren't in app_ids get a 404.
+    Requests block while release is cleared.
+    """
+
+    def __init__(self, app_ids: Dict[str, str]) -> None:
+        self.app_ids = app_ids
+        self.requests = []  # type: List[str]
+        self.release = threading.Event()
+        self.release.set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                service_hash = parse_qs(urlparse(self.path).query)['user'][0]
+                server.requests.append(service_hash)
+                server.release.wait()
+                if service_hash not in server.app_ids:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps({'app_id': server.app_ids[service_hash]}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/unauthenticated/service-app' % self.httpd.server_address[1]
+
+    def __enter__(self) -> 'FakeServiceAppServer':
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from log_parser import aggregation, bizz, writer
+from log_parser.aggregation import AggregationStore, Aggregator, Sketch, Window
+from log_parser.bizz import process_lines
+from log_parser.checkpoint import load_checkpoint
+from log_parser.config import AggregationConfig, InfluxConfig
+from log_parser.line_protocol import from_epoch
+from log_parser.point import Point
+from test.fakes import FakeInfluxDBClient
+from test.test_bizz import CrashingClient
+from test.test_parser import get_file_content
+
+CONFIG = AggregationConfig({'enabled': True, 'window': 60, 'lateness': 120, 'measurements': {'request': ['latency']}})
+
+
+def get_point(seconds: float, latency: float, status: int = 200) -> Point:
+    return Point('request', {'status': status}, from_epoch(seconds), {'latency': latency, 'host': 'example.com'})
+
+
+class SketchTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        values = [random.Random(1).lognormvariate(0, 2) for _ in range(10000)]
+        sketch = Sketch()
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for quantile in (0, 0.5, 0.9, 0.99, 1):
+            actual = values[int(quantile * (len(values) - 1))]
+            self.assertAlmostEqual(actual, sketch.quantile(quantile), delta=actual * 0.011)
+        self.assertEqual((values[0], values[-1], len(values)), (sketch.min, sketch.max, sketch.count))
+
+    def test_merge(self):
+        first, second, both = Sketch(), Sketch(), Sketch()
+        for value in (0, 1.5, 3, 200):
+            first.add(value)
+            both.add(value)
+        for value in (0.2, 7, 7):
+            second.add(value)
+            both.add(value)
+        first.merge(Sketch.from_json(json.loads(json.dumps(second.to_json()))))
+        self.assertEqual(both.to_json(), first.to_json())
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def test_windows(self):
+        aggregator = Aggregator(CONFIG, 'test')
+        self.assertFalse(aggregator.add(Point('other', {}, from_epoch(0), {'value': 1})))
+        for second, latency, status in ((0, 1.0, 200), (10, 3.0, 200), (59, 2.0, 200), (30, 5.0, 500), (60, 1.0, 200)):
+            self.assertTrue(aggregator.add(get_point(second, latency, status)))
+        self.assertEqual(3, len(aggregator.windows))
+        self.assertEqual([], aggregator.close_windows())
+        # The first window is closed 120 seconds after its end
+        aggregator.add(get_point(180, 1.0))
+        points = aggregator.close_windows()
+        self.assertEqual(2, len(points))
+        point = points[0]
+        self.assertEqual(('request.aggregated', {'status': 200}), (point.measurement, point['tags']))
+        self.assertEqual(0, point.time - point.time % 60000000)
+        self.assertEqual((3, 6.0, 1.0, 3.0), tuple(point['fields'][key] for key in
+                                                   ('count', 'latency_sum', 'latency_min', 'latency_max')))
+        self.assertAlmostEqual(2.0, point['fields']['latency_p50'], delta=0.02)
+        self.assertEqual({'count': 1, 'latency_sum': 5.0, 'latency_min': 5.0, 'latency_max': 5.0,
+                          'latency_p50': 5.0, 'latency_p90': 5.0, 'latency_p99': 5.0}, points[1]['fields'])
+        # A late point of a closed window is written as a separate part
+        aggregator.add(get_point(1, 1.0))
+        aggregator.add(get_point(400, 1.0))
+        late = [point for point in aggregator.close_windows() if point.time < 60000000]
+        self.assertEqual(1, len(late))
+        self.assertEqual(point.time + 1, late[0].time)
+
+    def test_none_tags(self):
+        aggregator = Aggregator(CONFIG, 'test')
+        aggregator.add(get_point(0, 1.0, None))
+        aggregator.add(get_point(0, 2.0, 200))
+        aggregator.add(get_point(400, 1.0))
+        points = aggregator.close_windows()
+        self.assertEqual([{'status': 200}, {'status': None}], sorted((point['tags'] for point in points), key=repr))
+
+    def test_keep_raw(self):
+        aggregator = Aggregator(AggregationConfig({'measurements': {'request': []}, 'keep_raw': True}), 'test')
+        self.assertFalse(aggregator.add(get_point(0, 1.0)))
+        self.assertEqual(1, len(aggregator.windows))
+
+
+class AggregationStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = AggregationStore(os.path.join(self.directory, 'aggregation.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_hand_off(self):
+        first = Aggregator(CONFIG, 'first')
+        first.add(get_point(0, 1.0))
+        first.add(get_point(100, 1.0))
+        self.store.put(first.take_open_windows(), first.watermark)
+        self.assertEqual({}, self.store.take(first.lateness + first.window_size))
+        second = Aggregator(CONFIG, 'second')
+        second.add(get_point(50, 2.0))
+        second.add(get_point(200, 2.0))
+        self.store.put(second.take_open_windows(), second.watermark)
+        windows = self.store.take(second.lateness + second.window_size)
+        self.assertEqual([('request', (('status', 200),), 0)], list(windows))
+        window = windows[('request', (('status', 200),), 0)]
+        self.assertEqual((2, 3.0), (window.count, window.sketches['latency'].sum))
+        self.assertEqual(2, len(self.store.take(None)))
+        self.assertEqual({}, self.store.take(None))
+
+    def test_hand_off_retried(self):
+        aggregation.configure(AggregationConfig({'enabled': True, 'window': 60, 'lateness': 120,
+                                                 'measurements': {'request': ['latency']}}))
+        try:
+            for _ in range(2):
+                aggregator = Aggregator(aggregation.settings, 'logs.json[0:100]')
+                aggregator.add(get_point(0, 1.0, None))
+                aggregation.hand_off(aggregator)
+            windows, points = aggregation.take_all('test')
+            self.assertEqual([1], [window.count for window in windows.values()])
+            self.assertEqual([{'status': None}], [point['tags'] for point in points])
+        finally:
+            aggregation.configure(AggregationConfig({}))
+
+    def test_restore(self):
+        aggregator = Aggregator(CONFIG, 'test')
+        aggregator.add(get_point(0, 1.0))
+        aggregator.add(get_point(400, 2.0))
+        aggregator.close_windows()
+        restored = Aggregator(CONFIG, 'test')
+        restored.restore(json.loads(json.dumps(aggregator.get_state())))
+        self.assertEqual((aggregator.watermark, aggregator.parts), (restored.watermark, restored.parts))
+        self.assertEqual([point.to_dict() for point in aggregator.to_points(aggregator.windows)],
+                         [point.to_dict() for point in restored.to_points(restored.windows)])
+
+    def test_window_json(self):
+        window = Window()
+        window.count = 2
+        window.sketches['latency'] = Sketch()
+        window.sketches['latency'].add(0.5)
+        self.assertEqual(window.to_json(), Window.from_json(window.to_json()).to_json())
+
+
+class ProcessLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        aggregation.configure(AggregationConfig({
+            'enabled': True,
+            'measurements': {'rogerthat.callback_api': []},
+            'state_path': os.path.join(self.directory, 'aggregation.sqlite'),
+        }))
+
+    def tearDown(self):
+        aggregation.configure(AggregationConfig({}))
+        shutil.rmtree(self.directory)
+
+    def test_process_lines(self):
+        lines = [json.dumps(json.loads(get_file_content(filename))).encode('utf-8') + b'\n'
+                 for filename in ('callback-api.json', 'total-users.json')] * 100
+        client = FakeInfluxDBClient()
+        process_lines(client, lines, 'logs.json')
+        # The callback window is still open, so it's handed off
+        self.assertEqual(3100, len(client.lines))
+        self.assertFalse([line for line in client.lines if line.startswith(b'rogerthat.callback_api')])
+        _, points = aggregation.take_all('test')
+        self.assertEqual([('rogerthat.callback_api.aggregated', 100)],
+                         [(point.measurement, point['fields']['count']) for point in points])
+
+    def test_resume(self):
+        lines = [json.dumps(json.loads(get_file_content(filename))).encode('utf-8') + b'\n'
+                 for filename in ('callback-api.json', 'total-users.json')] * 10
+        checkpoint_path = os.path.join(self.directory, 'logs.json.checkpoint')
+        writer.configure(InfluxConfig({'batch_size': 10, 'min_batch_size': 10, 'max_batch_size': 10}))
+        interval, bizz.AGGREGATION_CHECKPOINT_INTERVAL = bizz.AGGREGATION_CHECKPOINT_INTERVAL, 0
+        try:
+            with self.assertRaises(ConnectionError):
+                process_lines(CrashingClient(10), lines, 'logs.json', checkpoint_path=checkpoint_path)
+            checkpoint = load_checkpoint(checkpoint_path)
+            self.assertTrue(checkpoint.line_number)
+            # The callback lines before the checkpoint are in its open window
+            [(_, _, _, window)] = checkpoint.aggregation['windows']
+            self.assertEqual((checkpoint.line_number + 1) // 2, Window.from_json(window).count)
+            process_lines(FakeInfluxDBClient(), lines[checkpoint.line_number:], 'logs.json', None, checkpoint_path,
+                          checkpoint)
+        finally:
+            bizz.AGGREGATION_CHECKPOINT_INTERVAL = interval
+            writer.configure(InfluxConfig({}))
+        _, points = aggregation.take_all('test')
+        self.assertEqual([10], [point['fields']['count'] for point in points])
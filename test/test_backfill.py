@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from log_parser.backfill import Progress, backfill, find_files
+from log_parser.config import LogParserConfig
+from log_parser.writer import LineProtocolFiles
+from test.test_parser import get_file_content
+
+
+class LineProtocolFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shards(self):
+        files = LineProtocolFiles(os.path.join(self.directory, 'logs'), 'monitoring', max_lines=4)
+        files.write_lines([b'test value=%di' % i for i in range(3)])
+        files.write_lines([b'test value=%di' % i for i in range(3, 10)])
+        self.assertEqual(2, len(files.paths))
+        files.close()
+        self.assertEqual(['logs.0.txt.gz', 'logs.1.txt.gz', 'logs.2.txt.gz'], sorted(os.listdir(self.directory)))
+        with gzip.open(files.paths[2], 'rb') as f:
+            self.assertEqual(b'# DDL\nCREATE DATABASE monitoring\n# DML\n# CONTEXT-DATABASE: monitoring\n'
+                             b'test value=8i\ntest value=9i\n', f.read())
+
+    def test_discard(self):
+        files = LineProtocolFiles(os.path.join(self.directory, 'logs'), 'monitoring', max_lines=4)
+        files.write_lines([b'test value=%di' % i for i in range(6)])
+        self.assertEqual(['logs.0.txt.gz', 'logs.1.txt.gz.tmp'], sorted(os.listdir(self.directory)))
+        files.discard()
+        self.assertEqual(([], []), (files.paths, os.listdir(self.directory)))
+
+
+class BackfillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logs = os.path.join(self.directory, 'logs')
+        self.output = os.path.join(self.directory, 'output')
+        lines = [json.dumps(json.loads(get_file_content(filename)))
+                 for filename in ('callback-api.json', 'total-users.json', 'channel.json')]
+        for folder in ('2018-03-06 07:00:00', '2018-03-06 08:00:00'):
+            os.makedirs(os.path.join(self.logs, folder))
+            with open(os.path.join(self.logs, folder, 'logs.json'), 'w') as f:
+                f.write('\n'.join(lines * 10))
+        with open(os.path.join(self.logs, 'notes.txt'), 'w') as f:
+            f.write('not a log file')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_files(self):
+        self.assertEqual(['2018-03-06 07:00:00/logs.json', '2018-03-06 08:00:00/logs.json'],
+                         find_files(self.logs, '*.json'))
+        self.assertEqual(['2018-03-06 08:00:00/logs.json'], find_files(self.logs, '2018-03-06 08*'))
+
+    def test_backfill_to_files(self):
+        configuration = LogParserConfig({
+            'influxdb': {'db': 'monitoring'},
+            'resolver': {'cache_path': os.path.join(self.directory, 'service_apps.sqlite')},
+            'stats': {'enabled': False},
+        })
+        self.assertEqual([], backfill(self.logs, configuration, 2, self.output, '*.json', chunk_size=2000))
+        lines = []
+        for root, _, filenames in os.walk(self.output):
+            for filename in filenames:
+                self.assertTrue(filename.endswith('.txt.gz'), filename)
+                with gzip.open(os.path.join(root, filename), 'rb') as f:
+                    lines.extend(line for line in f.read().splitlines() if not line.startswith(b'#'))
+        self.assertEqual(2 * 320, len([line for line in lines if not line.startswith(b'CREATE DATABASE')]))
+
+
+class ProgressTest(unittest.TestCase):
+
+    def test_remaining(self):
+        progress = Progress(1000)
+        self.assertIsNone(progress.remaining_seconds)
+        progress.started -= 10
+        progress.add(250, 40)
+        self.assertAlmostEqual(30, progress.remaining_seconds, delta=1)
+        self.assertIn('(25.0%)', progress.report())
+        self.assertIn('40 points', progress.report())
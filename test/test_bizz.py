@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from log_parser import writer
+from log_parser.bizz import get_line_ranges, iter_blob_lines, process_logs, list_new_files, _get_next_date, \
+    get_checkpoint_path
+from log_parser.checkpoint import load_checkpoint
+from log_parser.config import InfluxConfig
+from log_parser.prefilter import Prefilter
+from test.fakes import FakeBucket, FakeInfluxDBClient
+from test.test_parser import get_file_content
+
+
+class LineRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _get_ranges(self, content: bytes, chunk_size: int):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+        return get_line_ranges(self.path, chunk_size)
+
+    def test_ranges_end_on_newlines(self):
+        content = b'aaaa\nbb\ncccccc\nd\n'
+        ranges = self._get_ranges(content, 6)
+        self.assertEqual([(0, 8), (8, 15), (15, 17)], ranges)
+        self.assertEqual(content, b''.join(content[start:end] for start, end in ranges))
+
+    def test_last_line_without_newline(self):
+        self.assertEqual([(0, 5), (5, 8)], self._get_ranges(b'aaaa\nbbb', 2))
+
+    def test_empty_file(self):
+        self.assertEqual([], self._get_ranges(b'', 10))
+
+    def test_single_range(self):
+        self.assertEqual([(0, 8)], self._get_ranges(b'aaaa\nbb\n', 1024))
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.bucket = FakeBucket(self.root_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_iter_blob_lines(self):
+        lines = [b'a' * length for length in (0, 1, 7, 3, 20, 2, 0, 5)]
+        blob = self.bucket.blob('2018-03-06 07:00:00/lines.json')
+        expected = [line + b'\n' for line in lines]
+        for content, expected in ((b'\n'.join(lines), expected[:-1] + [lines[-1]]), (b''.join(expected), expected)):
+            blob.upload_from_string(content)
+            for chunk_size in (1, 2, 3, 7, 100):
+                self.assertEqual(expected, list(iter_blob_lines(blob, chunk_size, buffer_chunks=2)), chunk_size)
+            # Starting at the second line
+            self.assertEqual(expected[1:], list(iter_blob_lines(blob, 3, start=1)))
+
+    def test_process_logs(self):
+        lines = [json.dumps(json.loads(get_file_content(filename)))
+                 for filename in ('callback-api.json', 'total-users.json', 'channel.json')]
+        bucket_path = '2018-03-06 07:00:00/logs.json'
+        self.bucket.blob(bucket_path).upload_from_string('\n'.join(lines * 10))
+        client = FakeInfluxDBClient()
+        process_logs(os.path.join(self.root_dir, 'data'), client, self.bucket, bucket_path, Prefilter(), 100)
+        self.assertEqual(320, len(client.lines))
+
+
+class CrashingClient(FakeInfluxDBClient):
+
+    def __init__(self, max_requests: int) -> None:
+        super().__init__()
+        self.max_requests = max_requests
+
+    def request(self, *args, **kwargs):
+        if self.requests >= self.max_requests:
+            raise ConnectionError('influxdb is down')
+        super().request(*args, **kwargs)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.bucket = FakeBucket(self.root_dir)
+        self.download_directory = os.path.join(self.root_dir, 'data')
+        writer.configure(InfluxConfig({'batch_size': 10, 'min_batch_size': 10, 'max_batch_size': 10}))
+
+    def tearDown(self):
+        writer.configure(InfluxConfig({}))
+        shutil.rmtree(self.root_dir)
+
+    def test_resume(self):
+        lines = [json.dumps(json.loads(get_file_content(filename)))
+                 for filename in ('callback-api.json', 'total-users.json', 'channel.json')]
+        content = '\n'.join(lines * 10)
+        bucket_path = '2018-03-06 07:00:00/logs.json'
+        self.bucket.blob(bucket_path).upload_from_string(content)
+        checkpoint_path = get_checkpoint_path(self.download_directory, self.bucket.name, bucket_path)
+        for stream_chunk_size in (0, 100):
+            client = FakeInfluxDBClient()
+            process_logs(self.download_directory, client, self.bucket, bucket_path, None, stream_chunk_size)
+            crashing_client = CrashingClient(10)
+            with self.assertRaises(ConnectionError):
+                process_logs(self.download_directory, crashing_client, self.bucket, bucket_path, None,
+                             stream_chunk_size)
+            checkpoint = load_checkpoint(checkpoint_path)
+            self.assertTrue(checkpoint.offset)
+            self.assertEqual('\n', content[checkpoint.offset - 1])
+            self.assertEqual(content[:checkpoint.offset].count('\n'), checkpoint.line_number)
+            self.assertLessEqual(checkpoint.batch_sequence, 10)
+            resumed_client = FakeInfluxDBClient()
+            process_logs(self.download_directory, resumed_client, self.bucket, bucket_path, None, stream_chunk_size)
+            self.assertLess(len(resumed_client.lines), len(client.lines))
+            self.assertEqual(set(client.lines), set(crashing_client.lines + resumed_client.lines))
+            self.assertFalse(os.path.exists(checkpoint_path))
+
+
+class ListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = FakeBucket(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, name: str) -> None:
+        self.bucket.blob(name).upload_from_string('{}')
+
+    def test_incremental(self):
+        self.add('2018-03-06 07:00:00/a.json')
+        self.add('2018-03-06 09:00:00/b.json')
+        self.add('2018-03-06 09:00:00/b.txt')
+        files, watermark = list_new_files(self.bucket, set(), None, 1)
+        self.assertEqual(['2018-03-06 07:00:00/a.json', '2018-03-06 09:00:00/b.json'], [f.name for f in files])
+        self.assertEqual('2018-03-06 09:00:00', watermark)
+        known_files = {f.name for f in files}
+        self.add('2018-03-06 07:00:00/late.json')
+        self.add('2018-03-06 08:00:00/c.json')
+        self.add('2018-03-06 10:00:00/d.json')
+        files, watermark = list_new_files(self.bucket, known_files, watermark, 1)
+        # Folders before the overlap aren't listed again
+        self.assertEqual(['2018-03-06 08:00:00/c.json', '2018-03-06 10:00:00/d.json'], [f.name for f in files])
+        self.assertEqual('2018-03-06 10:00:00', watermark)
+
+    def test_compacted_folders(self):
+        self.add('2018-03-06 07:00:00/a.json')
+        self.add('2018-03-06 08:00:00/b.json')
+        self.add('2018-03-06 09:00:00/c.json')
+        files, watermark = list_new_files(self.bucket, set(), '2018-03-06 09:00:00', 2, '2018-03-06 07:00:00')
+        self.assertEqual(['2018-03-06 08:00:00/b.json', '2018-03-06 09:00:00/c.json'], [f.name for f in files])
+
+    def test_next_date(self):
+        self.assertIsNone(_get_next_date(self.bucket))
+        self.add('2018-03-06 07:00:00/a.json')
+        self.add('2018-03-06 09:00:00/b.json')
+        self.assertEqual(datetime(2018, 3, 6, 7), _get_next_date(self.bucket))
+        self.assertEqual(datetime(2018, 3, 6, 9), _get_next_date(self.bucket, datetime(2018, 3, 6, 7)))
+        self.assertIsNone(_get_next_date(self.bucket, datetime(2018, 3, 6, 9)))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from log_parser.db import DatabaseConnection
+from log_parser.models import LogParserFile
+
+
+class DatabaseConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files(self):
+        db = DatabaseConnection(self.directory)
+        db.add_files([LogParserFile('2018-03-06 07:00:00/a.json', None, 'bucket'),
+                      LogParserFile('2018-03-06 08:00:00/b.json', None, 'bucket'),
+                      LogParserFile('2018-03-06 08:00:00/c.json', None, 'other')], {'bucket': '2018-03-06 08:00:00'})
+        # Known files are ignored
+        db.add_files([LogParserFile('2018-03-06 07:00:00/a.json', None, 'bucket')], {})
+        db.set_processed('bucket', '2018-03-06 07:00:00/a.json', 1520320437)
+        self.assertEqual([('bucket', '2018-03-06 08:00:00/b.json'), ('other', '2018-03-06 08:00:00/c.json')],
+                         [(f.bucket, f.name) for f in db.get_unprocessed_files()])
+        self.assertEqual({'2018-03-06 07:00:00/a.json', '2018-03-06 08:00:00/b.json'}, db.get_file_names('bucket'))
+        self.assertEqual({'2018-03-06 08:00:00/b.json'}, db.get_file_names('bucket', '2018-03-06 08:00:00'))
+        self.assertEqual({'bucket': '2018-03-06 08:00:00'}, db.get_watermarks())
+        # Still there after a restart
+        self.assertEqual(2, len(DatabaseConnection(self.directory).get_unprocessed_files()))
+
+    def test_migrate_settings(self):
+        with open(os.path.join(self.directory, 'settings.json'), 'w') as f:
+            json.dump({'files': [{'name': 'a.json', 'processed_timestamp': 1520320437, 'bucket': 'bucket'},
+                                 {'name': 'b.json', 'processed_timestamp': None, 'bucket': 'bucket'}]}, f)
+        db = DatabaseConnection(self.directory)
+        self.assertEqual(['b.json'], [f.name for f in db.get_unprocessed_files()])
+        self.assertEqual({'a.json', 'b.json'}, db.get_file_names('bucket'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'settings.json')))
+
+    def test_add_size_column(self):
+        # Database of a version that didn't store the size of the files
+        connection = sqlite3.connect(os.path.join(self.directory, 'state.sqlite'))
+        with connection:
+            connection.execute('CREATE TABLE files (bucket TEXT NOT NULL, name TEXT NOT NULL, '
+                               'processed_timestamp INTEGER, PRIMARY KEY (bucket, name))')
+            connection.execute("INSERT INTO files VALUES ('bucket', 'a.json', NULL)")
+        connection.close()
+        db = DatabaseConnection(self.directory)
+        self.assertEqual([('a.json', None)], [(f.name, f.size) for f in db.get_unprocessed_files()])
+        db.add_files([LogParserFile('b.json', None, 'bucket', 10)], {})
+        self.assertEqual([None, 10], [f.size for f in db.get_unprocessed_files()])
+
+    def test_compact(self):
+        db = DatabaseConnection(self.directory)
+        db.add_files([LogParserFile('2018-03-06 07:00:00/a.json', 1, 'bucket'),
+                      LogParserFile('2018-03-06 07:00:00/b.json', 1, 'bucket'),
+                      LogParserFile('2018-03-06 08:00:00/c.json', 2, 'bucket'),
+                      LogParserFile('2018-03-06 09:00:00/d.json', None, 'bucket'),
+                      LogParserFile('2018-03-06 10:00:00/e.json', 3, 'bucket')], {})
+        # Stops at the first folder with files that still need processing
+        self.assertEqual(3, db.compact('bucket', '2018-03-06 11:00:00'))
+        self.assertEqual('2018-03-06 08:00:00', db.get_compacted_folder('bucket'))
+        self.assertEqual({'2018-03-06 09:00:00/d.json', '2018-03-06 10:00:00/e.json'}, db.get_file_names('bucket'))
+        self.assertEqual(0, db.compact('bucket', '2018-03-06 11:00:00'))
+        db.set_processed('bucket', '2018-03-06 09:00:00/d.json', 4)
+        self.assertEqual(1, db.compact('bucket', '2018-03-06 10:00:00'))
+        self.assertEqual('2018-03-06 09:00:00', db.get_compacted_folder('bucket'))
+        self.assertIsNone(db.get_compacted_folder('other'))
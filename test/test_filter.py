@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+
+from log_parser.parsers.filter import PathIndex
+
+
+def _collect(name):
+    def listener(value):
+        yield name, value
+    return listener
+
+
+class PathIndexTest(unittest.TestCase):
+
+    def test_nested_paths(self):
+        index = PathIndex()
+        index.add('', _collect('root'))
+        index.add('request_data.params.user_details.item', _collect('user'))
+        index.add('protoPayload.line.item', _collect('line'))
+        value = {
+            'request_data': {'params': {'user_details': [{'app_id': 'a'}, {'app_id': 'b'}]}},
+            'response_data': {'huge': list(range(10))},
+        }
+        self.assertEqual([('user', {'app_id': 'a'}), ('user', {'app_id': 'b'}), ('root', value)],
+                         list(index.dispatch(value)))
+
+    def test_only_objects_are_dispatched(self):
+        index = PathIndex()
+        index.add('', _collect('root'))
+        index.add('a', _collect('a'))
+        self.assertEqual([], list(index.dispatch([1, 2])))
+        self.assertEqual([('root', {'a': 'not an object'})], list(index.dispatch({'a': 'not an object'})))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+from datetime import datetime
+
+from influxdb.line_protocol import make_lines
+
+from log_parser.line_protocol import from_epoch, make_line, parse_time
+from log_parser.point import Point
+from test.test_parser import _analyze, get_file_content
+
+
+class LineProtocolTest(unittest.TestCase):
+
+    def test_same_as_influxdb(self):
+        for filename in ('full-request-log-malicious-useragent.json', 'test-log-task.json', 'request-log.json',
+                         'callback-api-loyalty.json', 'app-log.json', 'total-services.json'):
+            points = _analyze(get_file_content(filename))
+            expected = make_lines({'points': points}, precision='u').encode('utf-8', 'replace')
+            self.assertEqual(expected, b''.join(make_line(point) + b'\n' for point in points), filename)
+
+    def test_escaping(self):
+        point = Point(measurement='my measurement',
+                      tags={'a,b': 'c=d', 'empty': '', 'none': None, 'status': 200},
+                      time=1520320437405700,
+                      fields={'text': 'say "hi"\n', 'int': 1, 'float': 1.5, 'bool': True, 'none': None})
+        self.assertEqual(b'my\\ measurement,a\\,b=c\\=d,status=200 bool=True,float=1.5,int=1i,'
+                         b'text="say \\"hi\\"\\n" 1520320437405700', make_line(point))
+
+    def test_parse_time(self):
+        self.assertEqual(1538465879713854, parse_time('2018-10-02T07:37:59.713854Z'))
+        self.assertEqual(1520320437405700, parse_time('2018-03-06T07:13:57.405700Z'))
+        self.assertEqual(1520320437000000, parse_time('2018-03-06T07:13:57Z'))
+
+    def test_from_epoch(self):
+        for seconds in (1520320437, 1520320437.4057, 1538465879.713854, 1538465879.9999996):
+            expected = parse_time(datetime.utcfromtimestamp(seconds).isoformat() + 'Z')
+            self.assertEqual(expected, from_epoch(seconds), seconds)
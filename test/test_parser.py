@@ -20,8 +20,11 @@ from typing import List
 
 from influxdb.line_protocol import make_lines
 
+from log_parser import resolver
 from log_parser.analyzer import analyze
+from log_parser.config import ResolverConfig
 from log_parser.parsers import oca
+from test.fakes import FakeServiceAppServer
 
 
 def _analyze(line: str) -> List[dict]:
@@ -74,7 +77,17 @@ class ParserTest(unittest.TestCase):
         self.check_length('callback-api-bad-tag.json', 1)
 
     def test_api(self):
-        self.check_length('api.json', 1)
+        with FakeServiceAppServer({'service-xxxxxxxxxx@rogerth.at': 'rogerthat'}) as server:
+            resolver.configure(ResolverConfig({'url': server.url}))
+            try:
+                # Parked until the app id is resolved
+                self.check_length('api.json', 0)
+                points = resolver.get_resolver().drain(5)
+                self.assertEqual(1, len(points))
+                self.assertEqual('rogerthat', points[0]['tags']['app_id'])
+                self.check_length('api.json', 1)
+            finally:
+                resolver.configure(ResolverConfig({}))
 
     def test_without_type(self):
         self.check_length('without-type.json', 1)
@@ -143,3 +156,8 @@ class ParserTest(unittest.TestCase):
 
     def test_convert_string_time(self):
         self.check_length('test-str-time.json', 3)
+
+    def test_bytes(self):
+        for filename in ('full-request-log.json', 'callback-api.json', 'truncated.json', 'total-users.json'):
+            line = get_file_content(filename)
+            self.assertEqual(_analyze(line), _analyze(line.encode('utf-8')), filename)
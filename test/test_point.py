@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+
+from log_parser.point import Point
+
+
+class PointTest(unittest.TestCase):
+
+    def test_tags_are_interned(self):
+        first = Point('api', {'user': 'a', 'function': 'b'}, 1, {'amount': 1})
+        second = Point('api', {'function': 'b', 'user': 'a'}, 2, {'amount': 2})
+        self.assertIs(first.tags, second.tags)
+        self.assertEqual((('function', 'b'), ('user', 'a')), first.tags)
+
+    def test_to_dict(self):
+        point = Point('api', {'user': 'a'}, 1, {'amount': 1})
+        expected = {'measurement': 'api', 'tags': {'user': 'a'}, 'time': 1, 'fields': {'amount': 1}}
+        self.assertEqual(expected, point.to_dict())
+        self.assertEqual({'user': 'a'}, point['tags'])
+        self.assertEqual('api', point['measurement'])
+        self.assertNotIn('foo', point)
+        self.assertIsNone(point.get('foo'))
+        with self.assertRaises(KeyError):
+            point['foo']
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import unittest
+
+from log_parser.prefilter import Prefilter, UNTYPED
+from test.test_parser import get_file_content
+
+
+class PrefilterTest(unittest.TestCase):
+
+    def test_skip_types(self):
+        prefilter = Prefilter()
+        self.assertTrue(prefilter.skip(json.dumps({'type': 'web', 'request_data': {'type': 'app'}})))
+        self.assertTrue(prefilter.skip('{"request_data": {"a": {"type": "app"}}, "type": "web_channel"}'))
+        self.assertFalse(prefilter.skip('{"request_data": {"a": {"type": "web"}}, "type": "app"}'))
+        self.assertFalse(prefilter.skip('{"request_data": [{"type": "web"}], "timestamp": 1}'))
+        self.assertDictEqual({'web': 1, 'web_channel': 1}, prefilter.skipped)
+
+    def test_bytes(self):
+        prefilter = Prefilter()
+        self.assertTrue(prefilter.skip(b'{"request_data": {"a": {"type": "app"}}, "type": "web_channel"}'))
+        self.assertFalse(prefilter.skip(b'{"request_data": {"a": {"type": "web"}}, "type": "app"}'))
+        self.assertFalse(prefilter.skip(get_file_content('full-request-log.json').encode('utf-8')))
+        self.assertDictEqual({'web_channel': 1}, prefilter.skipped)
+
+    def test_skip_untyped(self):
+        prefilter = Prefilter()
+        self.assertTrue(prefilter.skip(get_file_content('channel.json')))
+        self.assertTrue(prefilter.skip('\n'))
+        self.assertFalse(prefilter.skip(get_file_content('without-type.json')))
+        self.assertFalse(prefilter.skip(get_file_content('full-request-log.json')))
+        self.assertDictEqual({UNTYPED: 2}, prefilter.skipped)
+        self.assertFalse(Prefilter(skip_untyped=False).skip(get_file_content('channel.json')))
+
+    def test_fixtures_with_points_are_kept(self):
+        prefilter = Prefilter()
+        for filename in ('api.json', 'app-log.json', 'callback-api.json', 'truncated.json', 'created-apps.json',
+                         'oca-custom-loyalty-cards.json', 'request-log.json', 'test-log-task.json'):
+            self.assertFalse(prefilter.skip(get_file_content(filename)), filename)
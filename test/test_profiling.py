@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from log_parser.analyzer import analyze
+from log_parser.config import ProfilingConfig
+from log_parser.profiling import load_profiling_config, profile, save_profiling_config, should_profile
+from test.test_parser import get_file_content
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def test_should_profile(self):
+        self.assertFalse(should_profile(ProfilingConfig({}), 'bucket', '2018-10-02 07:00:00/logs.json'))
+        config = ProfilingConfig({'files': ['bucket/2018-10-02 *']})
+        self.assertTrue(should_profile(config, 'bucket', '2018-10-02 07:00:00/logs.json'))
+        self.assertFalse(should_profile(config, 'other', '2018-10-02 07:00:00/logs.json'))
+        self.assertTrue(should_profile(ProfilingConfig({'files': ['*/logs.json']}), 'other', '2018/logs.json'))
+        self.assertTrue(should_profile(ProfilingConfig({'worker': os.getpid()}), 'bucket', 'logs.json'))
+
+    def test_sample(self):
+        names = ['2018-10-02 %02d:00:00/logs.json' % hour for hour in range(24)] * 10
+        sampled = [name for name in names if should_profile(ProfilingConfig({'sample_rate': 0.5}), 'bucket', name)]
+        self.assertTrue(0 < len(sampled) < len(names))
+        # The same files every time
+        self.assertEqual(0, len(sampled) % 10)
+        self.assertEqual(len(names), len([name for name in names
+                                          if should_profile(ProfilingConfig({'sample_rate': 1}), 'bucket', name)]))
+
+    def test_load_config(self):
+        default = ProfilingConfig({'sample_rate': 0.1})
+        self.assertIs(default, load_profiling_config(self.data_path, default))
+        self.assertEqual(os.path.join(self.data_path, 'profiles'), default.output_path)
+        save_profiling_config(self.data_path, {'files': ['*']})
+        config = load_profiling_config(self.data_path, default)
+        self.assertEqual((['*'], 0.0), (config.files, config.sample_rate))
+
+    def test_profile(self):
+        config = load_profiling_config(self.data_path, ProfilingConfig({'files': ['*'], 'top': 5}))
+        with profile(config, 'bucket', '2018-10-02 07:00:00/logs.json', '.0-100'):
+            for name in ('callback-api.json', 'app-log.json', 'full-request-log.json'):
+                list(analyze(get_file_content(name)))
+        path = os.path.join(self.data_path, 'profiles', 'bucket', '2018-10-02 07:00:00', 'logs.json.0-100')
+        self.assertTrue(pstats.Stats(path + '.prof').total_calls)
+        with open(path + '.txt') as f:
+            summary = f.read()
+        self.assertIn('Log type callback_api:', summary)
+        self.assertIn('Log type request_log:', summary)
+        self.assertIn('callback_api)', summary)
+
+    def test_not_selected(self):
+        with profile(ProfilingConfig({'output_path': self.data_path}), 'bucket', 'logs.json'):
+            pass
+        self.assertEqual([], os.listdir(self.data_path))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import unittest
+
+from log_parser import analyzer
+from log_parser.config import DecodeConfig
+from log_parser.projection import Projection, has_fast_backend, project
+from test.test_parser import get_file_content
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_project(self):
+        projection = Projection.from_paths(['type', 'request_data', 'response_data.c.item.t'])
+        line = json.dumps({'type': 'app',
+                           'request_data': {'a': [1, {'b': 2}]},
+                           'response_data': {'huge': [{'x': 1}] * 10, 'c': [{'t': 1, 'f': 'x'}, {'f': 'y'}]},
+                           'other': {'x': [1, 2]}})
+        self.assertDictEqual({'type': 'app',
+                              'request_data': {'a': [1, {'b': 2}]},
+                              'response_data': {'c': [{'t': 1}, {}]}}, project(line, projection))
+
+    def test_scalar_instead_of_object(self):
+        projection = Projection.from_paths(['request_data.c'])
+        self.assertDictEqual({'request_data': '{"c": 1}'}, project('{"request_data": "{\\"c\\": 1}"}', projection))
+
+    def test_truncated(self):
+        projection = Projection.from_paths(['a', 'b.c'])
+        self.assertDictEqual({'a': 1.5, 'b': {'c': [{'d': 'e'}]}},
+                             project('{"a": 1.5, "x": [1], "b": {"c": [{"d": "e"}, "trunc', projection))
+
+    @unittest.skipUnless(has_fast_backend, 'Projection is only used with the C backend of ijson')
+    def test_min_size(self):
+        lines = [json.dumps(json.loads(get_file_content(name))) for name in ('app-log.json', 'callback-api.json')]
+        try:
+            analyzer.configure(DecodeConfig({'projection_min_size': 1}))
+            projected = [point.to_dict() for line in lines for point in analyzer.analyze(line)]
+            analyzer.configure(DecodeConfig({'projection_min_size': 0}))
+            decoded = [point.to_dict() for line in lines for point in analyzer.analyze(line)]
+        finally:
+            analyzer.configure(DecodeConfig({}))
+        self.assertTrue(decoded)
+        self.assertEqual(decoded, projected)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import os
+import shutil
+import tempfile
+import unittest
+
+from log_parser.config import ResolverConfig
+from log_parser.resolver import FAILURE_TTL, ResolverCache, ServiceAppResolver, UNKNOWN_APP_ID
+from test.fakes import FakeServiceAppServer
+
+
+class ServiceAppResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = FakeServiceAppServer({'service-a': 'app-a'}).__enter__()
+        self.resolvers = []
+
+    def tearDown(self):
+        for resolver in self.resolvers:
+            resolver.close()
+        self.server.__exit__()
+        shutil.rmtree(self.directory)
+
+    def get_resolver(self) -> ServiceAppResolver:
+        resolver = ServiceAppResolver(ResolverConfig({'url': self.server.url,
+                                                      'cache_path': os.path.join(self.directory, 'cache.sqlite')}))
+        self.resolvers.append(resolver)
+        return resolver
+
+    def test_parked_until_resolved(self):
+        resolver = self.get_resolver()
+        self.assertIsNone(resolver.get_app_id('service-a'))
+        resolver.park('service-a', 'api', {'method': 'a'}, 1, {'service': 'service-a'})
+        resolver.park('service-a', 'api', {'method': 'b'}, 2, {'service': 'service-a'})
+        points = resolver.drain(5)
+        self.assertEqual([{'method': 'a', 'app_id': 'app-a'}, {'method': 'b', 'app_id': 'app-a'}],
+                         [point['tags'] for point in points])
+        self.assertEqual(['service-a'], self.server.requests)
+        self.assertEqual([], resolver.drain(5))
+
+    def test_has_unwritten_points(self):
+        resolver = self.get_resolver()
+        self.assertFalse(resolver.has_unwritten_points())
+        self.server.release.clear()
+        resolver.park('service-a', 'api', {}, 1, {})
+        self.assertTrue(resolver.has_unwritten_points())
+        self.server.release.set()
+        resolver.executor.shutdown(wait=True)
+        # Resolved, but not drained yet
+        self.assertTrue(resolver.has_unwritten_points())
+        self.assertEqual(1, len(resolver.drain()))
+        self.assertFalse(resolver.has_unwritten_points())
+
+    def test_shared_cache(self):
+        resolver = self.get_resolver()
+        resolver.park('service-a', 'api', {}, 1, {})
+        resolver.drain(5)
+        self.assertEqual('app-a', resolver.get_app_id('service-a'))
+        # Another process uses the same database
+        self.assertEqual('app-a', self.get_resolver().get_app_id('service-a'))
+        self.assertEqual(['service-a'], self.server.requests)
+
+    def test_failed_lookup(self):
+        resolver = self.get_resolver()
+        resolver.park('service-b', 'api', {}, 1, {})
+        self.assertEqual([{'app_id': UNKNOWN_APP_ID}], [point['tags'] for point in resolver.drain(5)])
+        # Not looked up again for a while
+        self.assertEqual(UNKNOWN_APP_ID, resolver.get_app_id('service-b'))
+        resolver.failed['service-b'] -= FAILURE_TTL
+        self.assertIsNone(resolver.get_app_id('service-b'))
+        # Nor shared with other processes
+        self.assertIsNone(self.get_resolver().get_app_id('service-b'))
+
+    def test_clearing_on_error(self):
+        resolver = self.get_resolver()
+        self.server.release.clear()
+        with self.assertRaises(ValueError):
+            with resolver.clearing_on_error():
+                resolver.park('service-a', 'api', {}, 1, {})
+                raise ValueError('The file failed')
+        self.assertFalse(resolver.has_unwritten_points())
+        self.server.release.set()
+        self.assertEqual([], resolver.drain(5))
+        self.assertEqual('app-a', resolver.get_app_id('service-a'))
+
+    def test_slow_lookup(self):
+        resolver = self.get_resolver()
+        self.server.release.clear()
+        resolver.park('service-a', 'api', {}, 1, {})
+        self.assertEqual([], resolver.drain())
+        self.assertEqual([{'app_id': UNKNOWN_APP_ID}], [point['tags'] for point in resolver.drain(0.1)])
+        self.server.release.set()
+
+
+class ResolverCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = ResolverCache(':memory:', 60, 2, eviction_interval=1)
+        cache.put('a', 'app-a')
+        cache.put('b', 'app-b')
+        cache.connection.execute('UPDATE service_apps SET used = 0 WHERE service_hash = ?', ('a',))
+        cache.put('c', 'app-c')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual('app-b', cache.get('b')[0])
+        self.assertEqual('app-c', cache.get('c')[0])
+
+    def test_eviction_batch(self):
+        cache = ResolverCache(':memory:', 60, 100, eviction_interval=50)
+        for i in range(149):
+            cache.put(str(i), 'app')
+        self.assertEqual(149, cache.connection.execute('SELECT COUNT(*) FROM service_apps').fetchone()[0])
+        cache.put('149', 'app')
+        self.assertEqual(90, cache.connection.execute('SELECT COUNT(*) FROM service_apps').fetchone()[0])
+
+    def test_expired(self):
+        cache = ResolverCache(':memory:', 60, 10)
+        cache.put('a', 'app-a')
+        cache.connection.execute('UPDATE service_apps SET fetched = fetched - 61')
+        self.assertIsNone(cache.get('a'))
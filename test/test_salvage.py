@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import time
+import unittest
+
+from log_parser.salvage import salvage
+
+
+class SalvageTest(unittest.TestCase):
+
+    def test_truncated_string(self):
+        result = salvage('{"a": 1, "b": {"c": [1, 2], "d": "some long te')
+        self.assertDictEqual({'a': 1, 'b': {'c': [1, 2]}}, result.value)
+        self.assertEqual(', "d": "some long te', result.dropped)
+        self.assertEqual('}}', result.closed)
+
+    def test_truncated_key(self):
+        result = salvage('{"a": [true, {"b": null}], "c')
+        self.assertDictEqual({'a': [True, {'b': None}]}, result.value)
+        result = salvage('{"a": [true, {"b": null}], "c": ')
+        self.assertDictEqual({'a': [True, {'b': None}]}, result.value)
+
+    def test_truncated_number(self):
+        result = salvage('{"a": "x", "b": [1, 23')
+        self.assertDictEqual({'a': 'x', 'b': [1]}, result.value)
+
+    def test_open_containers_are_kept(self):
+        result = salvage('{"a": {"b": [{"c": {')
+        self.assertDictEqual({'a': {'b': [{'c': {}}]}}, result.value)
+
+    def test_escaped_quotes(self):
+        result = salvage('{"a": "x\\"}", "b\\\\": "y\\\\", "c": "{\\"')
+        self.assertDictEqual({'a': 'x"}', 'b\\': 'y\\'}, result.value)
+
+    def test_large_escaped_string(self):
+        # Embedded JSON with many escaped quotes, cut in the middle of the string
+        embedded = '{\\"key\\": \\"value\\", ' * 30000
+        text = '{"a": [1, {"b": "c"}], "data": "' + embedded
+        start = time.perf_counter()
+        result = salvage(text)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertDictEqual({'a': [1, {'b': 'c'}]}, result.value)
+        self.assertEqual('}', result.closed)
+
+    def test_garbage(self):
+        self.assertIsNone(salvage('not json'))
+        self.assertIsNone(salvage(''))
+        self.assertIsNone(salvage('{"a": 1}}'))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+
+from log_parser.config import SchedulerConfig
+from log_parser.models import LogParserFile
+from log_parser.scheduler import Scheduler
+
+
+def _names(files):
+    return [f.name for f in files]
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_oldest_first(self):
+        scheduler = Scheduler(SchedulerConfig({'max_in_flight': 2}), 1)
+        scheduler.add(LogParserFile('2018-03-06 09:00:00/a.json', None, 'bucket', 10))
+        scheduler.add(LogParserFile('2018-03-06 07:00:00/b.json', None, 'bucket', 1))
+        scheduler.add(LogParserFile('2018-03-06 08:00:00/c.json', None, 'bucket', 100))
+        self.assertEqual(['2018-03-06 07:00:00/b.json', '2018-03-06 08:00:00/c.json'], _names(scheduler.next_files()))
+        # The window is full
+        self.assertEqual([], scheduler.next_files())
+        # Files that are in flight aren't queued again
+        scheduler.add(LogParserFile('2018-03-06 07:00:00/b.json', None, 'bucket', 1))
+        scheduler.done('bucket', '2018-03-06 07:00:00/b.json')
+        self.assertEqual(['2018-03-06 09:00:00/a.json'], _names(scheduler.next_files()))
+        self.assertEqual(2, scheduler.in_flight_count)
+        self.assertFalse(scheduler.queued)
+
+    def test_largest_first_when_backfilling(self):
+        scheduler = Scheduler(SchedulerConfig({'backfill_threshold': 2}), 2)
+        for name, size in (('a', 1), ('b', 30), ('c', None), ('d', 20)):
+            scheduler.add(LogParserFile('2018-03-06 07:00:00/%s.json' % name, None, 'bucket', size))
+        self.assertTrue(scheduler.backfilling)
+        self.assertEqual(['2018-03-06 07:00:00/b.json', '2018-03-06 07:00:00/d.json', '2018-03-06 07:00:00/a.json',
+                          '2018-03-06 07:00:00/c.json'], _names(scheduler.next_files()))
+
+    def test_bucket_limit(self):
+        scheduler = Scheduler(SchedulerConfig({'max_in_flight': 3, 'bucket_limit': 1}), 1)
+        scheduler.add(LogParserFile('2018-03-06 07:00:00/a.json', None, 'first'))
+        scheduler.add(LogParserFile('2018-03-06 08:00:00/b.json', None, 'first'))
+        scheduler.add(LogParserFile('2018-03-06 09:00:00/c.json', None, 'second'))
+        self.assertEqual(['2018-03-06 07:00:00/a.json', '2018-03-06 09:00:00/c.json'], _names(scheduler.next_files()))
+        scheduler.done('first', '2018-03-06 07:00:00/a.json')
+        self.assertEqual(['2018-03-06 08:00:00/b.json'], _names(scheduler.next_files()))
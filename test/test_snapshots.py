@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from log_parser import snapshots
+from log_parser.bizz import process_lines
+from log_parser.config import SnapshotConfig
+from log_parser.line_protocol import from_epoch
+from log_parser.point import Point
+from log_parser.snapshots import SnapshotStore, filter_unchanged
+from test.fakes import FakeInfluxDBClient
+from test.test_parser import get_file_content
+
+HEARTBEAT = 3600 * 1000000
+
+
+def get_point(seconds: float, amount: int, app: str = 'be-loc') -> Point:
+    return Point('rogerthat.all_users', {'app': app}, from_epoch(seconds), {'amount': amount})
+
+
+def get_times(points):
+    return [point.time // 1000000 for point in points]
+
+
+class SnapshotStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SnapshotStore(os.path.join(self.directory, 'snapshots.sqlite'), 30 * 86400)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_changed(self):
+        self.assertEqual([0], get_times(self.store.changed([get_point(0, 1)], HEARTBEAT)))
+        self.assertEqual([], get_times(self.store.changed([get_point(600, 1)], HEARTBEAT)))
+        self.assertEqual([1200], get_times(self.store.changed([get_point(1200, 2)], HEARTBEAT)))
+        # The heartbeat is counted from the last point that was written
+        points = [get_point(seconds, 2) for seconds in range(1800, 7200, 600)] + [get_point(4800, 3, 'be-other')]
+        self.assertEqual([4800, 4800], get_times(self.store.changed(points, HEARTBEAT)))
+
+    def test_out_of_order(self):
+        self.assertEqual([0], get_times(self.store.changed([get_point(0, 5)], HEARTBEAT)))
+        # A later file that is processed first
+        self.assertEqual([], get_times(self.store.changed([get_point(1800, 5)], HEARTBEAT)))
+        # The point at 1800 doesn't repeat the one before it anymore
+        points = self.store.changed([get_point(1200, 7)], HEARTBEAT)
+        self.assertEqual([(1200, 7), (1800, 5)], [(time, point['fields']['amount'])
+                                                  for time, point in zip(get_times(points), points)])
+        self.assertEqual([600], get_times(self.store.changed([get_point(600, 7)], HEARTBEAT)))
+        self.assertEqual([], get_times(self.store.changed([get_point(900, 7), get_point(2400, 5)], HEARTBEAT)))
+
+    def test_processed_again(self):
+        self.store.changed([get_point(600, 1)], HEARTBEAT)
+        # The write of the first attempt might have failed
+        self.assertEqual([600], get_times(self.store.changed([get_point(600, 1)], HEARTBEAT)))
+        # An earlier point with the same fields makes it redundant
+        self.assertEqual([0], get_times(self.store.changed([get_point(0, 1), get_point(600, 1)], HEARTBEAT)))
+        self.assertEqual([], get_times(self.store.changed([get_point(1200, 1)], HEARTBEAT)))
+
+    def test_prune(self):
+        store = SnapshotStore(':memory:', 3600, prune_interval=1)
+        store.changed([get_point(0, 1)], HEARTBEAT)
+        store.changed([get_point(7200, 1)], HEARTBEAT)
+        self.assertEqual([(7200000000,)], store.connection.execute('SELECT time FROM snapshot_points').fetchall())
+        store.close()
+
+
+class FilterUnchangedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        snapshots.configure(SnapshotConfig({
+            'enabled': True,
+            'state_path': os.path.join(self.directory, 'snapshots.sqlite'),
+        }))
+
+    def tearDown(self):
+        snapshots.configure(SnapshotConfig({}))
+        shutil.rmtree(self.directory)
+
+    def test_filter_unchanged(self):
+        other = Point('rogerthat.callback_api', {}, from_epoch(0), {'value': 1})
+        points = [get_point(0, 1), other]
+        self.assertEqual([other, get_point(0, 1)], filter_unchanged(points))
+        self.assertEqual([other], filter_unchanged([get_point(60, 1), other]))
+        # Points that have to be written after all are added
+        self.assertEqual([other, get_point(30, 2), get_point(60, 1)], filter_unchanged([get_point(30, 2), other]))
+        snapshots.configure(SnapshotConfig({}))
+        self.assertEqual(1, len(filter_unchanged([get_point(120, 1)])))
+
+    def test_process_lines(self):
+        line = json.dumps(json.loads(get_file_content('total-users.json')))
+        lines = [line.replace('1522108800.0', str(1522108800 + hour * 3600)).encode('utf-8') + b'\n'
+                 for hour in range(48)]
+        client = FakeInfluxDBClient()
+        process_lines(client, lines, 'logs.json')
+        # Only the first snapshot and the one after a day
+        self.assertEqual(31 * 2, len([line for line in client.lines if line.startswith(b'rogerthat.all_users,')]))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+
+from log_parser import stats
+from log_parser.analyzer import analyze
+from log_parser.config import StatsConfig
+from log_parser.stats import DECODE, PARSE, WRITE, Stats
+from test.test_parser import get_file_content
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_flush(self):
+        process_stats = Stats(StatsConfig({}))
+        process_stats.record(WRITE, 0.5, 100, 2000)
+        process_stats.record(WRITE, 1.5, 300, 6000)
+        process_stats.record(PARSE, 0.1, 2, log_type='app')
+        process_stats.add_progress(10, 20, 1000)
+        process_stats.set_gauge('writer_queue', 1)
+        points = {(point['tags']['stage'], point['tags'].get('log_type')): point for point in process_stats.flush()}
+        self.assertEqual({('parse', 'app'), ('total', None), ('write', None)}, set(points))
+        self.assertEqual(process_stats.worker, points[('total', None)]['tags']['worker'])
+        write = points[('write', None)]
+        self.assertEqual('log_parser.stats', write.measurement)
+        self.assertEqual({'count': 2, 'seconds': 2.0, 'items': 400, 'bytes': 8000, 'average_latency': 1.0},
+                         write['fields'])
+        total = points[('total', None)]['fields']
+        self.assertEqual((10, 20, 1000, 1), (total['lines'], total['points'], total['bytes'], total['writer_queue']))
+        self.assertGreater(total['lines_per_second'], 0)
+        # Counters are reset
+        self.assertEqual([], process_stats.flush())
+
+    def test_disabled(self):
+        process_stats = Stats(StatsConfig({'enabled': False, 'interval': 0}))
+        process_stats.record(WRITE, 0.5, 100, 2000)
+        process_stats.add_progress(10, 20, 1000)
+        process_stats.set_gauge('writer_queue', 1)
+        self.assertEqual(({}, {}, 0, 0, 0), (process_stats.stages, process_stats.gauges, process_stats.lines,
+                                             process_stats.points, process_stats.bytes))
+        self.assertFalse(process_stats.due)
+        self.assertEqual([], process_stats.flush_lines())
+
+    def test_due(self):
+        process_stats = Stats(StatsConfig({'interval': 0}))
+        self.assertTrue(process_stats.due)
+        process_stats = Stats(StatsConfig({'interval': 60}))
+        self.assertFalse(process_stats.due)
+
+    def test_analyze(self):
+        stats.configure(StatsConfig({'measurement': 'test_stats'}))
+        process_stats = stats.get_stats()
+        process_stats.flush()
+        points = list(analyze(get_file_content('callback-api.json')))
+        self.assertEqual(1, process_stats.stages[(DECODE, '')].count)
+        self.assertEqual(len(points), process_stats.stages[(PARSE, 'callback_api')].items)
+        stats.configure(StatsConfig({}))
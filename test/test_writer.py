@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 GIG Technology NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# @@license_version:1.4@@
+import unittest
+
+from influxdb.exceptions import InfluxDBClientError
+
+from log_parser import stats
+from log_parser.config import InfluxConfig, StatsConfig
+from log_parser.stats import WRITE
+from log_parser.writer import BackgroundWriter, BatchController, save_statistic_entries
+from test.fakes import FakeInfluxDBClient
+
+
+class FailingClient(FakeInfluxDBClient):
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        raise ConnectionError('influxdb is down')
+
+
+class TimeoutClient(FakeInfluxDBClient):
+    """Times out on the first request"""
+
+    def request(self, *args, **kwargs):
+        if not self.requests:
+            self.requests += 1
+            raise InfluxDBClientError('timeout')
+        super().request(*args, **kwargs)
+
+
+class BackgroundWriterTest(unittest.TestCase):
+
+    def test_write(self):
+        client = FakeInfluxDBClient()
+        with BackgroundWriter(client) as writer:
+            for i in range(10):
+                writer.write([b'test value=%di' % i] * 3)
+        self.assertEqual(30, len(client.lines))
+        self.assertEqual(10, client.requests)
+
+    def test_error(self):
+        client = FailingClient()
+        with self.assertRaises(ConnectionError):
+            with BackgroundWriter(client) as writer:
+                for i in range(10):
+                    writer.write([b'test value=%di' % i])
+        # Batches after the failure are dropped
+        self.assertEqual(1, client.requests)
+
+    def test_timeout(self):
+        stats.configure(StatsConfig({'measurement': 'test_stats'}))
+        try:
+            client = TimeoutClient('timeout')
+            save_statistic_entries(client, [b'test value=%di' % i for i in range(600)])
+            self.assertEqual(600, len(client.lines))
+            # The retries are written in smaller batches, and recorded in the statistics
+            self.assertLess(1, client.requests - 1)
+            self.assertEqual((client.requests - 1, 600),
+                             (stats.get_stats().stages[(WRITE, '')].count, stats.get_stats().stages[(WRITE, '')].items))
+        finally:
+            stats.configure(StatsConfig({}))
+
+
+class BatchControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = BatchController(InfluxConfig({'batch_size': 500, 'min_batch_size': 100,
+                                                        'max_batch_size': 5000, 'target_latency': 1.0}))
+
+    def test_grow(self):
+        for _ in range(20):
+            self.controller.record_success(self.controller.size, self.controller.size * 0.0001)
+        self.assertEqual(5000, self.controller.size)
+
+    def test_shrink(self):
+        for _ in range(20):
+            self.controller.record_success(self.controller.size, self.controller.size * 0.004)
+        self.assertAlmostEqual(250, self.controller.size, delta=5)
+
+    def test_error(self):
+        self.controller.record_error()
+        self.assertEqual(250, self.controller.size)
+        self.controller.record_error()
+        self.controller.record_error()
+        self.assertEqual(100, self.controller.size)
+
+    def test_error_rate(self):
+        self.controller.record_error()
+        self.assertEqual(250, self.controller.size)
+        # Writes that take as long as the target don't grow the batches back right away
+        self.controller.record_success(250, 1.0)
+        self.assertLess(self.controller.size, 250)
+        for _ in range(30):
+            self.controller.record_success(self.controller.size, self.controller.size * 0.004)
+        self.assertAlmostEqual(250, self.controller.size, delta=5)